@@ -0,0 +1,164 @@
+import paramcache
+import glob
+import json
+import time
+import traceback
+import multiprocessing
+
+
+def expand_cards(patterns):
+    """
+    expand_cards turns a comma separated list of card files and/or glob
+    patterns into a sorted list of card files (duplicates removed)
+    """
+
+    cards = []
+    for pattern in patterns.split(','):
+        pattern = pattern.strip()
+        if pattern == '':
+            continue
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            #
+            # keep missing files so they are reported as failed jobs
+            matches = [pattern]
+        for card in matches:
+            if card not in cards:
+                cards.append(card)
+
+    return cards
+
+
+def detect_mode(inputDict):
+    """
+    detect_mode returns the job type of a card from the keys it holds
+    """
+
+    if 'nSamples' in inputDict:
+        return 'uncertainty'
+    elif 'nCycles' in inputDict:
+        return 'cycle'
+    elif 'mhydrideFloatName' in inputDict:
+        return 'mhrfc'
+    elif 'tHiStart' in inputDict:
+        return 'screening'
+    elif 'libraryDir' in inputDict:
+        return 'grid'
+    elif 'simTime' in inputDict:
+        return 'simulation'
+    elif 'dataFiles' in inputDict:
+        return 'fit'
+    else:
+        return 'chart'
+
+
+def run_job(job):
+    """
+    run_job runs one card and returns its manifest entry.  any error (a bad
+    card, a missing .mhd file, a missing key) is caught and recorded so one
+    failing card does not stop the batch.  this is the unit of work handed
+    to the process pool
+    """
+
+    import metalhydride
+    import bedsim
+    import cyclesim
+    import fitting
+    import montecarlo
+    import gridengine
+
+    cardFile, mode = job
+    entry = {'card' : cardFile, 'mode' : mode, 'status' : 'ok', 'seconds' : 0.0, 'outputs' : [], 'error' : None}
+
+    startTime = time.time()
+    try:
+        #
+        # each job gets its own copy of the card, charts are never shown
+        # and the job runs inside its worker (no nested process pools)
+        inputDict = dict(paramcache.get_params(cardFile))
+        inputDict['showChart'] = 'False'
+        inputDict['nProcs'] = 1
+        if mode is None:
+            mode = detect_mode(inputDict)
+        entry['mode'] = mode
+
+        if mode == 'chart':
+            outputs = metalhydride.generate_chart_data(inputDict)
+        elif mode == 'mhrfc':
+            outputs = metalhydride.generate_mhrfc_cycle_data(inputDict)
+        elif mode == 'screening':
+            outputs = metalhydride.generate_pair_screening(inputDict)
+        elif mode == 'simulation':
+            outputs = bedsim.run_simulation(inputDict)
+        elif mode == 'fit':
+            outputs = fitting.run_fit(inputDict)
+        elif mode == 'cycle':
+            outputs = cyclesim.run_cycle_simulation(inputDict)
+        elif mode == 'uncertainty':
+            outputs = montecarlo.run_uncertainty(inputDict)
+        elif mode == 'grid':
+            outputs = gridengine.run_grid(inputDict)
+        else:
+            raise ValueError('Unknown batch mode ' + str(mode))
+
+        entry['outputs'] = list(outputs)
+
+    except Exception as e:
+        entry['status'] = 'failed'
+        entry['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        entry['traceback'] = traceback.format_exc()
+
+    entry['seconds'] = time.time() - startTime
+
+    return entry
+
+
+def run_batch(cards, mode = None, nProcs = 1, manifestFile = 'batch-manifest.json'):
+    """
+    run_batch runs every card on a pool of nProcs worker processes and
+    writes a JSON manifest of the outputs, timings and failures
+
+    Input:
+        list    cards           card file names
+        str     mode            chart, mhrfc, screening, simulation, fit, cycle,
+                                uncertainty or grid, None
+                                detects the mode from each card
+        int     nProcs          number of worker processes
+        str     manifestFile    manifest file name
+
+    """
+
+    startTime = time.time()
+    jobs = [(card, mode) for card in cards]
+
+    if nProcs > 1:
+        #
+        # workers are reused between jobs so the interpreter start up,
+        # imports and parsed .mhd files are paid once per worker
+        pool = multiprocessing.Pool(nProcs)
+        try:
+            entries = pool.map(run_job, jobs, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        entries = [run_job(job) for job in jobs]
+
+    failed = [entry for entry in entries if entry['status'] != 'ok']
+
+    manifest = {'cards' : len(entries),
+                'failed' : len(failed),
+                'nProcs' : nProcs,
+                'seconds' : time.time() - startTime,
+                'jobs' : entries}
+
+    f = open(manifestFile,'w+')
+    json.dump(manifest, f, indent = 2)
+    f.close()
+
+    for entry in failed:
+        print ('Card ' + entry['card'] + ' failed: ' + entry['error'])
+
+    print ('{0} cards, {1} failed, {2:.2f} s, manifest written to {3}'.format(len(entries), len(failed), manifest['seconds'], manifestFile))
+
+    return manifest
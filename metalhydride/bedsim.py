@@ -0,0 +1,296 @@
+import mhydride
+import units
+import math
+import numpy as np
+
+#
+# molecular weight of hydrogen [kg/mol]
+MW_H2 = 2.016e-3
+
+
+def solve_tridiagonal(lower, diag, upper, rhs):
+    """
+    solve_tridiagonal will solve a tridiagonal system by cyclic reduction
+    (no pivoting, the conduction matrix is diagonally dominant).  each
+    reduction level eliminates every other unknown in one numpy sweep over
+    all cells, so the system is solved in log2(n) vectorized levels instead
+    of a sequential loop over the cells
+
+    the arrays may carry trailing dimensions (n, ...), every column is an
+    independent system and all of them are swept together
+
+    Input:
+        array   lower       sub diagonal, lower[i] multiplies x[i-1] (lower[0] unused)
+        array   diag        main diagonal
+        array   upper       super diagonal, upper[i] multiplies x[i+1] (upper[-1] unused)
+        array   rhs         right hand side
+
+    """
+
+    diag = np.asarray(diag, dtype = float)
+    n = diag.shape[0]
+
+    #
+    # a ghost row (x = 0) at each end so every row has two neighbours
+    shape = (n + 2,) + diag.shape[1:]
+    a = np.zeros(shape)
+    b = np.ones(shape)
+    c = np.zeros(shape)
+    d = np.zeros(shape)
+    a[2:-1] = np.asarray(lower, dtype = float)[1:]
+    b[1:-1] = diag
+    c[1:-2] = np.asarray(upper, dtype = float)[:-1]
+    d[1:-1] = rhs
+
+    return _cyclic_reduction(a, b, c, d)[1:-1]
+
+
+def _cyclic_reduction(a, b, c, d):
+    #
+    # a, b, c, d hold the rows 1..n between the two ghost rows, returns x
+    # with the ghost rows (0)
+    n = b.shape[0] - 2
+    x = np.zeros(d.shape)
+    if n == 1:
+        x[1] = d[1]/b[1]
+        return x
+
+    #
+    # eliminate the neighbours of the rows 1, 3, 5, ..., the ghost rows
+    # never couple in as a[1] = c[n] = 0
+    keep = slice(1, n + 1, 2)
+    left = slice(0, n, 2)
+    right = slice(2, n + 2, 2)
+    alpha = -a[keep]/b[left]
+    gamma = -c[keep]/b[right]
+
+    shape = (alpha.shape[0] + 2,) + b.shape[1:]
+    aReduced = np.zeros(shape)
+    bReduced = np.ones(shape)
+    cReduced = np.zeros(shape)
+    dReduced = np.zeros(shape)
+    aReduced[1:-1] = alpha*a[left]
+    bReduced[1:-1] = b[keep] + alpha*c[left] + gamma*a[right]
+    cReduced[1:-1] = gamma*c[right]
+    dReduced[1:-1] = d[keep] + alpha*d[left] + gamma*d[right]
+
+    x[keep] = _cyclic_reduction(aReduced, bReduced, cReduced, dReduced)[1:-1]
+
+    #
+    # back substitute the eliminated rows from their solved neighbours
+    back = slice(2, n + 1, 2)
+    x[back] = (d[back] - a[back]*x[1:n:2] - c[back]*x[3:n + 2:2])/b[back]
+
+    return x
+
+
+class HydrideBed(object):
+    """
+    This class is a transient 1D finite volume model of a metal hydride bed
+    held at a uniform hydrogen supply pressure.  the bed is either a
+    cylinder (radial, wall at r = bedSize) or a slab (axial, insulated at
+    x = 0 and wall at x = bedSize)
+
+    each time step the reaction rate is evaluated for all cells at once
+    with MetalHydride.calc_rdot_array, the heat of reaction becomes a source
+    and the heat conduction is advanced implicitly with a tridiagonal solve
+
+    Members:
+        mh          MetalHydride with the bed material, temperatures in k
+        nCells      number of cells
+        omega       cell omega values
+        t           cell temperatures [k]
+        time        simulated time [s]
+        pSupply     hydrogen supply pressure in the MetalHydride pressure units
+        tWall       wall (coolant) temperature [k]
+        hWall       wall heat transfer coefficient [W/m2-K], <= 0 is adiabatic
+
+    Member Functions:
+        step        advances the bed by one time step
+        mean_omega  volume averaged omega
+        mean_t      volume averaged temperature [k]
+
+    """
+
+    def __init__(self, mh, geometry, bedSize, nCells, omegaInit, tInit, pSupply, tWall, hWall):
+        self.mh = mh
+        self.nCells = nCells
+        self.omega = np.full(nCells, float(omegaInit))
+        self.t = np.full(nCells, float(tInit))
+        self.time = 0.0
+        self.pSupply = pSupply
+        self.tWall = tWall
+        self.hWall = hWall
+
+        rho = mh.paramDict['rho']
+        voidf = mh.paramDict['voidf']
+        kcond = mh.paramDict['kcond']
+
+        #
+        # solid mass per unit bed volume [kg/m3] and hydrogen held at
+        # omega = 1 per unit bed volume [mol/m3] (h2cap is in wt%)
+        self.solidDensity = rho*(1.0 - voidf)
+        self.nMax = self.solidDensity*mh.paramDict['h2cap']/100.0/MW_H2
+        self.cpAlpha = mh.paramDict['cpAlpha']
+        self.cpBeta = mh.paramDict['cpBeta']
+        self.delH = mh.paramDict['delH']
+
+        #
+        # cell volumes and face areas (per unit length for radial, per
+        # unit area for axial), faces run from 0 to nCells
+        dx = bedSize/nCells
+        faces = dx*np.arange(nCells + 1)
+        if geometry == 'radial':
+            self.volume = math.pi*(faces[1:]**2 - faces[:-1]**2)
+            area = 2.0*math.pi*faces
+        else:
+            self.volume = np.full(nCells, dx)
+            area = np.ones(nCells + 1)
+
+        #
+        # conductance between neighbouring cells and from the last cell
+        # centre through the wall film to the coolant
+        self.conductance = kcond*area[1:-1]/dx
+        if hWall > 0.0:
+            self.wallConductance = 1.0/(1.0/(hWall*area[-1]) + 0.5*dx/(kcond*area[-1]))
+        else:
+            self.wallConductance = 0.0
+
+        return
+
+    def step(self, dt):
+        """
+        step advances the bed by dt seconds and returns the heat removed
+        through the wall over the step [J per unit length/area]
+        """
+
+        #
+        # reaction, all cells at once (rdot is positive for desorption)
+        rdot = self.mh.calc_rdot_array(self.omega, self.t, self.pSupply)
+        omegaNew = np.clip(self.omega - rdot*dt, 0.0, 1.0)
+        source = -self.delH*self.nMax*(omegaNew - self.omega)/dt
+        self.omega = omegaNew
+
+        #
+        # implicit conduction with the reaction heat as a source
+        heatCap = self.solidDensity*(self.cpAlpha + self.omega*(self.cpBeta - self.cpAlpha))*self.volume/dt
+
+        lower = np.zeros(self.nCells)
+        upper = np.zeros(self.nCells)
+        lower[1:] = -self.conductance
+        upper[:-1] = -self.conductance
+        diag = heatCap.copy()
+        diag[1:] = diag[1:] + self.conductance
+        diag[:-1] = diag[:-1] + self.conductance
+        diag[-1] = diag[-1] + self.wallConductance
+
+        rhs = heatCap*self.t + source*self.volume
+        rhs[-1] = rhs[-1] + self.wallConductance*self.tWall
+
+        self.t = solve_tridiagonal(lower, diag, upper, rhs)
+        self.time = self.time + dt
+
+        return self.wallConductance*(self.t[-1] - self.tWall)*dt
+
+    def mean_omega(self):
+        return np.dot(self.omega, self.volume)/self.volume.sum()
+
+    def mean_t(self):
+        return np.dot(self.t, self.volume)/self.volume.sum()
+
+
+def run_simulation(inputDict):
+    """
+    run_simulation will run the transient bed model for a simulation input
+    card (-s), write the bed history and the final profiles and return the
+    names of the files written
+
+    card keys:
+        mhydrideName    metal hydride name
+        pUnits, tUnits  units of the pressure and temperature inputs/outputs
+        geometry        radial or axial
+        bedSize         bed radius or length [m]
+        nCells          number of cells
+        omegaInit       initial omega
+        tInit           initial bed temperature
+        pSupply         hydrogen supply pressure
+        tWall           wall (coolant) temperature
+        hWall           wall heat transfer coefficient [W/m2-K]
+        simTime         simulated time [s]
+        dt              time step [s]
+        outputInterval  time between history rows [s]
+        delimit         column delimiter (space, tab, csv)
+
+    """
+
+    mhName = inputDict['mhydrideName']
+    pUnits = inputDict['pUnits']
+    tUnits = inputDict['tUnits']
+    geometry = inputDict.get('geometry', 'radial')
+    bedSize = inputDict['bedSize']
+    nCells = int(inputDict['nCells'])
+    omegaInit = inputDict['omegaInit']
+    tInit = inputDict['tInit']
+    pSupply = inputDict['pSupply']
+    tWall = inputDict['tWall']
+    hWall = inputDict['hWall']
+    simTime = inputDict['simTime']
+    dt = inputDict['dt']
+    outputInterval = inputDict.get('outputInterval', dt)
+    delimit = inputDict.get('delimit', 'space')
+
+    delimiter = ' '
+    if delimit == 'tab':
+        delimiter = "\t"
+    elif delimit == 'csv':
+        delimiter = ', '
+
+    #
+    # the bed works in kelvin, inputs and outputs are in the card units
+    toK = units.temperature_plan(tUnits,'k')
+    fromK = units.temperature_plan('k',tUnits)
+
+    mh = mhydride.MetalHydride()
+    mh.load_data(mhName)
+    mh.set_punits(pUnits)
+    mh.set_tunits('k')
+
+    bed = HydrideBed(mh, geometry, bedSize, nCells, omegaInit, units.apply_plan(toK, tInit),
+                     pSupply, units.apply_plan(toK, tWall), hWall)
+
+    nSteps = int(round(simTime/dt))
+    outputEvery = max(int(round(outputInterval/dt)), 1)
+
+    lines = []
+    rowFormat = '{0:6.3e}{1}{2:6.3e}{3}{4:6.3e}{5}{6:6.3e}{7}{8:6.3e}'
+    wallHeat = 0.0
+    lines.append(rowFormat.format(bed.time,delimiter,bed.mean_omega(),delimiter,units.apply_plan(fromK, bed.mean_t()),
+                                  delimiter,units.apply_plan(fromK, bed.t.max()),delimiter,wallHeat) + "\n")
+
+    for n in range(1, nSteps + 1):
+        wallHeat = wallHeat + bed.step(dt)
+        if n % outputEvery == 0 or n == nSteps:
+            lines.append(rowFormat.format(bed.time,delimiter,bed.mean_omega(),delimiter,units.apply_plan(fromK, bed.mean_t()),
+                                          delimiter,units.apply_plan(fromK, bed.t.max()),delimiter,wallHeat) + "\n")
+
+    outputFiles = []
+
+    #
+    # history: time, mean omega, mean T, max T, cumulative wall heat
+    outputFileName = mhName + "-sim-data.txt"
+    f = open(outputFileName,'w+')
+    f.write(''.join(lines))
+    f.close()
+    outputFiles.append(outputFileName)
+
+    #
+    # final profiles: cell centre, omega, T
+    centres = bedSize*(np.arange(nCells) + 0.5)/nCells
+    tProfile = units.apply_plan(fromK, bed.t)
+    outputFileName = mhName + "-sim-profile.txt"
+    f = open(outputFileName,'w+')
+    f.write(''.join([('{0:6.3e}{1}{2:6.3e}{3}{4:6.3e}').format(centres[i],delimiter,bed.omega[i],delimiter,tProfile[i]) + "\n" for i in range(nCells)]))
+    f.close()
+    outputFiles.append(outputFileName)
+
+    return outputFiles
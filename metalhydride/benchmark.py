@@ -0,0 +1,281 @@
+import mhydride
+import units
+import paramcache
+import metalhydride
+import sys
+import os
+import getopt
+import glob
+import json
+import time
+import shutil
+import platform
+import tempfile
+import numpy as np
+
+#
+# hydrides every benchmark is run on
+MATERIALS = ['hystor207', 'CaNi5', 'LaNi46Mn4']
+
+#
+# grid sizes for the end to end runs, (name, delOmega, delT, plot), from the
+# default 0.05 step up to about 10^6 points per material
+CHART_GRIDS = [('default', 0.05, 25.0, 'B'),
+               ('1e4', 0.002, 25.0, 'B'),
+               ('1e5', 0.001, 2.0, 'B'),
+               ('1e6', 0.0002, 2.0, 'B')]
+
+MHRFC_GRIDS = [('default', 0.05),
+               ('1e4', 0.0002),
+               ('1e6', 0.000002)]
+
+
+def best_time(func, repeat):
+    """
+    best_time returns the shortest wall time of repeat calls of func
+    """
+
+    best = None
+    for i in range(repeat):
+        startTime = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - startTime
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def bench_calc_peq(results, repeat, quick):
+    nCalls = 2000 if quick else 20000
+
+    for name in MATERIALS:
+        mh = mhydride.MetalHydride()
+        mh.load_data(name)
+        mh.set_punits('psia')
+        mh.set_tunits('degc')
+        omegaVals = np.linspace(0.01, 0.99, nCalls).tolist()
+
+        def scalar():
+            mh.set_t(25.0)
+            for omega in omegaVals:
+                mh.set_omega(omega)
+                mh.calc_peq()
+
+        seconds = best_time(scalar, repeat)
+        results['calc_peq_scalar-' + name] = {'seconds' : seconds, 'points' : nCalls}
+
+        omegaArray = np.linspace(0.01, 0.99, 1000)
+        tArray = np.linspace(25.0, 200.0, 100 if quick else 1000)[:,np.newaxis]
+        seconds = best_time(lambda: mh.calc_peq_array(omegaArray, tArray), repeat)
+        results['calc_peq_array-' + name] = {'seconds' : seconds, 'points' : omegaArray.size*tArray.size}
+
+    return
+
+
+def bench_load_data(results, repeat, quick):
+    nLoads = 20 if quick else 200
+
+    for name in MATERIALS:
+        def parse():
+            for i in range(nLoads):
+                paramcache.invalidate()
+                mh = mhydride.MetalHydride()
+                mh.load_data(name)
+
+        def cached():
+            for i in range(nLoads):
+                mh = mhydride.MetalHydride()
+                mh.load_data(name)
+
+        results['load_data_parse-' + name] = {'seconds' : best_time(parse, repeat), 'points' : nLoads}
+        results['load_data_cached-' + name] = {'seconds' : best_time(cached, repeat), 'points' : nLoads}
+
+    return
+
+
+def bench_units(results, repeat, quick):
+    nCalls = 2000 if quick else 20000
+    values = np.linspace(1.0, 100.0, nCalls).tolist()
+
+    def scalar_p():
+        for p in values:
+            units.convertP(p, 'atm', 'psia')
+
+    def scalar_t():
+        for t in values:
+            units.convertT(t, 'degc', 'k')
+
+    arrayValues = np.linspace(1.0, 100.0, 10**5 if quick else 10**6)
+
+    results['convertP_scalar'] = {'seconds' : best_time(scalar_p, repeat), 'points' : nCalls}
+    results['convertT_scalar'] = {'seconds' : best_time(scalar_t, repeat), 'points' : nCalls}
+    results['convertP_array'] = {'seconds' : best_time(lambda: units.convertP(arrayValues, 'atm', 'psia'), repeat), 'points' : arrayValues.size}
+    results['convertT_array'] = {'seconds' : best_time(lambda: units.convertT(arrayValues, 'degc', 'k'), repeat), 'points' : arrayValues.size}
+
+    return
+
+
+def bench_chart(results, repeat, quick):
+    grids = CHART_GRIDS[:2] if quick else CHART_GRIDS
+
+    for name in MATERIALS:
+        for gridName, delOmega, delT, plot in grids:
+            for outputFile in ('single', 'multiple', 'binary'):
+                inputDict = {'mhydrideName' : name, 'pUnits' : 'psia', 'tUnits' : 'degc',
+                             'omegaStart' : 0.05, 'omegaEnd' : 0.95, 'delOmega' : delOmega,
+                             'tStart' : 25.0, 'tEnd' : 200.0, 'delT' : delT, 'plot' : plot,
+                             'outputFile' : outputFile, 'showChart' : 'False', 'delimit' : 'tab'}
+                points = (len(metalhydride.make_axis(0.05, 0.95, delOmega))*len(metalhydride.make_axis(25.0, 200.0, delT))
+                          *len(metalhydride.branch_list(plot)))
+
+                #
+                # one file per isotherm is only timed on the smaller grids
+                if outputFile == 'multiple' and points > 10**5:
+                    continue
+
+                seconds = best_time(lambda: metalhydride.generate_chart_data(inputDict), repeat)
+                results['chart-' + gridName + '-' + outputFile + '-' + name] = {'seconds' : seconds, 'points' : points}
+
+    return
+
+
+def bench_mhrfc(results, repeat, quick):
+    grids = MHRFC_GRIDS[:2] if quick else MHRFC_GRIDS
+
+    for gridName, delOmega in grids:
+        for outputFile in ('single', 'binary'):
+            inputDict = {'mhydrideFloatName' : 'LaNi46Mn4', 'mhydrideFixedName' : 'hystor207',
+                         'pUnits' : 'psia', 'tUnits' : 'degc', 'omegaStart' : 0.05, 'omegaEnd' : 0.85,
+                         'delOmega' : delOmega, 'tHi' : 70.0, 'tLow' : 25.0, 'outputFile' : outputFile,
+                         'showChart' : 'False', 'delimit' : 'tab'}
+            points = 4*len(metalhydride.make_axis(0.05, 0.85, delOmega))
+            seconds = best_time(lambda: metalhydride.generate_mhrfc_cycle_data(inputDict), repeat)
+            results['mhrfc-' + gridName + '-' + outputFile] = {'seconds' : seconds, 'points' : points}
+
+    return
+
+
+def run_benchmarks(repeat = 3, quick = False):
+    """
+    run_benchmarks runs every benchmark in a scratch directory (the .mhd
+    files are copied next to the outputs) and returns the results document
+    """
+
+    sourceDir = os.path.dirname(os.path.abspath(__file__))
+    workDir = tempfile.mkdtemp(prefix = 'mhbench-')
+    for f in glob.glob(os.path.join(sourceDir, '*.mhd')):
+        shutil.copy(f, workDir)
+
+    cwd = os.getcwd()
+    os.chdir(workDir)
+    results = {}
+    try:
+        bench_calc_peq(results, repeat, quick)
+        bench_load_data(results, repeat, quick)
+        bench_units(results, repeat, quick)
+        bench_chart(results, repeat, quick)
+        bench_mhrfc(results, repeat, quick)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workDir, ignore_errors = True)
+
+    for name in results:
+        results[name]['rate'] = results[name]['points']/results[name]['seconds']
+
+    return {'meta' : {'python' : platform.python_version(),
+                      'numpy' : np.__version__,
+                      'platform' : platform.platform(),
+                      'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                      'repeat' : repeat,
+                      'quick' : quick},
+            'results' : results}
+
+
+def compare(document, baseline, tolerance):
+    """
+    compare checks each benchmark against the baseline and returns the
+    list of (name, ratio) pairs that are more than tolerance slower
+    """
+
+    regressions = []
+    for name in sorted(document['results']):
+        if name not in baseline['results']:
+            continue
+        ratio = document['results'][name]['seconds']/baseline['results'][name]['seconds']
+        document['results'][name]['baselineRatio'] = ratio
+        if ratio > 1.0 + tolerance:
+            regressions.append((name, ratio))
+
+    return regressions
+
+
+def main():
+    """
+    benchmark suite for the equilibrium and cycle paths
+
+    arguments:
+        -o [filename]   :   write the results (JSON) to filename
+        -b [filename]   :   compare against a saved baseline, exit 1 on regressions
+        -t [fraction]   :   allowed slow down before a benchmark is a regression, default 0.25
+        -n [repeat]     :   number of repeats (the best time is kept), default 3
+        -q              :   quick run (smaller sizes, no 10^6 point grids)
+
+    """
+
+    outputFile = 'benchmark-results.json'
+    baselineFile = ''
+    tolerance = 0.25
+    repeat = 3
+    quick = False
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "o:b:t:n:q")
+    except getopt.error as msg:
+        print (msg)
+        sys.exit(2)
+
+    for o, arg in opts:
+        if o == "-o":
+            outputFile = arg
+        if o == "-b":
+            baselineFile = arg
+        if o == "-t":
+            tolerance = float(arg)
+        if o == "-n":
+            repeat = int(arg)
+        if o == "-q":
+            quick = True
+
+    document = run_benchmarks(repeat, quick)
+
+    regressions = []
+    if baselineFile != '':
+        f = open(baselineFile,'r')
+        baseline = json.load(f)
+        f.close()
+        regressions = compare(document, baseline, tolerance)
+        document['regressions'] = [name for name, ratio in regressions]
+
+    f = open(outputFile,'w+')
+    json.dump(document, f, indent = 2, sort_keys = True)
+    f.close()
+
+    for name in sorted(document['results']):
+        result = document['results'][name]
+        line = '{0:45s} {1:10.4f} s {2:12.4g} points/s'.format(name, result['seconds'], result['rate'])
+        if 'baselineRatio' in result:
+            line = line + ' {0:6.2f}x baseline'.format(result['baselineRatio'])
+        print (line)
+
+    for name, ratio in regressions:
+        print ('REGRESSION ' + name + ' {0:.2f}x slower than baseline'.format(ratio))
+
+    if len(regressions) > 0:
+        sys.exit(1)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import json
+import hashlib
+
+
+#
+# incremental regeneration
+#
+# the build cache manifest records, for every output file, the key of the
+# inputs it was generated from and the size, modification time and content
+# hash of the file as written.  a key is the hash of the generator version,
+# the card values that shape the file and the content hashes of the .mhd
+# files it reads, so an output is current when its key is unchanged and the
+# file on disk is the one that was written.  isotherm files are keyed one by
+# one, extending tStart/tEnd/delT only adds new keys
+
+#
+# bump when the content of the generated files changes
+GENERATOR_VERSION = 1
+
+MANIFEST_FILE = 'mh-build-cache.json'
+
+
+def file_hash(fileName):
+    """
+    file_hash returns the sha256 hex digest of the contents of fileName
+    """
+
+    digest = hashlib.sha256()
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+    """
+    This class is the build cache manifest of one output directory
+
+    Members:
+        manifestFile    manifest file name
+        entries         dictionary output file -> {key, size, mtime, hash}
+        hashes          content hashes of input files, (path, size, mtime) -> hash
+
+    Member Functions:
+        input_hash      content hash of an input file (.mhd, card)
+        key             key of a set of inputs
+        is_current      True if an output file was generated from a key and is unchanged
+        record          records an output file written from a key
+        save            writes the manifest
+
+    """
+
+    def __init__(self, manifestFile = MANIFEST_FILE):
+        self.manifestFile = manifestFile
+        self.entries = {}
+        self.hashes = {}
+
+        if os.path.exists(manifestFile):
+            try:
+                with open(manifestFile, 'r') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == GENERATOR_VERSION:
+                    self.entries = manifest.get('outputs', {})
+            except (ValueError, OSError):
+                self.entries = {}
+
+        return
+
+    def input_hash(self, fileName):
+        stat = os.stat(fileName)
+        stamp = (os.path.abspath(fileName), stat.st_size, stat.st_mtime_ns)
+        digest = self.hashes.get(stamp)
+        if digest is None:
+            digest = file_hash(fileName)
+            self.hashes[stamp] = digest
+
+        return digest
+
+    def key(self, *parts):
+        """
+        key returns the hash of the generator version and parts (json
+        serializable card values and input hashes)
+        """
+
+        text = json.dumps([GENERATOR_VERSION] + list(parts), sort_keys = True, default = float)
+
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def is_current(self, fileName, key):
+        entry = self.entries.get(fileName)
+        if entry is None or entry['key'] != key or not os.path.exists(fileName):
+            return False
+
+        stat = os.stat(fileName)
+        if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime']:
+            return True
+
+        #
+        # touched but maybe not changed
+        return stat.st_size == entry['size'] and file_hash(fileName) == entry['hash']
+
+    def record(self, fileName, key):
+        stat = os.stat(fileName)
+        self.entries[fileName] = {'key' : key, 'size' : stat.st_size, 'mtime' : stat.st_mtime_ns, 'hash' : file_hash(fileName)}
+
+        return
+
+    def save(self):
+        f = open(self.manifestFile,'w+')
+        json.dump({'version' : GENERATOR_VERSION, 'outputs' : self.entries}, f, indent = 2, sort_keys = True)
+        f.close()
+
+        return
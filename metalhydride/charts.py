@@ -0,0 +1,128 @@
+import os
+
+
+#
+# chart rendering
+#
+# matplotlib is only imported when a chart is actually drawn, runs that
+# only compute and write data never load it.  charts are either shown
+# interactively (showChart = True) or rendered straight to a file with the
+# non-interactive Agg backend (chartFormat = png or svg), or both
+#
+# every line is labelled with its temperature, branch and units
+
+CHART_FORMATS = ('png', 'svg')
+
+#
+# legends with more lines than this are left off, they would cover the chart
+MAX_LEGEND_LINES = 24
+
+BRANCH_NAMES = {'A' : 'absorption', 'D' : 'desorption'}
+
+
+def get_pyplot(interactive):
+    """
+    get_pyplot imports and returns matplotlib.pyplot, when interactive is
+    False the Agg backend is selected so no display is needed
+    """
+
+    import matplotlib
+    if not interactive:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def chart_format(inputDict):
+    """
+    chart_format returns the chartFormat card option (png or svg) or None
+    if no chart file is requested
+    """
+
+    chartFormat = inputDict.get('chartFormat', 'none').lower()
+    if chartFormat in CHART_FORMATS:
+        return chartFormat
+    elif chartFormat != 'none':
+        raise ValueError('Unknown chartFormat ' + chartFormat + ', use png, svg or none')
+
+    return None
+
+
+class Chart(object):
+    """
+    This class is one equilibrium pressure chart, lines are added as they
+    are generated (one block of isotherms at a time when streaming) and the
+    chart is saved and/or shown by finish
+
+    Members:
+        title       chart title
+        pUnits      pressure units of the y axis
+        tUnits      temperature units used in the line labels
+        logPlot     log scale pressure axis
+        interactive True if the chart will be shown on screen
+        nLines      number of lines drawn
+
+    Member Functions:
+        add_line    draws one pressure series
+        add_block   draws a (nT, nBranch, nOmega) block of isotherms
+        finish      saves the chart to a file and/or shows it, returns the file names
+
+    """
+
+    def __init__(self, title, tUnits, pUnits, logPlot = False, interactive = False):
+        self.title = title
+        self.tUnits = tUnits
+        self.pUnits = pUnits
+        self.logPlot = logPlot
+        self.interactive = interactive
+        self.nLines = 0
+
+        self.plt = get_pyplot(interactive)
+        self.figure = self.plt.figure()
+        self.axes = self.figure.add_subplot(1, 1, 1)
+
+        return
+
+    def add_line(self, omega, peq, temperature, branch, material = None):
+        label = 'T = ' + str(temperature) + ' ' + self.tUnits + ', ' + BRANCH_NAMES.get(branch, branch)
+        if material is not None:
+            label = material + ', ' + label
+
+        self.axes.plot(omega, peq, label = label)
+        self.nLines = self.nLines + 1
+
+        return
+
+    def add_block(self, temperatures, branches, omega, peq):
+        for i in range(len(temperatures)):
+            for j in range(len(branches)):
+                self.add_line(omega, peq[i,j], temperatures[i], branches[j])
+
+        return
+
+    def finish(self, fileName = None):
+        """
+        finish labels the axes, writes the chart to fileName (if given) and
+        shows it when interactive, returns the list of files written
+        """
+
+        self.axes.set_title(self.title)
+        self.axes.set_xlabel('omega [-]')
+        self.axes.set_ylabel('Pressure [' + self.pUnits + ']')
+        if self.logPlot:
+            self.axes.set_yscale('log')
+        if 0 < self.nLines <= MAX_LEGEND_LINES:
+            self.axes.legend(fontsize = 'small')
+
+        outputFiles = []
+        if fileName is not None:
+            self.figure.savefig(fileName, format = os.path.splitext(fileName)[1][1:])
+            outputFiles.append(fileName)
+
+        if self.interactive:
+            self.plt.show()
+
+        self.plt.close(self.figure)
+
+        return outputFiles
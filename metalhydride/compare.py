@@ -0,0 +1,191 @@
+import mhydride
+import mhio
+import sys
+import os
+import glob
+import getopt
+import numpy as np
+
+#
+# the stored files are written with 3 decimals ('6.3f') or 4 significant
+# digits ('6.3e'), a regenerated value agrees if it is within either
+# rounding of the stored value
+ABS_TOLERANCE = 5.0e-4
+REL_TOLERANCE = 5.0e-4
+
+
+def file_materials(fileName, nSeries):
+    """
+    file_materials returns the metal hydride name of each series of a data
+    file from the file name
+
+        name-T-....txt              one isotherm of name (multiple files)
+        float-fixed-mhrfc-data.txt  the four MHRFC series (float D at tHi,
+                                    float A, fixed A and fixed D at tLow)
+        name-data.txt               isotherms of name (single file)
+
+    """
+
+    baseName = os.path.basename(fileName)
+    match = mhio.FILE_NAME_TAGS.search(baseName)
+    if match is not None:
+        return [baseName[:match.start()]]*nSeries
+
+    if baseName.endswith('-mhrfc-data.txt'):
+        names = baseName[:-len('-mhrfc-data.txt')].split('-')
+        if len(names) != 2 or nSeries != 4:
+            raise ValueError('Cannot tell the float and fixed hydrides of ' + fileName)
+        return [names[0], names[0], names[1], names[1]]
+
+    if baseName.endswith('-data.txt'):
+        return [baseName[:-len('-data.txt')]]*nSeries
+
+    raise ValueError('Cannot tell the metal hydride of ' + fileName)
+
+
+def compare_file(fileName, pUnits, tUnits, plot = 'B', absTolerance = ABS_TOLERANCE, relTolerance = REL_TOLERANCE):
+    """
+    compare_file will regenerate every series of a stored data file with
+    MetalHydride and return the deviations of the stored pressures
+
+    Input:
+        str     fileName        data file in any layout the tool writes
+        str     pUnits          pressure units, unless the file name carries them
+        str     tUnits          temperature units, unless the file name carries them
+        str     plot            branches of single files (A, D or B)
+        float   absTolerance    allowed absolute deviation
+        float   relTolerance    allowed relative deviation
+
+    Returns:
+        dict    file, series, points, maxAbs, maxRel, failed points, status
+
+    """
+
+    series = mhio.read_series(fileName, plot)
+    temperature, fileTUnits, filePUnits, branch = mhio.file_name_tags(fileName)
+    if fileTUnits is not None:
+        tUnits = fileTUnits
+    if filePUnits is not None:
+        pUnits = filePUnits
+
+    #
+    # the MHRFC single file holds its own branch order
+    if os.path.basename(fileName).endswith('-mhrfc-data.txt') and len(series) == 4 and branch is None:
+        series = [(series[k][0], ['D', 'A', 'A', 'D'][k], series[k][2], series[k][3]) for k in range(4)]
+
+    materials = file_materials(fileName, len(series))
+    libraryDir = os.path.dirname(fileName)
+
+    result = {'file' : fileName, 'series' : len(series), 'points' : 0, 'maxAbs' : 0.0, 'maxRel' : 0.0, 'failed' : 0}
+    hydrides = {}
+
+    for k in range(len(series)):
+        seriesT, seriesBranch, omega, stored = series[k]
+        mh = hydrides.get(materials[k])
+        if mh is None:
+            mh = mhydride.MetalHydride()
+            mh.load_data(os.path.join(libraryDir, materials[k]))
+            mh.set_punits(pUnits)
+            mh.set_tunits(tUnits)
+            hydrides[materials[k]] = mh
+
+        peq = mh.calc_peq_array(omega, seriesT, seriesBranch == 'A')
+        deviation = np.abs(stored - peq)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            relative = np.where(peq != 0.0, deviation/np.abs(peq), np.inf)
+
+        result['points'] = result['points'] + len(omega)
+        if len(omega) > 0:
+            result['maxAbs'] = max(result['maxAbs'], float(deviation.max()))
+            result['maxRel'] = max(result['maxRel'], float(relative.max()))
+        result['failed'] = result['failed'] + int(np.count_nonzero((deviation > absTolerance) & (relative > relTolerance)))
+
+    result['status'] = 'ok' if result['failed'] == 0 else 'failed'
+
+    return result
+
+
+def compare_files(fileNames, pUnits, tUnits, plot = 'B', absTolerance = ABS_TOLERANCE, relTolerance = REL_TOLERANCE):
+    """
+    compare_files runs compare_file on every file, files that cannot be
+    read or matched to a metal hydride are reported with status 'error'
+    """
+
+    results = []
+    for fileName in fileNames:
+        try:
+            results.append(compare_file(fileName, pUnits, tUnits, plot, absTolerance, relTolerance))
+        except (ValueError, KeyError, OSError) as e:
+            results.append({'file' : fileName, 'status' : 'error', 'error' : '{0}: {1}'.format(type(e).__name__, e)})
+
+    return results
+
+
+def main():
+    """
+    regression comparison of stored data files against MetalHydride
+
+    arguments:
+        -p [units]      :   pressure units of files whose name does not carry them, default psia
+        -t [units]      :   temperature units of files whose name does not carry them, default degc
+        -l [plot]       :   branches of single files (A, D or B), default B
+        -a [value]      :   allowed absolute deviation, default 5e-4
+        -r [value]      :   allowed relative deviation, default 5e-4
+        files           :   data files or glob patterns, default '*data.txt'
+
+    exits 1 if any file deviates or cannot be read
+    """
+
+    pUnits = 'psia'
+    tUnits = 'degc'
+    plot = 'B'
+    absTolerance = ABS_TOLERANCE
+    relTolerance = REL_TOLERANCE
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "p:t:l:a:r:")
+    except getopt.error as msg:
+        print (msg)
+        sys.exit(2)
+
+    for o, arg in opts:
+        if o == "-p":
+            pUnits = arg
+        if o == "-t":
+            tUnits = arg
+        if o == "-l":
+            plot = arg
+        if o == "-a":
+            absTolerance = float(arg)
+        if o == "-r":
+            relTolerance = float(arg)
+
+    if len(args) == 0:
+        args = ['*data.txt']
+
+    fileNames = []
+    for pattern in args:
+        fileNames = fileNames + [f for f in sorted(glob.glob(pattern)) if f not in fileNames]
+
+    results = compare_files(fileNames, pUnits, tUnits, plot, absTolerance, relTolerance)
+
+    bad = 0
+    for result in results:
+        if result['status'] == 'error':
+            print ('{0:50s} ERROR {1}'.format(result['file'], result['error']))
+        else:
+            print ('{0:50s} {1:6s} {2:3d} series {3:6d} points max abs {4:9.3e} max rel {5:9.3e}'.format(
+                result['file'], result['status'], result['series'], result['points'], result['maxAbs'], result['maxRel']))
+        if result['status'] != 'ok':
+            bad = bad + 1
+
+    print ('{0} files, {1} failed'.format(len(results), bad))
+
+    if bad > 0:
+        sys.exit(1)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+import mhydride
+import units
+import profiling
+import bedsim
+import math
+import numpy as np
+
+
+#
+# relative pressure step of the numerical d(rdot)/dp used by the linearly
+# implicit gas update
+DP_FRACTION = 1.0e-6
+
+
+class TwoBedCycle(object):
+    """
+    This class is a lumped transient model of the MHRFC cycle.  a float bed
+    and a fixed bed exchange hydrogen through one shared gas volume.  the
+    fixed bed is cooled to tLow, the float bed is heated to tHi for the
+    first half of each cycle and cooled to tLow for the second half
+
+        hot half    float desorbs at tHi, the fixed bed absorbs at tLow
+        cold half   the fixed bed desorbs at tLow, the float bed reabsorbs
+
+    each bed is one uniform (omega, T) state.  the reaction rates come
+    from MetalHydride.calc_rdot_array, the gas pressure is advanced
+    linearly implicit (the gas volume is usually far stiffer than the
+    beds), the omegas follow from the rates at the new pressure and the
+    bed temperatures are advanced implicitly against their heat sources
+
+    the work is the ideal isothermal expansion work of the hydrogen flows
+    across the pressure ratios between each bed equilibrium pressure and
+    the shared volume, i.e. what ideal expanders between the beds and the
+    volume would recover
+
+    Members:
+        mhFloat, mhFixed    MetalHydride of each bed, pressures in pa, temperatures in k
+        nMaxFloat, nMaxFixed    hydrogen held by each bed at omega = 1 [mol]
+        heatCapFloat, heatCapFixed  (cpAlpha, cpBeta) times bed mass [J/K]
+        uaFloat, uaFixed    bed to heat source conductance [W/K]
+        tHi, tLow, tGas     heat source and gas temperatures [k]
+        gasVolume           shared gas volume [m3]
+        halfPeriod          duration of each half cycle [s]
+        dt                  time step [s]
+        state               [omegaFloat, tFloat, omegaFixed, tFixed, p] at the start of the next cycle
+        inventory           total hydrogen [mol], conserved
+
+    Member Functions:
+        set_state       sets the cycle start state, the gas holds the rest of the inventory
+        run_cycle       runs one cycle and returns its metrics
+        state_error     scaled difference of two cycle start states
+        conserve        projects a state onto the hydrogen inventory
+
+    """
+
+    def __init__(self, mhFloat, mhFixed, massFloat, massFixed, uaFloat, uaFixed, gasVolume, tHi, tLow, tGas,
+                 halfPeriod, dt):
+        self.mhFloat = mhFloat
+        self.mhFixed = mhFixed
+        self.uaFloat = uaFloat
+        self.uaFixed = uaFixed
+        self.gasVolume = gasVolume
+        self.tHi = tHi
+        self.tLow = tLow
+        self.tGas = tGas
+        self.halfPeriod = halfPeriod
+        self.nSteps = max(int(round(halfPeriod/dt)), 1)
+        self.dt = halfPeriod/self.nSteps
+
+        #
+        # h2cap is in wt%
+        self.nMaxFloat = massFloat*mhFloat.paramDict['h2cap']/100.0/bedsim.MW_H2
+        self.nMaxFixed = massFixed*mhFixed.paramDict['h2cap']/100.0/bedsim.MW_H2
+        self.heatCapFloat = (massFloat*mhFloat.paramDict['cpAlpha'], massFloat*mhFloat.paramDict['cpBeta'])
+        self.heatCapFixed = (massFixed*mhFixed.paramDict['cpAlpha'], massFixed*mhFixed.paramDict['cpBeta'])
+        self.delHFloat = mhFloat.paramDict['delH']
+        self.delHFixed = mhFixed.paramDict['delH']
+
+        #
+        # gas moles per pa of pressure
+        self.gasCapacity = gasVolume/(mhydride.R_GAS*tGas)
+
+        self.state = None
+        self.inventory = 0.0
+
+        return
+
+    def set_state(self, omegaFloat, tFloat, omegaFixed, tFixed, p):
+        self.state = [float(omegaFloat), float(tFloat), float(omegaFixed), float(tFixed), float(p)]
+        self.inventory = self.nMaxFloat*omegaFloat + self.nMaxFixed*omegaFixed + self.gasCapacity*p
+
+        return
+
+    def conserve(self, state):
+        """
+        conserve returns state with omega and pressure limited to their
+        ranges and the fixed bed omega set so the hydrogen inventory is
+        unchanged (extrapolated states do not conserve it exactly)
+        """
+
+        omegaFloat = min(max(state[0], 0.0), 1.0)
+        p = max(state[4], 1.0e-12*max(self.state[4], 1.0))
+        omegaFixed = (self.inventory - self.nMaxFloat*omegaFloat - self.gasCapacity*p)/self.nMaxFixed
+        if omegaFixed < 0.0 or omegaFixed > 1.0:
+            omegaFixed = min(max(omegaFixed, 0.0), 1.0)
+            p = max((self.inventory - self.nMaxFloat*omegaFloat - self.nMaxFixed*omegaFixed)/self.gasCapacity, 0.0)
+
+        return [omegaFloat, state[1], omegaFixed, state[3], p]
+
+    def state_error(self, a, b):
+        """
+        state_error returns the largest scaled change between two cycle start
+        states: omega absolute, temperatures relative to tHi - tLow and the
+        pressure in ln(p)
+        """
+
+        tScale = max(self.tHi - self.tLow, 1.0)
+
+        return max(abs(a[0] - b[0]), abs(a[2] - b[2]), abs(a[1] - b[1])/tScale, abs(a[3] - b[3])/tScale,
+                   abs(math.log(max(a[4], 1.0e-30)/max(b[4], 1.0e-30))))
+
+    def run_cycle(self, history = None, outputEvery = 1):
+        """
+        run_cycle advances the beds over one cycle from self.state and
+        returns a dictionary of the cycle metrics
+
+            h2Moved     hydrogen absorbed by the fixed bed in the hot half [mol]
+            h2Returned  hydrogen reabsorbed by the float bed in the cold half [mol]
+            heatIn      heat taken from the tHi source [J]
+            heatOut     heat rejected to the tLow sink [J]
+            work        ideal expansion work of the flows [J]
+            efficiency  work/heatIn
+
+        with a history list every outputEvery-th step appends
+        (time, omegaFloat, tFloat, omegaFixed, tFixed, p)
+        """
+
+        omegaFloat, tFloat, omegaFixed, tFixed, p = self.state
+        nMaxFloat = self.nMaxFloat
+        nMaxFixed = self.nMaxFixed
+        dt = self.dt
+        rtGas = mhydride.R_GAS*self.tGas
+
+        h2Moved = 0.0
+        h2Returned = 0.0
+        heatIn = 0.0
+        heatOut = 0.0
+        work = 0.0
+
+        if history is not None:
+            history.append((0.0, omegaFloat, tFloat, omegaFixed, tFixed, p))
+
+        for n in range(2*self.nSteps):
+            hot = n < self.nSteps
+            if hot:
+                tSource = self.tHi
+            else:
+                tSource = self.tLow
+
+            #
+            # rates at p and p + dp for the numerical d(rdot)/dp, one call per bed
+            dp = DP_FRACTION*p
+            pressures = np.array([p, p + dp])
+            rFloat, rFloatUp = self.mhFloat.calc_rdot_array(omegaFloat, tFloat, pressures).tolist()
+            rFixed, rFixedUp = self.mhFixed.calc_rdot_array(omegaFixed, tFixed, pressures).tolist()
+            slopeFloat = (rFloatUp - rFloat)/dp
+            slopeFixed = (rFixedUp - rFixed)/dp
+
+            #
+            # linearly implicit gas pressure, the gas source decreases with p
+            source = nMaxFloat*rFloat + nMaxFixed*rFixed
+            slope = nMaxFloat*slopeFloat + nMaxFixed*slopeFixed
+            deltaP = dt*source/(self.gasCapacity - dt*slope)
+            pNew = max(p + deltaP, 0.1*p)
+
+            omegaFloatNew = min(max(omegaFloat - (rFloat + slopeFloat*(pNew - p))*dt, 0.0), 1.0)
+            omegaFixedNew = min(max(omegaFixed - (rFixed + slopeFixed*(pNew - p))*dt, 0.0), 1.0)
+
+            #
+            # the gas holds whatever the beds do not, hydrogen is conserved exactly
+            pNew = max((self.inventory - nMaxFloat*omegaFloatNew - nMaxFixed*omegaFixedNew)/self.gasCapacity, 1.0e-6*p)
+
+            #
+            # expansion work across each bed equilibrium pressure and the volume,
+            # desorbing beds are at their desorption branch, absorbing beds at absorption
+            dnFloat = nMaxFloat*(omegaFloatNew - omegaFloat)
+            dnFixed = nMaxFixed*(omegaFixedNew - omegaFixed)
+            if dnFloat != 0.0 or dnFixed != 0.0:
+                peq = np.array([self.mhFloat.calc_peq_array(omegaFloat, tFloat, dnFloat > 0.0),
+                                self.mhFixed.calc_peq_array(omegaFixed, tFixed, dnFixed > 0.0)])
+                lnRatio = np.abs(np.log(peq/pNew)).tolist()
+                work = work + rtGas*(abs(dnFloat)*lnRatio[0] + abs(dnFixed)*lnRatio[1])
+
+            if hot and dnFixed > 0.0:
+                h2Moved = h2Moved + dnFixed
+            if not hot and dnFloat > 0.0:
+                h2Returned = h2Returned + dnFloat
+
+            #
+            # implicit bed temperatures with the reaction heat (delH < 0 for an
+            # exothermic absorption) as a source
+            capFloat = self.heatCapFloat[0] + omegaFloatNew*(self.heatCapFloat[1] - self.heatCapFloat[0])
+            capFixed = self.heatCapFixed[0] + omegaFixedNew*(self.heatCapFixed[1] - self.heatCapFixed[0])
+            tFloat = (capFloat/dt*tFloat + self.uaFloat*tSource - self.delHFloat*dnFloat/dt)/(capFloat/dt + self.uaFloat)
+            tFixed = (capFixed/dt*tFixed + self.uaFixed*self.tLow - self.delHFixed*dnFixed/dt)/(capFixed/dt + self.uaFixed)
+
+            qFloat = self.uaFloat*(tSource - tFloat)*dt
+            qFixed = self.uaFixed*(self.tLow - tFixed)*dt
+            if hot:
+                heatIn = heatIn + qFloat
+                heatOut = heatOut - qFixed
+            else:
+                heatOut = heatOut - qFloat - qFixed
+
+            omegaFloat = omegaFloatNew
+            omegaFixed = omegaFixedNew
+            p = pNew
+
+            if history is not None and ((n + 1) % outputEvery == 0 or n == 2*self.nSteps - 1):
+                history.append(((n + 1)*dt, omegaFloat, tFloat, omegaFixed, tFixed, p))
+
+        if profiling.enabled:
+            profiling.count('cycle_steps', 2*self.nSteps)
+
+        self.state = [omegaFloat, tFloat, omegaFixed, tFixed, p]
+
+        return {'h2Moved' : h2Moved,
+                'h2Returned' : h2Returned,
+                'heatIn' : heatIn,
+                'heatOut' : heatOut,
+                'work' : work,
+                'efficiency' : work/heatIn if heatIn > 0.0 else 0.0}
+
+
+def aitken(s0, s1, s2):
+    """
+    aitken returns the componentwise aitken delta squared extrapolation of
+    three successive cycle start states.  components that are not
+    converging geometrically (ratio of successive changes outside (-1, 1))
+    or have already converged keep their latest value
+    """
+
+    extrapolated = list(s2)
+    for i in range(len(s2)):
+        d1 = s1[i] - s0[i]
+        d2 = s2[i] - s1[i]
+        if d1 == 0.0 or d2 == 0.0:
+            continue
+        ratio = d2/d1
+        if abs(ratio) < 1.0:
+            extrapolated[i] = s2[i] + d2*ratio/(1.0 - ratio)
+
+    return extrapolated
+
+
+def run_cycle_simulation(inputDict):
+    """
+    run_cycle_simulation will run the two bed MHRFC cycle for a cycle input
+    card (-y) until cyclic steady state or nCycles, streaming one row per
+    cycle to disk, write the time history of the last cycle and return the
+    names of the files written
+
+    the start state of successive cycles converges to the periodic state.
+    every accelerateEvery plain cycles the last three start states are
+    extrapolated (aitken delta squared) and the run continues from the
+    extrapolated state, projected back onto the hydrogen inventory.
+    cyclic steady state is reached when the start state changes less than
+    cssTolerance over one cycle
+
+    card keys:
+        mhydrideFloatName   float (heated) bed hydride
+        mhydrideFixedName   fixed (tLow) bed hydride
+        pUnits, tUnits      units of the pressure and temperature inputs/outputs
+        tHi, tLow           heat source and sink temperatures
+        tGas                gas volume temperature, default tLow
+        massFloat, massFixed    hydride mass of each bed [kg]
+        uaFloat, uaFixed    bed heat transfer conductance [W/K]
+        gasVolume           shared gas volume [m3]
+        omegaFloatInit, omegaFixedInit      initial omega of each bed
+        pInit               initial gas pressure
+        halfPeriod          duration of the hot and of the cold half cycle [s]
+        dt                  time step [s]
+        nCycles             maximum number of cycles
+        cssTolerance        cyclic steady state tolerance, default 1e-6
+        accelerate          True to extrapolate towards steady state, default True
+        accelerateEvery     plain cycles between extrapolations, at least 3, default 3
+        stopAtSteadyState   False to run all nCycles, default True
+        chunkCycles         cycles buffered between writes, default 100
+        outputInterval      time between rows of the last cycle history [s]
+        delimit             column delimiter (space, tab, csv)
+
+    """
+
+    mhFloatName = inputDict['mhydrideFloatName']
+    mhFixedName = inputDict['mhydrideFixedName']
+    pUnits = inputDict['pUnits']
+    tUnits = inputDict['tUnits']
+    halfPeriod = inputDict['halfPeriod']
+    dt = inputDict['dt']
+    nCycles = int(inputDict['nCycles'])
+    cssTolerance = inputDict.get('cssTolerance', 1.0e-6)
+    accelerate = inputDict.get('accelerate', 'True') == 'True'
+    accelerateEvery = int(inputDict.get('accelerateEvery', 3))
+    stopAtSteadyState = inputDict.get('stopAtSteadyState', 'True') == 'True'
+    chunkCycles = max(int(inputDict.get('chunkCycles', 100)), 1)
+    outputInterval = inputDict.get('outputInterval', dt)
+    delimit = inputDict.get('delimit', 'space')
+
+    delimiter = ' '
+    if delimit == 'tab':
+        delimiter = "\t"
+    elif delimit == 'csv':
+        delimiter = ', '
+
+    if accelerate and accelerateEvery < 3:
+        raise ValueError('accelerateEvery must be at least 3 plain cycles, got ' + str(accelerateEvery))
+
+    #
+    # the beds work in pa and kelvin, inputs and outputs are in the card units
+    toK = units.temperature_plan(tUnits,'k')
+    fromK = units.temperature_plan('k',tUnits)
+    toPa = units.pressure_plan(pUnits,'pa')
+    fromPa = units.pressure_plan('pa',pUnits)
+
+    tHi = units.apply_plan(toK, inputDict['tHi'])
+    tLow = units.apply_plan(toK, inputDict['tLow'])
+    tGas = units.apply_plan(toK, inputDict.get('tGas', inputDict['tLow']))
+
+    with profiling.stage('load'):
+        mhFloat = mhydride.MetalHydride()
+        mhFloat.load_data(mhFloatName)
+        mhFloat.set_punits('pa')
+        mhFloat.set_tunits('k')
+
+        mhFixed = mhydride.MetalHydride()
+        mhFixed.load_data(mhFixedName)
+        mhFixed.set_punits('pa')
+        mhFixed.set_tunits('k')
+
+    cycle = TwoBedCycle(mhFloat, mhFixed, inputDict['massFloat'], inputDict['massFixed'], inputDict['uaFloat'],
+                        inputDict['uaFixed'], inputDict['gasVolume'], tHi, tLow, tGas, halfPeriod, dt)
+    cycle.set_state(inputDict['omegaFloatInit'], tLow, inputDict['omegaFixedInit'], tLow,
+                    units.apply_plan(toPa, inputDict['pInit']))
+
+    outputFiles = []
+
+    #
+    # per cycle rows: cycle, extrapolated (1 if the cycle started from an
+    # extrapolated state), H2 moved [kg], H2 returned [kg], heat in [J],
+    # heat out [J], work [J], efficiency, carnot fraction, start state change,
+    # and the end state omegaFloat, T float, omegaFixed, T fixed, p
+    outputFileName = mhFloatName + "-" + mhFixedName + "-cycle-data.txt"
+    f = open(outputFileName,'w+')
+    outputFiles.append(outputFileName)
+
+    rowFormat = delimiter.join(['{0:d}', '{1:d}'] + ['{' + str(i) + ':6.3e}' for i in range(2, 15)]) + "\n"
+    carnot = 1.0 - tLow/tHi
+
+    lines = []
+    startStates = [list(cycle.state)]
+    plainCycles = 0
+    extrapolated = False
+    steadyState = False
+    error = float('inf')
+    metrics = {'efficiency' : 0.0}
+    count = 0
+
+    with profiling.stage('compute') as stage:
+        while count < nCycles:
+            count = count + 1
+            start = list(cycle.state)
+            metrics = cycle.run_cycle()
+            error = cycle.state_error(start, cycle.state)
+
+            end = cycle.state
+            lines.append(rowFormat.format(count, int(extrapolated), metrics['h2Moved']*bedsim.MW_H2, metrics['h2Returned']*bedsim.MW_H2,
+                                          metrics['heatIn'], metrics['heatOut'], metrics['work'], metrics['efficiency'],
+                                          metrics['efficiency']/carnot, error, end[0], units.apply_plan(fromK, end[1]),
+                                          end[2], units.apply_plan(fromK, end[3]), units.apply_plan(fromPa, end[4])))
+            if len(lines) >= chunkCycles:
+                f.write(''.join(lines))
+                lines = []
+
+            if error < cssTolerance:
+                steadyState = True
+                if stopAtSteadyState:
+                    break
+
+            #
+            # extrapolate from the last three start states after accelerateEvery
+            # plain (not extrapolated) cycles, startStates only keeps those three
+            extrapolated = False
+            plainCycles = plainCycles + 1
+            startStates = startStates[-2:] + [list(cycle.state)]
+            if accelerate and not steadyState and plainCycles >= accelerateEvery:
+                cycle.state = cycle.conserve(aitken(startStates[0], startStates[1], startStates[2]))
+                startStates = [list(cycle.state)]
+                plainCycles = 0
+                extrapolated = True
+                if profiling.enabled:
+                    profiling.count('cycle_extrapolations')
+        stage.add_points(count)
+
+    f.write(''.join(lines))
+    f.close()
+
+    #
+    # time history of one more cycle from the final state: time, omega float,
+    # T float, omega fixed, T fixed, p
+    history = []
+    outputEvery = max(int(round(outputInterval/cycle.dt)), 1)
+    with profiling.stage('compute'):
+        cycle.run_cycle(history, outputEvery)
+
+    outputFileName = mhFloatName + "-" + mhFixedName + "-cycle-history.txt"
+    f = open(outputFileName,'w+')
+    rowFormat = delimiter.join(['{' + str(i) + ':6.3e}' for i in range(6)]) + "\n"
+    f.write(''.join([rowFormat.format(row[0], row[1], units.apply_plan(fromK, row[2]), row[3], units.apply_plan(fromK, row[4]),
+                                      units.apply_plan(fromPa, row[5])) for row in history]))
+    f.close()
+    outputFiles.append(outputFileName)
+
+    if steadyState:
+        print ('{0}/{1}: cyclic steady state after {2} cycles, efficiency {3:.4e}'.format(mhFloatName, mhFixedName, count, metrics['efficiency']))
+    else:
+        print ('{0}/{1}: no cyclic steady state after {2} cycles (change {3:.3e})'.format(mhFloatName, mhFixedName, count, error))
+
+    return outputFiles
@@ -0,0 +1,337 @@
+import mhydride
+import mhio
+import units
+import paramcache
+import glob
+import multiprocessing
+import numpy as np
+
+
+#
+# choi and mills parameters found by the fit, in the order of the columns
+# of the design matrix
+FIT_KEYS = ['A', 'B', 'phi', 'phi0', 'beta']
+
+#
+# order the remaining parameters are written to the .mhd file
+MHD_KEYS = ['rho', 'cpAlpha', 'cpBeta', 'kcond', 'h2cap', 'voidf', 'MHMW', 'delH', 'Eact', 'dstar']
+
+
+def design_matrix(omega, tempK, absorb):
+    """
+    design_matrix will build the least squares system of the choi and mills
+    form, which is linear in its parameters
+
+    ln(peq) = A*(-1/t) + B + phi*tan + phi0*(+/-tan) + beta*(+/-1/2)
+
+    with tan = tan(pi*(omega - 0.5)), the tan and beta terms vanish for
+    omega <= 0 / omega >= 1 as in MetalHydride.calc_peq
+
+    Input:
+        array   omega       omega of each point
+        array   tempK       temperature of each point [k]
+        array   absorb      True for absorption points
+
+    Returns:
+        array   X           (nPoints, 5) design matrix, columns in FIT_KEYS order
+
+    """
+
+    sign = np.where(absorb, 1.0, -1.0)
+    inside = (omega > 0.0) & (omega < 1.0)
+    tanTerm = np.where(inside, np.tan(np.pi*(np.where(inside, omega, 0.5) - 0.5)), 0.0)
+
+    return np.column_stack((-1.0/tempK, np.ones(len(omega)), tanTerm, sign*tanTerm, np.where(inside, sign/2.0, 0.0)))
+
+
+def gather_points(dataFiles, tUnits, pUnits, plot = 'B'):
+    """
+    gather_points reads every data file and returns the measured points as
+    flat arrays (omega, tempK, absorb, lnP [atm], series id) plus the list of
+    (file, temperature, branch) series descriptions
+    """
+
+    toK = units.temperature_plan(tUnits,'k')
+    toAtm = units.pressure_plan(pUnits,'atm')
+
+    omega = []
+    tempK = []
+    absorb = []
+    lnP = []
+    seriesId = []
+    series = []
+
+    for fileName in dataFiles:
+        for temperature, branch, omegaVals, pVals in mhio.read_series(fileName, plot):
+            keep = pVals > 0.0
+            n = int(keep.sum())
+            omega.append(omegaVals[keep])
+            tempK.append(np.full(n, units.apply_plan(toK, temperature)))
+            absorb.append(np.full(n, branch == 'A'))
+            lnP.append(np.log(units.apply_plan(toAtm, pVals[keep])))
+            seriesId.append(np.full(n, len(series)))
+            series.append((fileName, temperature, branch))
+
+    if len(series) == 0:
+        raise ValueError('No data points to fit')
+
+    return (np.concatenate(omega), np.concatenate(tempK), np.concatenate(absorb),
+            np.concatenate(lnP), np.concatenate(seriesId), series)
+
+
+def fit_parameters(omega, tempK, absorb, lnP, fixed = None):
+    """
+    fit_parameters will find the choi and mills parameters by linear least
+    squares on ln(p).  parameters the data cannot determine are held at
+    their fixed values: phi0 and beta if only one branch was measured, A if
+    only one temperature was measured
+
+    Input:
+        array   omega, tempK, absorb, lnP   measured points (see gather_points)
+        dict    fixed       values of parameters held fixed, default 0 for phi0
+                            and beta, A has no default
+
+    Returns:
+        dict    params      the five parameters
+        list    fitted      names of the parameters found by the fit
+
+    """
+
+    if fixed is None:
+        fixed = {}
+
+    X = design_matrix(omega, tempK, absorb)
+
+    held = []
+    if absorb.all() or not absorb.any():
+        held = held + ['phi0', 'beta']
+    if np.ptp(1.0/tempK) == 0.0:
+        if 'A' not in fixed:
+            raise ValueError('A needs data at more than one temperature or a template value')
+        held = held + ['A']
+
+    params = {}
+    rhs = lnP.copy()
+    for key in held:
+        params[key] = fixed.get(key, 0.0)
+        rhs = rhs - params[key]*X[:,FIT_KEYS.index(key)]
+
+    fitted = [key for key in FIT_KEYS if key not in held]
+    columns = [FIT_KEYS.index(key) for key in fitted]
+
+    solution, residual, rank, singular = np.linalg.lstsq(X[:,columns], rhs, rcond = None)
+    if rank < len(columns):
+        raise ValueError('The data does not determine ' + ', '.join(fitted) + ' (rank ' + str(rank) + ')')
+
+    for k in range(len(fitted)):
+        params[fitted[k]] = float(solution[k])
+
+    return params, fitted
+
+
+def residual_statistics(lnP, lnPeq, seriesId, series):
+    """
+    residual_statistics summarizes the ln(p) residuals of a fit, overall and
+    per series (ln residuals are about the relative pressure error)
+    """
+
+    residual = lnP - lnPeq
+    total = np.sum((lnP - lnP.mean())**2)
+
+    stats = {'points' : len(lnP),
+             'rms' : float(np.sqrt(np.mean(residual**2))),
+             'maxAbs' : float(np.abs(residual).max()),
+             'bias' : float(residual.mean()),
+             'r2' : float(1.0 - np.sum(residual**2)/total) if total > 0.0 else 1.0,
+             'series' : []}
+
+    for k in range(len(series)):
+        r = residual[seriesId == k]
+        fileName, temperature, branch = series[k]
+        stats['series'].append({'file' : fileName, 'temperature' : temperature, 'branch' : branch, 'points' : len(r),
+                                'rms' : float(np.sqrt(np.mean(r**2))) if len(r) > 0 else 0.0,
+                                'maxAbs' : float(np.abs(r).max()) if len(r) > 0 else 0.0})
+
+    return stats
+
+
+def write_mhd(fileName, mhName, params, stats, template):
+    """
+    write_mhd writes a .mhd parameter file with the fitted parameters, the
+    other properties are copied from the template record
+    """
+
+    f = open(fileName,'w+')
+    f.write('#\n# ' + mhName + ' fitted to ' + str(stats['points']) + ' points, ln(p) rms ' +
+            '{0:.4e} max {1:.4e} r2 {2:.6f}'.format(stats['rms'], stats['maxAbs'], stats['r2']) + '\n\n')
+    f.write('MHName = str ' + mhName + '\n')
+    for key in FIT_KEYS:
+        f.write(key + ' = float ' + repr(params[key]) + '\n')
+    for key in MHD_KEYS:
+        if key in template:
+            f.write(key + ' = float ' + repr(float(template[key])) + '\n')
+    for key in template:
+        if key not in MHD_KEYS and key not in FIT_KEYS and key != 'MHName':
+            value = template[key]
+            if isinstance(value, float):
+                f.write(key + ' = float ' + repr(value) + '\n')
+            elif isinstance(value, int):
+                f.write(key + ' = int ' + str(value) + '\n')
+            else:
+                f.write(key + ' = str ' + str(value) + '\n')
+    f.close()
+
+    return
+
+
+def fit_specs(inputDict):
+    """
+    fit_specs splits a fit input card into one card per dataset.  a card
+    fits several alloys when mhydrideName is a comma separated list of
+    names, dataFiles then holds one group of data files per name separated
+    by ';' (each group a comma separated list/glob) and template is either
+    one name for every alloy or a comma separated list with one per alloy
+    """
+
+    names = [name.strip() for name in inputDict['mhydrideName'].split(',')]
+    groups = [group.strip() for group in inputDict['dataFiles'].split(';')]
+    if len(groups) != len(names):
+        raise ValueError('dataFiles has ' + str(len(groups)) + ' groups for ' + str(len(names)) + ' alloys, separate the groups with ;')
+
+    templates = [None]*len(names)
+    if 'template' in inputDict:
+        templates = [name.strip() for name in inputDict['template'].split(',')]
+        if len(templates) == 1:
+            templates = templates*len(names)
+        elif len(templates) != len(names):
+            raise ValueError('template needs one name or one per alloy')
+
+    specs = []
+    for k in range(len(names)):
+        spec = dict(inputDict)
+        spec['mhydrideName'] = names[k]
+        spec['dataFiles'] = groups[k]
+        if templates[k] is not None:
+            spec['template'] = templates[k]
+        specs.append(spec)
+
+    return specs
+
+
+def run_fit(inputDict):
+    """
+    run_fit will fit the choi and mills parameters of one or more alloys to
+    measured isotherms for a fit input card (-e), see fit_specs for a card
+    with several datasets.  the datasets are fitted concurrently on a pool
+    of nProcs worker processes, each fit writes its .mhd file and residual
+    report (see fit_dataset).  returns the names of the files written
+
+    card keys:
+        mhydrideName    name(s) of the fitted alloys, the .mhd file is mhydrideName.mhd
+        dataFiles       data files of each alloy (see fit_dataset), groups
+                        separated by ';' for several alloys
+        template        .mhd name(s) the other properties and the fixed
+                        parameters are copied from, optional
+        nProcs          number of worker processes, default 1
+        (see fit_dataset for the other keys)
+
+    """
+
+    specs = fit_specs(inputDict)
+    nProcs = min(int(inputDict.get('nProcs', 1)), len(specs))
+
+    if nProcs > 1:
+        pool = multiprocessing.Pool(nProcs)
+        try:
+            results = pool.map(fit_dataset, specs, chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [fit_dataset(spec) for spec in specs]
+
+    #
+    # the summary lines are printed here so they come in card order
+    outputFiles = []
+    for spec, (files, stats) in zip(specs, results):
+        print ('{0}: {1} points, ln(p) rms {2:.4e}, max {3:.4e}'.format(spec['mhydrideName'], stats['points'], stats['rms'], stats['maxAbs']))
+        outputFiles = outputFiles + files
+
+    return outputFiles
+
+
+def fit_dataset(inputDict):
+    """
+    fit_dataset will fit the choi and mills parameters of one alloy to
+    measured isotherms, write the .mhd file and a residual report and
+    return the names of the files written and the residual statistics
+
+    card keys:
+        mhydrideName    name of the fitted alloy, the .mhd file is mhydrideName.mhd
+        dataFiles       comma separated list/glob of measured data files in
+                        any layout the tool writes (see mhio.read_series)
+        pUnits, tUnits  units of the measured pressures and temperatures
+        plot            branches of three column files without a branch tag
+                        in their name (A, D or B), default B
+        template        .mhd name the other properties (rho, cp, ...) and
+                        the fixed parameters are copied from, optional
+        omegaMin        smallest omega used in the fit, default 0
+        omegaMax        largest omega used in the fit, default 1
+
+    """
+
+    mhName = inputDict['mhydrideName']
+    pUnits = inputDict['pUnits']
+    tUnits = inputDict['tUnits']
+    plot = inputDict.get('plot', 'B')
+    omegaMin = inputDict.get('omegaMin', 0.0)
+    omegaMax = inputDict.get('omegaMax', 1.0)
+
+    dataFiles = []
+    for pattern in inputDict['dataFiles'].split(','):
+        matches = sorted(glob.glob(pattern.strip()))
+        if len(matches) == 0:
+            raise ValueError('No data files match ' + pattern)
+        dataFiles = dataFiles + [f for f in matches if f not in dataFiles]
+
+    template = {}
+    if 'template' in inputDict:
+        template = paramcache.get_params(inputDict['template'] + '.mhd')
+
+    omega, tempK, absorb, lnP, seriesId, series = gather_points(dataFiles, tUnits, pUnits, plot)
+    keep = (omega >= omegaMin) & (omega <= omegaMax)
+    omega, tempK, absorb, lnP, seriesId = omega[keep], tempK[keep], absorb[keep], lnP[keep], seriesId[keep]
+
+    params, fitted = fit_parameters(omega, tempK, absorb, lnP, template)
+
+    #
+    # residuals of the fitted model through calc_peq_array
+    mh = mhydride.MetalHydride()
+    mh.paramDict = dict(template)
+    mh.paramDict.update(params)
+    mh.set_punits('atm')
+    mh.set_tunits('k')
+    lnPeq = np.log(mh.calc_peq_array(omega, tempK, absorb))
+    stats = residual_statistics(lnP, lnPeq, seriesId, series)
+
+    outputFiles = []
+
+    outputFileName = mhName + '.mhd'
+    write_mhd(outputFileName, mhName, params, stats, template)
+    outputFiles.append(outputFileName)
+
+    outputFileName = mhName + '-fit.txt'
+    f = open(outputFileName,'w+')
+    f.write('# fit of ' + mhName + ', fitted ' + ' '.join(fitted) + '\n')
+    for key in FIT_KEYS:
+        f.write('{0:6s} {1: .6e}{2}\n'.format(key, params[key], '' if key in fitted else ' (fixed)'))
+    f.write('# points {0} ln(p) rms {1:.4e} maxAbs {2:.4e} bias {3:.4e} r2 {4:.6f}\n'.format(
+        stats['points'], stats['rms'], stats['maxAbs'], stats['bias'], stats['r2']))
+    f.write('# file T[' + tUnits + '] branch points rms maxAbs\n')
+    for row in stats['series']:
+        f.write('{0} {1:6.3e} {2} {3:5d} {4:.4e} {5:.4e}\n'.format(row['file'], row['temperature'], row['branch'],
+                                                                    row['points'], row['rms'], row['maxAbs']))
+    f.close()
+    outputFiles.append(outputFileName)
+
+    return outputFiles, stats
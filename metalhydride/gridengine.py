@@ -0,0 +1,245 @@
+import library
+import mhio
+import profiling
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+
+
+#
+# worker state, set once per worker process by _init_worker
+_worker = {}
+
+
+def grid_tasks(shape, chunkPoints):
+    """
+    grid_tasks splits a (nMaterial, nT, nBranch, nOmega) grid into tiles of
+    whole (branch, omega) planes over blocks of materials and temperatures,
+    each of about chunkPoints points, returned as (m0, m1, t0, t1) ranges
+    """
+
+    nMaterial, nT, nBranch, nOmega = shape
+    plane = max(nBranch*nOmega, 1)
+    tBlock = max(min(nT, chunkPoints//plane), 1)
+    mBlock = max(chunkPoints//(plane*tBlock), 1)
+
+    return [(m0, min(m0 + mBlock, nMaterial), t0, min(t0 + tBlock, nT))
+            for m0 in range(0, nMaterial, mBlock) for t0 in range(0, nT, tBlock)]
+
+
+def _init_worker(shmName, shape, params, omega, temps, absorb, pUnits, tUnits):
+    #
+    # attach to the result block once, every task writes its tile in place
+    shm = shared_memory.SharedMemory(name = shmName)
+    samples = library.HydrideLibrary()
+    samples.params = params
+    _worker['shm'] = shm
+    _worker['peq'] = np.ndarray(shape, dtype = float, buffer = shm.buf)
+    _worker['library'] = samples
+    _worker['args'] = (omega, temps, absorb, pUnits, tUnits)
+
+    return
+
+
+def _grid_task(task):
+    """
+    _grid_task evaluates one tile into the shared result, only the number
+    of points goes back to the parent
+    """
+
+    m0, m1, t0, t1 = task
+    omega, temps, absorb, pUnits, tUnits = _worker['args']
+    _worker['peq'][m0:m1,t0:t1] = _tile(_worker['library'], task, omega, temps, absorb, pUnits, tUnits)
+
+    return (m1 - m0)*(t1 - t0)*len(absorb)*len(omega)
+
+
+def _tile(lib, task, omega, temps, absorb, pUnits, tUnits):
+    m0, m1, t0, t1 = task
+    rows = library.HydrideLibrary()
+    rows.params = dict([(key, lib.params[key][m0:m1]) for key in ('A', 'B', 'phi', 'phi0', 'beta')])
+
+    return rows.calc_peq(omega, temps[t0:t1], absorb, pUnits, tUnits)
+
+
+def evaluate_grid(lib, omega, temps, absorb = (True, False), pUnits = 'atm', tUnits = 'k', names = None,
+                  nProcs = 1, chunkPoints = 1000000, shm = None):
+    """
+    evaluate_grid will evaluate Peq of many materials on a shared
+    (T, branch, omega) grid with HydrideLibrary.calc_peq, split into tiles
+    (see grid_tasks) over nProcs worker processes.  the workers write their
+    tiles straight into one shared memory result, the tiles are handed out
+    one at a time so fast workers take more of them
+
+    every point is the same elementwise calc_peq expression whichever tile
+    it falls in, so the result is identical to the single process result
+
+    Input:
+        HydrideLibrary  lib     materials
+        array   omega       1d array of omega values
+        array   temp        1d array of temperatures in tUnits
+        list    absorb      branches to evaluate, True for absorption
+        str     pUnits      pressure units of the result
+        str     tUnits      temperature units of temps
+        list    names       materials to evaluate, default is all
+        int     nProcs      number of worker processes
+        int     chunkPoints points per tile
+        SharedMemory shm    result block of at least nMaterial*nT*nBranch*nOmega
+                            floats, the result is a view of it (no copy).  by
+                            default a block is made and the result copied out
+
+    Returns:
+        array   peq         (nMaterial, nT, nBranch, nOmega) equilibrium pressure
+
+    """
+
+    if names is None:
+        names = lib.names
+    rows = np.array([lib.index[name] for name in names], dtype = int)
+    params = dict([(key, np.ascontiguousarray(lib.params[key][rows])) for key in ('A', 'B', 'phi', 'phi0', 'beta')])
+
+    omega = np.asarray(omega, dtype = float).reshape(-1)
+    temps = np.asarray(temps, dtype = float).reshape(-1)
+    absorb = [bool(b) for b in absorb]
+    shape = (len(names), len(temps), len(absorb), len(omega))
+    tasks = grid_tasks(shape, max(int(chunkPoints), 1))
+
+    if profiling.enabled:
+        profiling.count('grid_tiles', len(tasks))
+        profiling.count('calc_peq_points', int(np.prod(shape)))
+
+    if nProcs <= 1 or len(tasks) <= 1:
+        if shm is None:
+            peq = np.empty(shape)
+        else:
+            peq = np.ndarray(shape, dtype = float, buffer = shm.buf)
+        selected = library.HydrideLibrary()
+        selected.params = params
+        for task in tasks:
+            peq[task[0]:task[1],task[2]:task[3]] = _tile(selected, task, omega, temps, absorb, pUnits, tUnits)
+        return peq
+
+    owner = shm is None
+    if owner:
+        shm = shared_memory.SharedMemory(create = True, size = max(int(np.prod(shape))*8, 8))
+
+    try:
+        pool = multiprocessing.Pool(nProcs, _init_worker, (shm.name, shape, params, omega, temps, absorb, pUnits, tUnits))
+        try:
+            for count in pool.imap_unordered(_grid_task, tasks, chunksize = 1):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+        peq = np.ndarray(shape, dtype = float, buffer = shm.buf)
+        if owner:
+            peq = peq.copy()
+    finally:
+        if owner:
+            shm.close()
+            shm.unlink()
+
+    return peq
+
+
+def run_grid(inputDict):
+    """
+    run_grid will evaluate the isotherms of every material of a library
+    directory for a grid input card (-g) with evaluate_grid and write them
+    with the chart writers, returns the names of the files written
+
+    card keys:
+        libraryDir          directory holding the .mhd files, default is '.'
+        materials           comma separated material names, default is all
+        snapshotFile        library snapshot (see library.open_library), optional
+        pUnits, tUnits      pressure and temperature units
+        omegaStart, omegaEnd, delOmega      omega axis
+        tStart, tEnd, delT  isotherm temperatures
+        plot                branches (A, D or B)
+        outputFile          single or multiple (text files per material as
+                            generate_chart_data writes them) or binary (one
+                            'materials' container, see mhio)
+        nProcs              number of worker processes, default 1
+        chunkPoints         points per tile handed to a worker, default 1e6
+        writerThreads       threads writing the text files, default 0 (inline)
+        writerQueue         isotherms waiting per writer thread, default 8
+        delimit             column delimiter (space, tab, csv)
+
+    """
+
+    import metalhydride
+
+    libraryDir = inputDict.get('libraryDir', '.')
+    pUnits = inputDict['pUnits']
+    tUnits = inputDict['tUnits']
+    omegaVals = metalhydride.make_axis(inputDict['omegaStart'], inputDict['omegaEnd'], inputDict['delOmega'])
+    isoTVals = metalhydride.make_axis(inputDict['tStart'], inputDict['tEnd'], inputDict['delT'])
+    plot = inputDict['plot']
+    outputFile = inputDict['outputFile']
+    nProcs = int(inputDict.get('nProcs', 1))
+    chunkPoints = int(inputDict.get('chunkPoints', 1000000))
+    delimit = inputDict.get('delimit', 'space')
+
+    delimiter = ' '
+    if delimit == 'tab':
+        delimiter = "\t"
+    elif delimit == 'csv':
+        delimiter = ', '
+
+    with profiling.stage('load'):
+        lib = library.open_library(libraryDir, inputDict.get('snapshotFile', None))
+        names = lib.names
+        if 'materials' in inputDict:
+            names = [name.strip() for name in inputDict['materials'].split(',')]
+
+    branches = metalhydride.branch_list(plot)
+    shape = (len(names), len(isoTVals), len(branches), len(omegaVals))
+
+    #
+    # the result stays in the shared block until it is written
+    shm = None
+    if nProcs > 1:
+        shm = shared_memory.SharedMemory(create = True, size = max(int(np.prod(shape))*8, 8))
+
+    outputFiles = []
+    peq = None
+    try:
+        with profiling.stage('compute') as stage:
+            peq = evaluate_grid(lib, omegaVals, isoTVals, branches, pUnits, tUnits, names, nProcs, chunkPoints, shm)
+            stage.add_points(peq.size)
+
+        with profiling.stage('write') as stage:
+            if outputFile == 'binary':
+                outputFileName = 'materials-grid-data.npz'
+                mhio.save_container(outputFileName, {'layout' : 'materials',
+                                                     'dims' : ['material', 'temperature', 'branch', 'omega'],
+                                                     'peq' : peq,
+                                                     'omega' : omegaVals,
+                                                     'temperature' : isoTVals,
+                                                     'branch' : [metalhydride.BRANCH_LETTERS[b] for b in branches],
+                                                     'material' : names,
+                                                     'pUnits' : pUnits,
+                                                     'tUnits' : tUnits})
+                outputFiles.append(outputFileName)
+            else:
+                #
+                # one sink for all materials, the writer threads format the
+                # next isotherms while earlier files are flushed (they hold
+                # views of peq), the with block joins them before the shared
+                # block is released
+                with mhio.make_sink(int(inputDict.get('writerThreads', 0)), int(inputDict.get('writerQueue', 8))) as sink:
+                    for m in range(len(names)):
+                        writer = mhio.ChartTextWriter(names[m], outputFile, plot, tUnits, pUnits, delimiter, sink)
+                        writer.write_block(isoTVals.tolist(), branches, omegaVals, peq[m])
+                outputFiles = sink.fileNames
+            stage.add_points(peq.size)
+    finally:
+        #
+        # the view must go before the block is released
+        peq = None
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    return outputFiles
@@ -0,0 +1,225 @@
+import paramcache
+import screening
+import units
+import mhio
+import os
+import numpy as np
+
+
+#
+# snapshot layout
+#
+# a snapshot is a container (see mhio) with the members
+#
+#   layout      'library'
+#   names       material names
+#   files       .mhd file of each material
+#   sizes       file sizes when the snapshot was taken
+#   mtimes      file modification times [ns] when the snapshot was taken
+#   p_<key>     float parameter key of every material (nan if missing)
+#   s_<key>     string parameter key of every material ('' if missing)
+
+
+class HydrideLibrary(object):
+    """
+    This class holds the parameters of many metal hydrides as struct of
+    arrays, one numpy array per parameter with one entry per material, so
+    a property of every material is evaluated in one broadcast call
+
+    Members:
+        names       material names, sorted
+        index       dictionary material name -> position in the arrays
+        params      dictionary parameter key -> float array (nan if missing)
+        strings     dictionary parameter key -> string array ('' if missing)
+        files       .mhd file of each material
+        stamps      (size, mtime_ns) of each file when it was read
+
+    Member Functions:
+        load_directory  reads every .mhd file of a directory
+        save            writes the library to a binary snapshot
+        load_snapshot   reads a binary snapshot
+        is_current      True if no .mhd file changed since the library was read
+        get             a parameter of one material
+        calc_peq        Peq of every material on a shared (T, branch, omega) grid
+
+    """
+
+    def __init__(self):
+        self.names = []
+        self.index = {}
+        self.params = {}
+        self.strings = {}
+        self.files = []
+        self.stamps = []
+
+        return
+
+    def load_directory(self, libraryDir):
+        """
+        load_directory will read every .mhd file in libraryDir into the
+        parameter arrays
+        """
+
+        self.names = screening.library_names(libraryDir)
+        self.files = [os.path.join(libraryDir, name + '.mhd') for name in self.names]
+        self.stamps = [_file_stamp(f) for f in self.files]
+
+        records = [paramcache.get_params(f) for f in self.files]
+
+        keys = []
+        for record in records:
+            for key in record:
+                if key not in keys:
+                    keys.append(key)
+
+        self.params = {}
+        self.strings = {}
+        for key in keys:
+            values = [record.get(key) for record in records]
+            if all([value is None or isinstance(value, (int, float)) for value in values]):
+                self.params[key] = np.array([np.nan if value is None else float(value) for value in values])
+            else:
+                self.strings[key] = np.array(['' if value is None else str(value) for value in values])
+
+        self.index = dict([(self.names[i], i) for i in range(len(self.names))])
+
+        return
+
+    def save(self, fileName):
+        """
+        save writes the library to a single binary snapshot (see the
+        snapshot layout above)
+        """
+
+        members = {'layout' : 'library',
+                   'names' : np.array(self.names, dtype = str),
+                   'files' : np.array(self.files, dtype = str),
+                   'sizes' : np.array([stamp[0] for stamp in self.stamps], dtype = np.int64),
+                   'mtimes' : np.array([stamp[1] for stamp in self.stamps], dtype = np.int64)}
+        for key in self.params:
+            members['p_' + key] = self.params[key]
+        for key in self.strings:
+            members['s_' + key] = self.strings[key]
+
+        mhio.save_container(fileName, members)
+
+        return
+
+    def load_snapshot(self, fileName):
+        """
+        load_snapshot reads a snapshot written by save, no .mhd file is parsed
+        """
+
+        members = mhio.load_container(fileName, mmap = False)
+        if members.get('layout') != 'library':
+            raise ValueError(fileName + ' is not a hydride library snapshot')
+
+        self.names = [str(name) for name in members['names']]
+        self.files = [str(f) for f in members['files']]
+        self.stamps = list(zip(members['sizes'].tolist(), members['mtimes'].tolist()))
+        self.params = {}
+        self.strings = {}
+        for name in members:
+            if name.startswith('p_'):
+                self.params[name[2:]] = np.asarray(members[name], dtype = float)
+            elif name.startswith('s_'):
+                self.strings[name[2:]] = np.asarray(members[name])
+
+        self.index = dict([(self.names[i], i) for i in range(len(self.names))])
+
+        return
+
+    def is_current(self, libraryDir):
+        """
+        is_current returns True if libraryDir holds the same .mhd files,
+        unchanged, as when the library was read
+        """
+
+        files = [os.path.join(libraryDir, name + '.mhd') for name in screening.library_names(libraryDir)]
+        if files != self.files:
+            return False
+
+        return [_file_stamp(f) for f in files] == self.stamps
+
+    def get(self, name, key):
+        i = self.index[name]
+        if key in self.params:
+            return float(self.params[key][i])
+
+        return str(self.strings[key][i])
+
+    def calc_peq(self, omega, temp, absorb = (True, False), pUnits = 'atm', tUnits = 'k', names = None):
+        """
+        calc_peq will calculate the choi and mills equilibrium pressure of
+        every material (or the listed names) on a shared grid in one
+        broadcast call, with the same omega <= 0 / omega >= 1 handling as
+        MetalHydride.calc_peq_grid
+
+        Input:
+            array   omega       1d array of omega values
+            array   temp        1d array of temperatures in tUnits
+            list    absorb      branches to evaluate, True for absorption
+            str     pUnits      pressure units of the result
+            str     tUnits      temperature units of temp
+            list    names       materials to evaluate, default is all
+
+        Returns:
+            array   peq         (nMaterial, nT, nBranch, nOmega) equilibrium pressure
+
+        """
+
+        if names is None:
+            rows = slice(None)
+        else:
+            rows = np.array([self.index[name] for name in names], dtype = int)
+
+        A = self.params['A'][rows][:,np.newaxis,np.newaxis,np.newaxis]
+        B = self.params['B'][rows][:,np.newaxis,np.newaxis,np.newaxis]
+        phi = self.params['phi'][rows][:,np.newaxis,np.newaxis,np.newaxis]
+        phi0 = self.params['phi0'][rows][:,np.newaxis,np.newaxis,np.newaxis]
+        beta = self.params['beta'][rows][:,np.newaxis,np.newaxis,np.newaxis]
+
+        omega = np.asarray(omega, dtype = float).reshape(-1)
+        temp = units.apply_plan(units.temperature_plan(tUnits,'k'),np.asarray(temp, dtype = float).reshape(-1))
+        sign = np.where(np.asarray(absorb, dtype = bool).reshape(-1), 1.0, -1.0)[np.newaxis,np.newaxis,:,np.newaxis]
+
+        #
+        # omega only terms (material, 1, branch, omega) and temperature only
+        # terms (material, T, 1, 1), combined with one exp
+        inside = (omega > 0.0) & (omega < 1.0)
+        tanTerm = np.tan(np.pi*(np.where(inside, omega, 0.5) - 0.5))
+        shape = np.where(inside, (phi + sign*phi0)*tanTerm + sign*(beta/2.0), 0.0)
+        tTerm = (-A/temp[np.newaxis,:,np.newaxis,np.newaxis]) + B
+
+        peq = np.exp(tTerm + shape)
+
+        return units.apply_plan(units.pressure_plan('atm',pUnits),peq)
+
+
+def _file_stamp(fileName):
+    stat = os.stat(fileName)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def open_library(libraryDir, snapshotFile = None):
+    """
+    open_library returns the library of libraryDir, read from snapshotFile
+    when it is current and otherwise parsed from the .mhd files (and the
+    snapshot rewritten)
+    """
+
+    library = HydrideLibrary()
+
+    if snapshotFile is not None and os.path.exists(snapshotFile):
+        try:
+            library.load_snapshot(snapshotFile)
+            if library.is_current(libraryDir):
+                return library
+        except (ValueError, KeyError, OSError):
+            pass
+
+    library.load_directory(libraryDir)
+    if snapshotFile is not None:
+        library.save(snapshotFile)
+
+    return library
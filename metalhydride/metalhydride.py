@@ -1,14 +1,134 @@
 import mhydride
 import units
+import paramcache
+import mhio
+import bedsim
+import cyclesim
+import screening
+import batch
+import charts
+import fitting
+import montecarlo
+import gridengine
+import buildcache
+import profiling
 import sys
 import getopt
 import math
 import numpy as np
-import matplotlib.pyplot as plt
 
 
+#
+# output file letter for each branch, True is absorption
+BRANCH_LETTERS = {True : 'A', False : 'D'}
 
 
+def make_axis(start, end, step):
+    """
+    make_axis will build an evenly spaced axis from start to end (inclusive)
+    the number of points is computed up front from an integer count so 
+    float accumulation cannot drop or duplicate the last point
+
+    Input:
+        float   start       first value
+        float   end         last value, included if it lies on the step
+        float   step        spacing between values
+
+    """
+
+    count = int(math.floor((end - start)/step + 1.0e-9)) + 1
+    count = max(count, 0)
+
+    return start + step*np.arange(count)
+
+
+def adaptive_axis(func, start, end, step, tolerance, logScale = True, maxPoints = 100000):
+    """
+    adaptive_axis will sample func from start to end (both included) 
+    starting from an evenly spaced axis and bisecting every interval where
+    linear interpolation between the samples misses func at the interval
+    midpoint by more than tolerance, so points gather where the curve bends
+    (the steep omega -> 0/1 ends) and the flat plateau stays coarse
+
+    Input:
+        function func       vectorized function of the axis values
+        float   start       first value
+        float   end         last value
+        float   step        spacing of the starting axis
+        float   tolerance   allowed interpolation error
+        bool    logScale    True to measure the error on ln(func) (relative
+                            error), False for the absolute error of func
+        int     maxPoints   refinement stops once the axis has this many points
+
+    Returns:
+        array   axis        sample points
+        array   values      func at the sample points
+
+    """
+
+    axis = make_axis(start, end, step)
+    if len(axis) == 0 or axis[-1] < end - 1.0e-9*abs(step):
+        axis = np.append(axis, end)
+    axis = np.unique(np.append(axis, start))
+    values = np.asarray(func(axis), dtype=float)
+
+    while len(axis) > 1 and len(axis) < maxPoints:
+        middle = 0.5*(axis[:-1] + axis[1:])
+        middleValues = np.asarray(func(middle), dtype=float)
+
+        if logScale:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                error = np.abs(np.log(middleValues) - 0.5*(np.log(values[:-1]) + np.log(values[1:])))
+        else:
+            error = np.abs(middleValues - 0.5*(values[:-1] + values[1:]))
+
+        split = np.nonzero(error > tolerance)[0]
+        if len(split) == 0:
+            break
+        split = split[:maxPoints - len(axis)]
+
+        axis = np.insert(axis, split + 1, middle[split])
+        values = np.insert(values, split + 1, middleValues[split])
+
+    return axis, values
+
+
+def omega_sampling(inputDict):
+    """
+    omega_sampling returns the omega sampling options of a card, None for
+    the evenly spaced delOmega axis or (tolerance, logScale) for adaptive
+    sampling
+
+    card keys:
+        omegaSampling       uniform (default) or adaptive
+        omegaTolerance      allowed interpolation error, default 0.001
+        omegaToleranceScale log (error in ln(peq), default) or linear
+                            (error in peq, in the pressure units)
+
+    """
+
+    sampling = inputDict.get('omegaSampling', 'uniform')
+    if sampling == 'uniform':
+        return None
+    elif sampling != 'adaptive':
+        raise ValueError('Unknown omegaSampling ' + str(sampling) + ', use uniform or adaptive')
+
+    return (inputDict.get('omegaTolerance', 1.0e-3), inputDict.get('omegaToleranceScale', 'log') == 'log')
+
+
+def branch_list(plot):
+    """
+    branch_list returns the branches for a plot type
+    'A' absorption, 'D' desorption, 'B' both (True is absorption)
+    """
+
+    if plot == 'A':
+        return [True]
+    elif plot == 'D':
+        return [False]
+    else:
+        return [True, False]
+
 
 def load_input_data(inputDict, Filename, clear = True):
     """Use this function to read MH properties into the dictionary"""
@@ -18,49 +138,10 @@ def load_input_data(inputDict, Filename, clear = True):
     if clear == 'True':
         inputDict.clear()
 
-    linenum = 0
-
-    #
-    # loop over lines in file
-    #
-    # comment lines start with '#' character
     #
-    # data lines are of the form [key] = [type] [value]
-    #
-    #   where 
-    #       key is the name of the parameter, e.g. MW for molecular weight
-    #       type is the value type, e.g., float, int, str
-    #       value is the actual value
-    #
-    for line in open(Filename,"r"):
-        # print (line)
-        tokens = line.split()
-        linenum = linenum + 1
-        # print (tokens)
-        #
-        # check to see if there are tokens on the line
-        if len(tokens) > 1:
-            if tokens[0] == "#":
-                # comment line ignore
-                # print ('Comment ',line)
-                pass
-            elif len(tokens) > 2:
-                if tokens[1] == "=":
-                    # print ('data:   ',line)
-                    # line contains data
-                    if tokens[2].lower() == 'float':
-                        # print (tokens[0], tokens[2], tokens[3])
-                        try:
-                            inputDict[tokens[0]] = float(tokens[3])
-                        except:
-                            print ('Error parsing file ',Filename," at line number ",linenum)
-                            sys.exit(2)
-
-
-                    elif tokens[2].lower() == 'int':
-                        inputDict[tokens[0]] = int(tokens[3])
-                    else:
-                        inputDict[tokens[0]] = tokens[3].strip()
+    # the card is parsed once per process by the paramcache registry
+    with profiling.stage('load'):
+        inputDict.update(paramcache.get_params(Filename))
 
     return inputDict
 
@@ -68,7 +149,16 @@ def load_input_data(inputDict, Filename, clear = True):
 def generate_chart_data(inputDict):
     """
     generate_chart_data will make a plot of the metal hydride data for a specified (input card)
-    metal hydride.  The data can be written to a single file or multiple files
+    metal hydride.  The data can be written to a single file, multiple files or
+    a single binary container (outputFile = binary, see mhio).  The chart is
+    shown (showChart = True) and/or rendered to a file (chartFormat = png or
+    svg, see charts).  With omegaSampling = adaptive every isotherm gets its
+    own omega axis (see omega_sampling).  With incremental = True output files
+    that are current in the build cache (see buildcache) are not regenerated,
+    in the multiple file layout only new or changed isotherms are computed.
+    With writerThreads > 0 the text files are formatted and written on
+    background threads (see mhio.ThreadedSink) while the next isotherms are
+    computed, writerQueue bounds the isotherms waiting per thread
 
     """
 
@@ -89,176 +179,240 @@ def generate_chart_data(inputDict):
     showChart = inputDict['showChart']
     delimit = inputDict['delimit']
 
-    mh = mhydride.MetalHydride()
-    mh.load_data(mhName)
-    mh.set_punits(pUnits)
-    mh.set_tunits(tUnits)
+    with profiling.stage('load'):
+        mh = mhydride.MetalHydride()
+        mh.load_data(mhName)
+        mh.set_punits(pUnits)
+        mh.set_tunits(tUnits)
 
-    temperature = tStart
-    isoTVals = []
-    chartData = []
+    #
+    # build the temperature and omega axes from integer point counts
+    isoTVals = make_axis(tStart, tEnd, delT).tolist()
+    omegaVals = make_axis(omegaStart, omegaEnd, delOmega)
+    branches = branch_list(plot)
+    sampling = omega_sampling(inputDict)
 
     #
-    # set a counter for the number of data series
-    count = 0
+    # the isotherms are generated in blocks of blockSize temperatures,
+    # in streaming mode (stream = True) each block is handed straight to the
+    # writer so memory is bounded by one block, otherwise one block holds
+    # the whole sweep
+    stream = inputDict.get('stream', 'False')
+    if stream == 'True':
+        blockSize = max(int(inputDict.get('blockSize', 1)), 1)
+    else:
+        blockSize = max(len(isoTVals), 1)
+
+    delimiter = ' '
+    if delimit == 'tab':
+        delimiter = "\t"
+    elif delimit == 'csv':
+        delimiter = ', '
 
     #
-    # loop over all the requested temperatures
+    # incremental regeneration, find the output files that are current
+    cache = None
+    currentFiles = []
+    if inputDict.get('incremental', 'False') == 'True' and outputFile in ('single','multiple','binary'):
+        cache = buildcache.BuildCache(inputDict.get('buildCacheFile', buildcache.MANIFEST_FILE))
+        outputKeys = chart_output_keys(cache, inputDict, mh, isoTVals, branches, sampling)
+        currentFiles = [f for f in outputKeys if cache.is_current(f, outputKeys[f][0])]
+
+    if cache is not None and len(currentFiles) == len(outputKeys):
+        writer = None
+    else:
+        writer = make_chart_writer(inputDict, mh, isoTVals, branches, omegaVals, delimiter, sampling is not None)
+        if cache is not None and outputFile == 'multiple':
+            writer.skip = set([outputKeys[f][1:] for f in currentFiles])
 
-    while temperature <= tEnd:
-        #
-        # set the temperature
-        mh.set_t(temperature)
-        isoTVals.append(temperature)
+    #
+    # matplotlib is only loaded if the chart is shown or rendered to a file
+    chartFormat = charts.chart_format(inputDict)
+    chart = None
+    if showChart == 'True' or chartFormat is not None:
+        with profiling.stage('render'):
+            chart = charts.Chart(mhName, mh.get_tunits(), mh.get_punits(), interactive = showChart == 'True')
+    branchLetters = [BRANCH_LETTERS[b] for b in branches]
 
-        #
-        # check if use wants absorption or both
-        if plot in ('A','B'):
-            #
-            # create a new list for the chart data
-            chartData.append([])
+    #
+    # without a chart only the isotherms of stale files are computed
+    computeTVals = isoTVals
+    if cache is not None and chart is None:
+        if writer is None:
+            computeTVals = []
+        elif outputFile == 'multiple':
+            computeTVals = [temp for temp in isoTVals if len([b for b in branches if (temp, b) not in writer.skip]) > 0]
 
-            omega = omegaStart
-            while omega <= omegaEnd:
-                mh.set_omega(omega)
-                peq = mh.calc_peq()
-                chartData[count].append((omega,peq))
-                omega = omega + delOmega
+    try:
+        nBlocks = (len(computeTVals) + blockSize - 1)//blockSize
+        for iBlock in range(nBlocks):
+            blockTVals = computeTVals[iBlock*blockSize:(iBlock + 1)*blockSize]
+
+            if sampling is not None:
+                #
+                # adaptive sampling, each isotherm has its own omega axis
+                nPoints = generate_adaptive_block(mh, blockTVals, branches, omegaStart, omegaEnd, delOmega, sampling, writer, chart)
+                if stream == 'True':
+                    print ('block {0}/{1}: T = {2} to {3} {4}, {5} points'.format(iBlock + 1, nBlocks, blockTVals[0], blockTVals[-1], mh.get_tunits(), nPoints))
+                continue
 
-            count = count + 1
-            #
-            # end omega <= omegaEnd:
             #
+            # chartData is a dense (nT, nBranch, nOmega) array of Peq
+            with profiling.stage('compute') as stage:
+                chartData = mh.calc_peq_grid(omegaVals, blockTVals, branches)
+                stage.add_points(chartData.size)
+
+            if writer is not None:
+                with profiling.stage('write') as stage:
+                    writer.write_block(blockTVals, branches, omegaVals, chartData)
+                    stage.add_points(chartData.size)
+
+            if chart is not None:
+                with profiling.stage('render') as stage:
+                    chart.add_block(blockTVals, branchLetters, omegaVals, chartData)
+                    stage.add_points(chartData.size)
+
+            if stream == 'True':
+                print ('block {0}/{1}: T = {2} to {3} {4}, {5} points'.format(iBlock + 1, nBlocks, blockTVals[0], blockTVals[-1], mh.get_tunits(), chartData.size))
+    finally:
+        #
+        # the writer is closed also on an error, a threaded sink joins its
+        # threads and flushes the isotherms still queued
+        if writer is not None:
+            with profiling.stage('write'):
+                writer.close()
 
+    outputFiles = []
+    if writer is not None:
+        outputFiles = writer.fileNames
 
-        if plot in ('D','B'):
-            
-            #
-            # create a new list for the chart data
-            chartData.append([])
+    if cache is not None:
+        for f in outputFiles:
+            cache.record(f, outputKeys[f][0])
+        cache.save()
+        outputFiles = [f for f in outputKeys if f in currentFiles or f in outputFiles]
 
-            omega = omegaStart
-            while omega <= omegaEnd:
-                mh.set_omega(omega)
-                peq = mh.calc_peq(False)
-                chartData[count].append((omega,peq))
-                omega = omega + delOmega
-            count = count + 1
+    if chart is not None:
+        chartFileName = None
+        if chartFormat is not None:
+            chartFileName = mhName + "-chart." + chartFormat
+        with profiling.stage('render'):
+            outputFiles = outputFiles + chart.finish(chartFileName)
 
-            #
-            # end omega <= omegaEnd:
-            #
-        
+    return outputFiles
 
 
-        #
-        # advance T and repeat
-        temperature = temperature + delT
-        #
-        # end   if plot in ('A','B'):
-        #       elif plot in ('D','B'):
+def chart_output_keys(cache, inputDict, mh, isoTVals, branches, sampling):
+    """
+    chart_output_keys returns the build cache key of every output file of a
+    chart card as fileName -> (key, temperature, branch).  isotherm files
+    (multiple) are keyed on their own temperature and branch, single and
+    binary files on the whole temperature axis (temperature and branch None)
+    """
 
-    # end while temperature <= tEnd:
+    mhName = inputDict['mhydrideName']
+    outputFile = inputDict['outputFile']
 
-    #
-    # data generation is complete
-    # check if user wants to see the plots or write out the data
-    delimiter = ' '
-    if delimit == 'tab':
-        delimiter = "\t"
-    elif delimit == 'csv':
-        delimiter = ', '
-        
+    settings = ['chart', outputFile, cache.input_hash(mh.fileName + '.mhd'), mh.get_punits(), mh.get_tunits(),
+                inputDict['omegaStart'], inputDict['omegaEnd'], inputDict['delOmega'], sampling,
+                inputDict['plot'], inputDict['delimit']]
 
-    if outputFile == 'single':
-        #
-        # write out one single file with the data
+    keys = {}
+    if outputFile == 'multiple':
+        for temp in isoTVals:
+            for absorb in branches:
+                fileName = mhio.chart_series_file_name(mhName, temp, mh.get_tunits(), mh.get_punits(), absorb)
+                keys[fileName] = (cache.key(settings, temp, absorb), temp, absorb)
+    elif outputFile == 'binary':
+        keys[mhName + "-data.npz"] = (cache.key(settings, isoTVals, branches), None, None)
+    else:
+        keys[mhName + "-data.txt"] = (cache.key(settings, isoTVals, branches), None, None)
 
-        outputFileName = mhName + "-data.txt"
-        f = open(outputFileName,'w+')
+    return keys
 
-        if plot in ('A','D'):
-            #
-            # only absorption or desorption curves
-            
-            for i in range(len(isoTVals)):
-                for j in range(len(chartData[i])):
-                    omega, peq = chartData[i][j]
-                    f.write(('{0:6.3e}{1}{2:6.3e}{3}{4:6.3e}').format(isoTVals[i],delimiter,omega,delimiter,peq) + "\n")
-        elif plot == 'B':
-            #
-            # plot both absorption and desorption
-            for i in range(len(isoTVals)):
-                for j in range(len(chartData[2*i])):
-                    omega, peq = chartData[2*i][j]
-                    f.write(('{0:6.3e}{1}{2:6.3e}{3}{4:6.3e}').format(isoTVals[i],delimiter,omega,delimiter,peq) + "\n")
 
-                for j in range(len(chartData[2*i+1])):
-                    omega, peq = chartData[2*i+1][j]
-                    f.write(('{0:6.3e}{1}{2:6.3e}{3}{4:6.3e}').format(isoTVals[i],delimiter,omega,delimiter,peq) + "\n")
+def generate_adaptive_block(mh, isoTVals, branches, omegaStart, omegaEnd, delOmega, sampling, writer, chart):
+    """
+    generate_adaptive_block will sample, write and draw the isotherms of one
+    temperature block with adaptive omega axes and return the number of
+    points generated
+    """
 
-        f.close()
+    tolerance, logScale = sampling
+    nPoints = 0
 
-    elif outputFile == 'multiple':
-        #
-        # write out multiple files with the data
+    for temp in isoTVals:
+        for absorb in branches:
+            with profiling.stage('compute') as stage:
+                omega, peq = adaptive_axis(lambda o: mh.calc_peq_array(o, temp, absorb), omegaStart, omegaEnd, delOmega, tolerance, logScale)
+                stage.add_points(len(omega))
+            nPoints = nPoints + len(omega)
 
+            if writer is not None:
+                with profiling.stage('write') as stage:
+                    writer.write_series(temp, absorb, omega, peq)
+                    stage.add_points(len(omega))
 
-        if plot in ('A','D'):
-            #
-            # only absorption or desorption curves
-         
-            for i in range(len(isoTVals)):
-                outputFileName = mhName + "-" + str(isoTVals[i]) + mh.get_tunits() + "-" + mh.get_punits() + '-' + plot + "-data.txt"
-                f = open(outputFileName,'w+')
-                for j in range(len(chartData[i])):
-                    omega, peq = chartData[i][j]
-                    f.write(('{0:6.3f}{1}{2:6.3f}').format(omega,delimiter,peq) + "\n")
-                f.close()
-        elif plot == 'B':
-            #
-            # plot both absorption and desorption
-            for i in range(len(isoTVals)):
-                outputFileName = mhName + "-" + str(isoTVals[i]) + mh.get_tunits() + "-" + mh.get_punits() + '-' +"A-data.txt"
-                f = open(outputFileName,'w+')
-                for j in range(len(chartData[2*i])):
-                    omega, peq = chartData[2*i][j]
-                    f.write(('{0:6.3e}{1}{2:6.3e}').format(omega,delimiter,peq) + "\n")
-                f.close()
-
-                outputFileName = mhName + "-" +str(isoTVals[i]) + mh.get_tunits() + "-" + mh.get_punits() + '-' +"D-data.txt"
-                f = open(outputFileName,'w+')
-                for j in range(len(chartData[2*i+1])):
-                    omega, peq = chartData[2*i+1][j]
-                    f.write(('{0:6.3e}{1}{2:6.3e}').format(omega,delimiter,peq) + "\n")
-                f.close()
+            if chart is not None:
+                with profiling.stage('render') as stage:
+                    chart.add_line(omega, peq, temp, BRANCH_LETTERS[absorb])
+                    stage.add_points(len(omega))
+
+    return nPoints
 
-    #
-    # check if user asked for plot to be shown
 
-    if showChart == 'True':
+def make_chart_writer(inputDict, mh, isoTVals, branches, omegaVals, delimiter, ragged = False):
+    """
+    make_chart_writer returns the writer for the outputFile option of a chart
+    card (see mhio), or None if no output file is requested.  ragged is True
+    when the isotherms have their own omega axes (adaptive sampling)
+    """
+
+    mhName = inputDict['mhydrideName']
+    outputFile = inputDict['outputFile']
+
+    if outputFile in ('single','multiple'):
         #
-        # loop over data pairs and create xvals and yvals vectors for matplot
+        # writerThreads > 0 formats and writes the isotherms on background threads
+        sink = mhio.make_sink(int(inputDict.get('writerThreads', 0)), int(inputDict.get('writerQueue', 8)))
+        return mhio.ChartTextWriter(mhName, outputFile, inputDict['plot'], mh.get_tunits(), mh.get_punits(), delimiter, sink)
 
-        for i in range(len(chartData)):
-            xvals = []
-            yvals= []
-            for j in range(len(chartData[i])):
-                omega, peq = chartData[i][j]
-                xvals.append(omega)
-                yvals.append(peq)
-            line = plt.plot(xvals,yvals)
+    elif outputFile == 'binary' and ragged:
+        #
+        # series of different lengths go into a 'ragged' container
+        return mhio.ChartRaggedWriter(mhName + "-data.npz", {'material' : mhName,
+                                                             'pUnits' : mh.get_punits(),
+                                                             'tUnits' : mh.get_tunits()})
 
-        plt.show()
+    elif outputFile == 'binary':
+        #
+        # the full (nT, nBranch, nOmega) array and its axes go into one container
+        outputFileName = mhName + "-data.npz"
+        shape = (len(isoTVals), len(branches), len(omegaVals))
+        return mhio.ChartBinaryWriter(outputFileName, {'layout' : 'grid', 
+                                                       'dims' : ['temperature', 'branch', 'omega'],
+                                                       'omega' : omegaVals,
+                                                       'temperature' : isoTVals,
+                                                       'branch' : [BRANCH_LETTERS[b] for b in branches],
+                                                       'material' : mhName,
+                                                       'pUnits' : mh.get_punits(),
+                                                       'tUnits' : mh.get_tunits()}, shape)
 
-    return
+    return None
 
 
 def generate_mhrfc_cycle_data(inputDict):
     """
     generate_mhrfc_cycle_data will make a plot of the MHRFC cycle based on metal hydride data 
     for two specified metal hydride materials, one with floating temperature and one with 
-    a fixed temperature.  The data can be written to a single file or multiple files
+    a fixed temperature.  The data can be written to a single file, multiple files or
+    a single binary container (outputFile = binary, see mhio).  The chart is
+    shown (showChart = True) and/or rendered to a file (chartFormat = png or
+    svg, see charts).  With omegaSampling = adaptive every series gets its
+    own omega axis (see omega_sampling).  With incremental = True the output
+    files are not regenerated while they are current in the build cache
+    (see buildcache).  With writerThreads > 0 the multiple file layout is
+    written on background threads (see mhio.ThreadedSink)
 
     """
 
@@ -285,18 +439,17 @@ def generate_mhrfc_cycle_data(inputDict):
         pass
 
 
-    mhFloat = mhydride.MetalHydride()
-    mhFloat.load_data(mhFloatName)
-    mhFloat.set_punits(pUnits)
-    mhFloat.set_tunits(tUnits)
+    with profiling.stage('load'):
+        mhFloat = mhydride.MetalHydride()
+        mhFloat.load_data(mhFloatName)
+        mhFloat.set_punits(pUnits)
+        mhFloat.set_tunits(tUnits)
 
-    mhFixed = mhydride.MetalHydride()
-    mhFixed.load_data(mhFixedName)
-    mhFixed.set_punits(pUnits)
-    mhFixed.set_tunits(tUnits)
+        mhFixed = mhydride.MetalHydride()
+        mhFixed.load_data(mhFixedName)
+        mhFixed.set_punits(pUnits)
+        mhFixed.set_tunits(tUnits)
    
-    chartData = []
-
     #
     # There are 4 different relevant series to plot
     #
@@ -305,52 +458,52 @@ def generate_mhrfc_cycle_data(inputDict):
     #  [2] mhFixed Tlow absorption
     #  [3] mhFixed Tlow desorption
     # 
-    # They will be stored in the chart data list 
+    # They will be stored in the series lists 
     # at the stated indicies
 
-
-    count = 0
+    omegaVals = make_axis(omegaStart, omegaEnd, delOmega)
+    sampling = omega_sampling(inputDict)
+    seriesTemps = [tHi, tLow, tLow, tLow]
+    seriesBranches = ['D', 'A', 'A', 'D']
+    seriesNames = [mhFloatName, mhFloatName, mhFixedName, mhFixedName]
+    chartFormat = charts.chart_format(inputDict)
 
     #
-    # create a new list for the chart data
-    
-    chartData.append([])
-    mhFloat.set_t(tHi)
-    omega = omegaStart
-    while omega <= omegaEnd:
-        mhFloat.set_omega(omega)
-        peq = mhFloat.calc_peq(False)
-        chartData[count].append((omega,peq))
-        omega = omega + delOmega
-
-    count = count + 1
-    chartData.append([])
-    mhFloat.set_t(tLow)
-    omega = omegaStart
-    while omega <= omegaEnd:
-        mhFloat.set_omega(omega)
-        peq = mhFloat.calc_peq()
-        chartData[count].append((omega,peq))
-        omega = omega + delOmega
-
-    count = count + 1
-    chartData.append([])
-    mhFixed.set_t(tLow)
-    omega = omegaStart
-    while omega <= omegaEnd:
-        mhFixed.set_omega(omega)
-        peq = mhFixed.calc_peq()
-        chartData[count].append((omega,peq))
-        omega = omega + delOmega
-
-    count = count + 1
-    chartData.append([])
-    omega = omegaStart
-    while omega <= omegaEnd:
-        mhFixed.set_omega(omega)
-        peq = mhFixed.calc_peq(False)
-        chartData[count].append((omega,peq))
-        omega = omega + delOmega
+    # incremental regeneration, the four series are cheap so all of them
+    # are regenerated when any output file is stale
+    cache = None
+    if inputDict.get('incremental', 'False') == 'True' and outputFile in ('single','multiple','binary'):
+        cache = buildcache.BuildCache(inputDict.get('buildCacheFile', buildcache.MANIFEST_FILE))
+        outputKey = cache.key('mhrfc', outputFile, cache.input_hash(mhFloat.fileName + '.mhd'), cache.input_hash(mhFixed.fileName + '.mhd'),
+                              pUnits, tUnits, omegaStart, omegaEnd, delOmega, sampling, tHi, tLow, delimit)
+        expectedFiles = mhrfc_output_files(outputFile, mhFloatName, mhFixedName, tHi, tLow, tUnits)
+        if showChart != 'True' and chartFormat is None and all([cache.is_current(f, outputKey) for f in expectedFiles]):
+            return expectedFiles
+
+    with profiling.stage('compute') as stage:
+        if sampling is None:
+            floatData = mhFloat.calc_peq_grid(omegaVals, [tHi, tLow], [True, False])
+            fixedData = mhFixed.calc_peq_grid(omegaVals, [tLow], [True, False])
+
+            chartData = np.array([floatData[0,1], floatData[1,0], fixedData[0,0], fixedData[0,1]])
+            seriesOmega = [omegaVals]*4
+            seriesPeq = list(chartData)
+        else:
+            #
+            # adaptive sampling, each series has its own omega axis
+            tolerance, logScale = sampling
+            seriesHydrides = [mhFloat, mhFloat, mhFixed, mhFixed]
+            seriesOmega = []
+            seriesPeq = []
+            for count in range(4):
+                mh = seriesHydrides[count]
+                temp = seriesTemps[count]
+                absorb = seriesBranches[count] == 'A'
+                omega, peq = adaptive_axis(lambda o: mh.calc_peq_array(o, temp, absorb), omegaStart, omegaEnd, delOmega, tolerance, logScale)
+                seriesOmega.append(omega)
+                seriesPeq.append(peq)
+        nPoints = sum([len(omega) for omega in seriesOmega])
+        stage.add_points(nPoints)
 
 
     #
@@ -362,75 +515,157 @@ def generate_mhrfc_cycle_data(inputDict):
     elif delimit == 'csv':
         delimiter = ', '
         
+    outputFiles = []
 
-    if outputFile == 'single':
-        #
-        # write out one single file with the data
-
-        outputFileName = mhFloatName + "-" + mhFixedName + "-mhrfc-data.txt"
-        f = open(outputFileName,'w+')
+    with profiling.stage('write') as stage:
+        if outputFile == 'single':
+            #
+            # write out one single file with the data
 
-        for count in range(4):
-            if count == 0: 
-                temp = tHi
-            else:
-                temp = tLow
-            for j in range(len(chartData[count])):
-                omega, peq = chartData[count][j]
-                f.write(('{0:6.3e}{1}{2:6.3e}{3}{4:6.3e}').format(temp,delimiter,omega,delimiter,peq) + "\n")
+            outputFileName = mhFloatName + "-" + mhFixedName + "-mhrfc-data.txt"
+            f = open(outputFileName,'w+')
+            outputFiles.append(outputFileName)
+
+            for count in range(4):
+                if count == 0: 
+                    temp = tHi
+                else:
+                    temp = tLow
+                omega = seriesOmega[count]
+                peq = seriesPeq[count]
+                for j in range(len(omega)):
+                    f.write(('{0:6.3e}{1}{2:6.3e}{3}{4:6.3e}').format(temp,delimiter,omega[j],delimiter,peq[j]) + "\n")
 
-        f.close()
+            f.close()
 
-    elif outputFile == 'multiple':
-        #
-        # write out multiple files with the data
-
-        for count in range(4):
-            if count == 0: 
-                temp = tHi
-                outputFileName = mhFloatName + "-" + str(tHi) + mhFloat.get_tunits() + "-D-mhrfc-data.txt"
-            elif count == 1:
-                temp = tLow
-                outputFileName = mhFloatName + "-" + str(tLow) + mhFloat.get_tunits() + "-A-mhrfc-data.txt"
-            elif count == 2:
-                temp = tLow
-                outputFileName = mhFixedName + "-" + str(tLow) + mhFixed.get_tunits() + "-A-mhrfc-data.txt"            
-            else:
-                temp = tLow
-                outputFileName = mhFixedName + "-" + str(tLow) + mhFixed.get_tunits() + "-D-mhrfc-data.txt"       
-            f = open(outputFileName,'w+')
+        elif outputFile == 'multiple':
+            #
+            # write out multiple files with the data
 
-            for j in range(len(chartData[count])):
-                omega, peq = chartData[count][j]
-                f.write(('{0:6.3e}{1}{2:6.3e}').format(omega,delimiter,peq) + "\n")
+            seriesFiles = mhrfc_output_files(outputFile, mhFloatName, mhFixedName, tHi, tLow, tUnits)
+            with mhio.make_sink(int(inputDict.get('writerThreads', 0)), int(inputDict.get('writerQueue', 8))) as sink:
+                for count in range(4):
+                    omega = seriesOmega[count]
+                    peq = seriesPeq[count]
+                    sink.write(seriesFiles[count], lambda omega = omega, peq = peq: ''.join([('{0:6.3e}{1}{2:6.3e}').format(omega[j],delimiter,peq[j]) + "\n" for j in range(len(omega))]), final = True)
+            outputFiles = outputFiles + sink.fileNames
 
-            f.close()
+        elif outputFile == 'binary' and sampling is not None:
+            #
+            # series of different lengths go into a 'ragged' container
+
+            outputFileName = mhFloatName + "-" + mhFixedName + "-mhrfc-data.npz"
+            writer = mhio.ChartRaggedWriter(outputFileName, {'material' : seriesNames,
+                                                             'pUnits' : mhFixed.get_punits(),
+                                                             'tUnits' : mhFixed.get_tunits()})
+            for count in range(4):
+                writer.write_series(seriesTemps[count], seriesBranches[count], seriesOmega[count], seriesPeq[count])
+            writer.close()
+            outputFiles.append(outputFileName)
+
+        elif outputFile == 'binary':
+            #
+            # write the four series and their descriptions to one container
+
+            outputFileName = mhFloatName + "-" + mhFixedName + "-mhrfc-data.npz"
+            mhio.save_container(outputFileName, {'layout' : 'series', 
+                                                 'dims' : ['series', 'omega'],
+                                                 'peq' : chartData,
+                                                 'omega' : omegaVals,
+                                                 'temperature' : seriesTemps,
+                                                 'branch' : seriesBranches,
+                                                 'material' : seriesNames,
+                                                 'pUnits' : mhFixed.get_punits(),
+                                                 'tUnits' : mhFixed.get_tunits()})
+            outputFiles.append(outputFileName)
+        stage.add_points(nPoints)
+
+    if cache is not None:
+        for f in outputFiles:
+            cache.record(f, outputKey)
+        cache.save()
 
     #
-    # check if user asked for plot to be shown
+    # check if user asked for plot to be shown or rendered to a file
 
-    if showChart == 'True':
+    if showChart == 'True' or chartFormat is not None:
         #
-        # loop over data pairs and create xvals and yvals vectors for matplot
+        # one labelled line per series
 
-        for i in range(len(chartData)):
-            xvals = []
-            yvals= []
-            for j in range(len(chartData[i])):
-                omega, peq = chartData[i][j]
-                xvals.append(omega)
-                yvals.append(peq)
-            line = plt.plot(xvals,yvals)
+        with profiling.stage('render'):
+            chart = charts.Chart(mhFloatName + ' / ' + mhFixedName + ' MHRFC', mhFixed.get_tunits(), mhFixed.get_punits(),
+                                 logPlot = logPlot == 'True', interactive = showChart == 'True')
+            for i in range(len(seriesPeq)):
+                chart.add_line(seriesOmega[i], seriesPeq[i], seriesTemps[i], seriesBranches[i], seriesNames[i])
 
-        plt.xlabel('omega [-]')
-        plt.ylabel('Pressure [' + mhFixed.get_punits() + ']')
+            chartFileName = None
+            if chartFormat is not None:
+                chartFileName = mhFloatName + "-" + mhFixedName + "-mhrfc-chart." + chartFormat
+            outputFiles = outputFiles + chart.finish(chartFileName)
 
-        if logPlot == 'True':
-            plt.yscale('log')
+    return outputFiles
 
-        plt.show()
 
-    return
+def mhrfc_output_files(outputFile, mhFloatName, mhFixedName, tHi, tLow, tUnits):
+    """
+    mhrfc_output_files returns the names of the data files of an MHRFC card,
+    in the multiple file layout one per series in the order of the series
+    """
+
+    if outputFile == 'single':
+        return [mhFloatName + "-" + mhFixedName + "-mhrfc-data.txt"]
+    elif outputFile == 'binary':
+        return [mhFloatName + "-" + mhFixedName + "-mhrfc-data.npz"]
+    elif outputFile == 'multiple':
+        return [mhFloatName + "-" + str(tHi) + tUnits + "-D-mhrfc-data.txt",
+                mhFloatName + "-" + str(tLow) + tUnits + "-A-mhrfc-data.txt",
+                mhFixedName + "-" + str(tLow) + tUnits + "-A-mhrfc-data.txt",
+                mhFixedName + "-" + str(tLow) + tUnits + "-D-mhrfc-data.txt"]
+
+    return []
+
+
+def generate_pair_screening(inputDict):
+    """
+    generate_pair_screening will screen every metal hydride pair in a library
+    directory as float/fixed materials of the MHRFC cycle over ranges of tHi 
+    and tLow, and write a table ranked by the usable omega window (see screening)
+
+    card keys:
+        libraryDir          directory holding the .mhd files, default is '.'
+        pUnits, tUnits      pressure and temperature units
+        omegaStart, omegaEnd, delOmega      omega axis
+        tHiStart, tHiEnd, delTHi            tHi values
+        tLowStart, tLowEnd, delTLow         tLow values
+        nProcs              number of worker processes, default 1
+        outputFileName      ranked table file, default 'mhrfc-screening.txt'
+
+    """
+
+    #
+    # get the relevant data from the dictionary
+    libraryDir = inputDict.get('libraryDir', '.')
+    pUnits = inputDict['pUnits']
+    tUnits = inputDict['tUnits']
+    omegaVals = make_axis(inputDict['omegaStart'], inputDict['omegaEnd'], inputDict['delOmega'])
+    tHiVals = make_axis(inputDict['tHiStart'], inputDict['tHiEnd'], inputDict['delTHi']).tolist()
+    tLowVals = make_axis(inputDict['tLowStart'], inputDict['tLowEnd'], inputDict['delTLow']).tolist()
+    nProcs = int(inputDict.get('nProcs', 1))
+    outputFileName = inputDict.get('outputFileName', 'mhrfc-screening.txt')
+
+    names = screening.library_names(libraryDir)
+    rows = screening.screen_pairs(names, libraryDir, pUnits, tUnits, omegaVals, tHiVals, tLowVals, nProcs)
+
+    f = open(outputFileName,'w+')
+    f.write('# rank float fixed tHi[' + tUnits + '] tLow[' + tUnits + '] omegaLow omegaHigh width forwardRatio returnRatio margin\n')
+    for rank in range(len(rows)):
+        row = rows[rank]
+        f.write(('{0:5d} {1:>16s} {2:>16s} {3:6.3e} {4:6.3e} {5:6.3e} {6:6.3e} {7:6.3e} {8:6.3e} {9:6.3e} {10:6.3e}').format(
+            rank + 1, row['float'], row['fixed'], row['tHi'], row['tLow'], row['omegaLow'], row['omegaHigh'],
+            row['width'], row['forwardRatio'], row['returnRatio'], row['margin']) + "\n")
+    f.close()
+
+    return [outputFileName]
 
 
 def main():
@@ -442,17 +677,35 @@ def main():
         -h              :   help on running the code
         -c              :   create data for plotting
         -s              :   system simulation
+        -r              :   create MHRFC cycle data
+        -p              :   screen all MHRFC hydride pairs in a library directory
+        -e              :   fit the Peq parameters of one or more alloys to measured isotherms
+        -y              :   two bed MHRFC cycle simulation to cyclic steady state
+        -u              :   monte carlo percentile bands of Peq and the MHRFC window
+        -g              :   isotherms of every material of a library directory, in parallel
         -f [filename]   :   input filename
+        -b [cards]      :   batch run of a comma separated list/glob of input cards,
+                            -c/-r/-s/-p/-e/-y/-u/-g force the card type (default is detected)
+        -j [nprocs]     :   number of worker processes for a batch run
+        --profile       :   report stage timings and counters at exit (also MH_PROFILE,
+                            see profiling)
 
     """
     inputFile = ""
     chartData = False
     simulation = False
     MHRFC_Cycle = False
+    pairScreening = False
+    parameterFit = False
+    cycleSimulation = False
+    uncertainty = False
+    materialGrid = False
+    batchCards = ""
+    nProcs = 1
     inputDict = {}
     
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "chsrf:",["help","filename="])
+        opts, args = getopt.getopt(sys.argv[1:], "chsrpeyugf:b:j:",["help","filename=","profile"])
     except getopt.error as msg:
         print (msg)
         print ("for help use --help")
@@ -464,23 +717,103 @@ def main():
             print ("python metalhydride.py")
         if o == "-f":
             inputFile = arg
-            inputDict = load_input_data(inputDict,inputFile)
+            try:
+                inputDict = load_input_data(inputDict,inputFile)
+            except paramcache.ParseError as msg:
+                print (msg)
+                sys.exit(2)
         if o == "-s":
             simulation = True
         if o == "-c":
             chartData = True
         if o == "-r":
             MHRFC_Cycle = True
-
-    if chartData == True:
+        if o == "-p":
+            pairScreening = True
+        if o == "-e":
+            parameterFit = True
+        if o == "-y":
+            cycleSimulation = True
+        if o == "-u":
+            uncertainty = True
+        if o == "-g":
+            materialGrid = True
+        if o == "-b":
+            batchCards = arg
+        if o == "-j":
+            nProcs = int(arg)
+        if o == "--profile":
+            profiling.enable(profiling.reportFile)
+
+    if batchCards != "":
         #
-        # generate chart files
-        generate_chart_data(inputDict)
+        # run every card, -c/-r/-s/-p/-e/-y/-u/-g force the card type
+        mode = None
+        if chartData == True:
+            mode = 'chart'
+        elif MHRFC_Cycle == True:
+            mode = 'mhrfc'
+        elif simulation == True:
+            mode = 'simulation'
+        elif pairScreening == True:
+            mode = 'screening'
+        elif parameterFit == True:
+            mode = 'fit'
+        elif cycleSimulation == True:
+            mode = 'cycle'
+        elif uncertainty == True:
+            mode = 'uncertainty'
+        elif materialGrid == True:
+            mode = 'grid'
+        manifest = batch.run_batch(batch.expand_cards(batchCards), mode, nProcs)
+        if manifest['failed'] > 0:
+            sys.exit(1)
+        return
 
-    elif MHRFC_Cycle == True:
-        #
-        # generate MHRFC cycle charts and files
-        generate_mhrfc_cycle_data(inputDict)
+    try:
+        if chartData == True:
+            #
+            # generate chart files
+            generate_chart_data(inputDict)
+
+        elif MHRFC_Cycle == True:
+            #
+            # generate MHRFC cycle charts and files
+            generate_mhrfc_cycle_data(inputDict)
+
+        elif simulation == True:
+            #
+            # run the transient hydride bed simulation
+            bedsim.run_simulation(inputDict)
+
+        elif pairScreening == True:
+            #
+            # rank all float/fixed pairs in the library for the MHRFC cycle
+            generate_pair_screening(inputDict)
+
+        elif parameterFit == True:
+            #
+            # fit the Peq parameters to measured isotherms and write a .mhd file
+            fitting.run_fit(inputDict)
+
+        elif cycleSimulation == True:
+            #
+            # run the two bed MHRFC cycle to cyclic steady state
+            cyclesim.run_cycle_simulation(inputDict)
+
+        elif uncertainty == True:
+            #
+            # propagate the Peq parameter uncertainty to percentile bands
+            montecarlo.run_uncertainty(inputDict)
+
+        elif materialGrid == True:
+            #
+            # evaluate the isotherms of a whole library on worker processes
+            gridengine.run_grid(inputDict)
+
+    except paramcache.ParseError as msg:
+        print (msg)
+        sys.exit(2)
 
 
     return
@@ -0,0 +1,630 @@
+import zipfile
+import re
+import os
+import io
+import mmap
+import threading
+import queue
+import units
+import numpy as np
+
+
+#
+# container layout
+#
+# a container is an uncompressed .npz file (a zip archive of .npy members)
+# so every member can be memory mapped in place.  the members are
+#
+#   layout      'grid', 'series', 'ragged' or 'materials'
+#   dims        names of the axes of peq
+#   peq         equilibrium pressure
+#   omega       omega axis
+#   temperature temperature axis (grid) or temperature of each series
+#   branch      'A'/'D' branch axis (grid) or branch of each series
+#   material    metal hydride name (grid) or name of each series
+#   pUnits      pressure units of peq
+#   tUnits      temperature units of temperature
+#
+# 'grid' containers hold peq as (nT, nBranch, nOmega), 'series' containers
+# hold peq as (nSeries, nOmega) with one temperature/branch/material per series.
+# 'ragged' containers (adaptive omega sampling) hold series of different
+# lengths, peq and omega are the series one after the other and the extra
+# member
+#
+#   offsets     series i is peq[offsets[i]:offsets[i + 1]]
+#
+# 'materials' containers (see gridengine) hold peq as (nMaterial, nT,
+# nBranch, nOmega) with the material name axis in material
+
+
+def save_container(fileName, members):
+    """
+    save_container will write the members (name -> array or string) to
+    an uncompressed .npz container in bulk
+    """
+
+    arrays = {}
+    for name in members:
+        arrays[name] = np.asarray(members[name])
+
+    with open(fileName, 'wb') as f:
+        np.savez(f, **arrays)
+
+    return
+
+
+def load_container(fileName, mmap = True):
+    """
+    load_container will read a container written by save_container and return
+    a dictionary of its members.  when mmap is True the numeric members are
+    returned as read only memory maps of the file (no copy is made)
+    """
+
+    members = {}
+
+    with zipfile.ZipFile(fileName, 'r') as zf:
+        for info in zf.infolist():
+            name = info.filename
+            if name.endswith('.npy'):
+                name = name[:-4]
+
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                array = _map_member(fileName, info)
+            else:
+                array = None
+
+            if array is None:
+                with zf.open(info) as member:
+                    array = np.lib.format.read_array(member)
+
+            if array.ndim == 0 and array.dtype.kind == 'U':
+                array = str(array)
+
+            members[name] = array
+
+    return members
+
+
+def _map_member(fileName, info):
+    """
+    _map_member returns a read only memory map of a stored .npy member,
+    or None if the member cannot be mapped (e.g. string arrays)
+    """
+
+    with open(fileName, 'rb') as f:
+        #
+        # skip the zip local file header to the start of the .npy data
+        f.seek(info.header_offset)
+        header = f.read(30)
+        nameLength = int.from_bytes(header[26:28], 'little')
+        extraLength = int.from_bytes(header[28:30], 'little')
+        f.seek(info.header_offset + 30 + nameLength + extraLength)
+
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if dtype.hasobject or dtype.kind == 'U' or len(shape) == 0 or 0 in shape:
+        return None
+
+    order = 'F' if fortranOrder else 'C'
+
+    return np.memmap(fileName, dtype = dtype, mode = 'r', offset = offset, shape = shape, order = order)
+
+
+#
+# temperature, units and branch tags in the names of the files written by
+# generate_chart_data and generate_mhrfc_cycle_data (multiple files), e.g.
+# hystor207-25.0degc-psia-A-data.txt or hystor207-25.0degc-A-mhrfc-data.txt
+FILE_NAME_TAGS = re.compile(r'-(?P<t>[-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)(?P<tUnits>' + '|'.join(units.TEMPERATURE_FACTORS) + ')'
+                            r'-(?:(?P<pUnits>' + '|'.join(units.PRESSURE_FACTORS) + ')-)?(?P<branch>[AD])-')
+
+
+#
+# text files larger than this [bytes] are memory mapped and parsed in chunks
+MMAP_THRESHOLD = 64*1024*1024
+MMAP_CHUNK = 16*1024*1024
+
+
+def detect_layout(fileName):
+    """
+    detect_layout returns (number of columns, delimit option) of a text data
+    file from its first data line, the delimit option is 'csv' (', '),
+    'tab' or 'space'
+    """
+
+    with open(fileName, 'r') as f:
+        for line in f:
+            if line.strip() == '' or line.lstrip().startswith('#'):
+                continue
+            if ',' in line:
+                return (len(line.split(',')), 'csv')
+            elif '\t' in line:
+                return (len(line.split()), 'tab')
+            else:
+                return (len(line.split()), 'space')
+
+    return (0, 'space')
+
+
+def read_columns(fileName, mmapThreshold = MMAP_THRESHOLD):
+    """
+    read_columns will read a whitespace, tab or ', ' delimited text data
+    file (any of the delimit options, see detect_layout) in bulk and return a
+    (nRows, nColumns) array.  files larger than mmapThreshold bytes are
+    memory mapped and parsed chunk by chunk into one preallocated array, so
+    only one chunk of text is held in memory
+    """
+
+    nColumns, delimit = detect_layout(fileName)
+    delimiter = ',' if delimit == 'csv' else None
+    if nColumns == 0:
+        return np.zeros((0, 0))
+
+    if os.path.getsize(fileName) <= mmapThreshold:
+        return np.loadtxt(fileName, delimiter = delimiter, comments = '#', ndmin = 2)
+
+    with open(fileName, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            #
+            # upper bound on the rows from the newline count, trimmed below
+            nLines = int(np.count_nonzero(np.frombuffer(mm, dtype = np.uint8) == ord('\n'))) + 1
+            data = np.empty((nLines, nColumns))
+            nRows = 0
+            start = 0
+            while start < len(mm):
+                end = mm.find(b'\n', min(start + MMAP_CHUNK, len(mm)))
+                end = len(mm) if end < 0 else end + 1
+                chunk = np.loadtxt(io.StringIO(mm[start:end].decode()), delimiter = delimiter, comments = '#', ndmin = 2)
+                if chunk.size > 0:
+                    if chunk.shape[1] != nColumns:
+                        raise ValueError('Rows of ' + fileName + ' do not have the same number of columns')
+                    data[nRows:nRows + len(chunk)] = chunk
+                    nRows = nRows + len(chunk)
+                start = end
+        finally:
+            mm.close()
+
+    return data[:nRows]
+
+
+def file_name_tags(fileName):
+    """
+    file_name_tags returns (temperature, tUnits, pUnits, branch) parsed from
+    the name of a data file, None for tags the name does not carry
+    """
+
+    match = FILE_NAME_TAGS.search(os.path.basename(fileName))
+    if match is None:
+        return (None, None, None, None)
+
+    return (float(match.group('t')), match.group('tUnits'), match.group('pUnits'), match.group('branch'))
+
+
+def read_series(fileName, plot = 'B'):
+    """
+    read_series will read a data file in any of the layouts the tool writes
+    and return its isotherms as a list of (temperature, branch, omega, p)
+    tuples, temperature and p in the units of the file
+
+    two column files (omega, p) hold one isotherm, the temperature and
+    branch are taken from the file name.  three column files (T, omega, p)
+    are split into isotherms where T changes or omega steps back, the
+    branch is taken from the file name or otherwise cycles through the
+    branches of plot ('A', 'D' or 'B', absorption first) as written by
+    generate_chart_data
+    """
+
+    data = read_columns(fileName)
+    temperature, tUnits, pUnits, branch = file_name_tags(fileName)
+
+    if data.shape[1] == 2:
+        if temperature is None or branch is None:
+            raise ValueError('The temperature and branch of ' + fileName + ' are not in its name')
+        return [(temperature, branch, data[:,0], data[:,1])]
+
+    elif data.shape[1] != 3:
+        raise ValueError(fileName + ' has ' + str(data.shape[1]) + ' columns, expected 2 or 3')
+
+    #
+    # series boundaries
+    newSeries = np.nonzero((np.diff(data[:,0]) != 0.0) | (np.diff(data[:,1]) <= 0.0))[0] + 1
+    starts = np.concatenate(([0], newSeries))
+    ends = np.concatenate((newSeries, [len(data)]))
+
+    if plot == 'A':
+        cycle = ['A']
+    elif plot == 'D':
+        cycle = ['D']
+    else:
+        cycle = ['A', 'D']
+
+    series = []
+    position = 0
+    for k in range(len(starts)):
+        if k > 0 and data[starts[k],0] != data[starts[k - 1],0]:
+            position = 0
+        seriesBranch = branch
+        if seriesBranch is None:
+            seriesBranch = cycle[position % len(cycle)]
+        position = position + 1
+        series.append((float(data[starts[k],0]), seriesBranch, data[starts[k]:ends[k],1], data[starts[k]:ends[k],2]))
+
+    return series
+
+
+class FileSink(object):
+    """
+    This class writes pre-joined blocks of text to output files
+
+    Members:
+        files       dictionary of open files, fileName -> file
+        fileNames   names of every file written, in the order they were opened
+
+    Member Functions:
+        write       appends text to a file, opening it on first use
+        close       closes every open file
+
+    a sink is a context manager, the files are closed when the with block
+    exits, also on an error
+
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.fileNames = []
+
+        return
+
+    def write(self, fileName, text, final = False):
+        """
+        write appends text to fileName, the file is created on the first
+        write and closed when final is True.  text is a string or a function
+        returning the string
+        """
+
+        if callable(text):
+            text = text()
+
+        f = self.files.get(fileName)
+        if f is None:
+            f = open(fileName,'w+')
+            self.files[fileName] = f
+            self.fileNames.append(fileName)
+
+        f.write(text)
+
+        if final:
+            f.close()
+            del self.files[fileName]
+
+        return
+
+    def close(self):
+        for fileName in list(self.files):
+            self.files.pop(fileName).close()
+
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        #
+        # after an error in the with block the sink is still closed, but an
+        # error of the close does not replace the original error
+        try:
+            self.close()
+        except Exception:
+            if excType is None:
+                raise
+
+        return False
+
+
+class ThreadedSink(FileSink):
+    """
+    This class is a FileSink that writes on background threads so the
+    formatting and the disk writes of one block overlap with computing the
+    next.  blocks go through a bounded queue (write blocks while the queue
+    is full), every file belongs to one writer thread so its blocks are
+    written in order, and each block is one bulk write of pre-joined text
+    to a buffered file.  text given as a function is formatted on the
+    writer thread
+
+    the first error of a writer thread is raised on the calling thread by
+    the next write or by close, the threads keep draining the queue after
+    an error so the caller never blocks on a dead writer
+
+    Members:
+        fileNames   names of every file written, in the order they were opened
+        error       first exception raised by a writer thread, None if none
+
+    Member Functions:
+        write       queues text for a file
+        close       waits for the queued blocks, closes every file and
+                    raises the first writer error
+
+    the writer threads are only joined by close, use the sink as a context
+    manager (see FileSink) or close it in a finally so an error of the
+    producer does not leave the threads running and the files unflushed
+
+    """
+
+    def __init__(self, nThreads = 1, maxQueue = 8, bufferSize = 1 << 20):
+        self.fileNames = []
+        self.error = None
+        self.bufferSize = bufferSize
+        self.queues = [queue.Queue(max(maxQueue, 1)) for k in range(max(nThreads, 1))]
+        self.owner = {}
+        self.threads = []
+        for q in self.queues:
+            thread = threading.Thread(target = self._run, args = (q,), daemon = True)
+            thread.start()
+            self.threads.append(thread)
+
+        return
+
+    def _run(self, q):
+        files = {}
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+
+            fileName, text, final = item
+            try:
+                if callable(text):
+                    text = text()
+                f = files.get(fileName)
+                if f is None:
+                    f = open(fileName, 'w+', buffering = self.bufferSize)
+                    files[fileName] = f
+                f.write(text)
+                if final:
+                    files.pop(fileName).close()
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+        for f in files.values():
+            try:
+                f.close()
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+        return
+
+    def write(self, fileName, text, final = False):
+        if self.error is not None:
+            raise self.error
+
+        k = self.owner.get(fileName)
+        if k is None:
+            #
+            # new files go to the threads in turn
+            k = len(self.fileNames) % len(self.queues)
+            self.owner[fileName] = k
+            self.fileNames.append(fileName)
+        if final:
+            del self.owner[fileName]
+
+        self.queues[k].put((fileName, text, final))
+
+        return
+
+    def close(self):
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+        if self.error is not None:
+            raise self.error
+
+        return
+
+
+def make_sink(writerThreads = 0, writerQueue = 8):
+    """
+    make_sink returns a ThreadedSink with writerThreads threads, or a
+    FileSink (writes on the calling thread) when writerThreads is 0
+    """
+
+    if writerThreads > 0:
+        return ThreadedSink(writerThreads, writerQueue)
+
+    return FileSink()
+
+
+def chart_series_file_name(mhName, temperature, tUnits, pUnits, branch):
+    """
+    chart_series_file_name returns the name of the file of one isotherm in
+    the multiple file layout, branch is True (or 'A') for absorption
+    """
+
+    if isinstance(branch, (bool, np.bool_)):
+        branch = 'A' if branch else 'D'
+
+    return mhName + "-" + str(temperature) + tUnits + "-" + pUnits + '-' + branch + "-data.txt"
+
+
+class ChartTextWriter(object):
+    """
+    This class writes isotherm blocks from generate_chart_data to text files
+    in the single file (T, omega, peq rows) or multiple file (omega, peq rows,
+    one file per isotherm and branch) layouts
+
+    Members:
+        mhName      metal hydride name used in the file names
+        outputFile  'single' or 'multiple'
+        plot        'A', 'D' or 'B'
+        tUnits      temperature units used in the file names
+        pUnits      pressure units used in the file names
+        delimiter   column delimiter
+        sink        FileSink or ThreadedSink the formatted text is written to
+        fileNames   names of the files written
+        skip        (temperature, branch) isotherms that are not written
+
+    Member Functions:
+        write_series    writes one (temperature, branch) isotherm
+        write_block     writes a (nT, nBranch, nOmega) block of isotherms
+        close           closes the output files
+
+    """
+
+    def __init__(self, mhName, outputFile, plot, tUnits, pUnits, delimiter, sink = None):
+        self.mhName = mhName
+        self.outputFile = outputFile
+        self.plot = plot
+        self.tUnits = tUnits
+        self.pUnits = pUnits
+        self.delimiter = delimiter
+        if sink is None:
+            sink = FileSink()
+        self.sink = sink
+        self.fileNames = sink.fileNames
+        self.skip = set()
+
+        return
+
+    def write_series(self, temperature, branch, omega, peq):
+        delimiter = self.delimiter
+
+        if (temperature, branch) in self.skip:
+            return
+
+        #
+        # the rows are formatted by the sink, on its writer thread for a ThreadedSink
+        if self.outputFile == 'single':
+            outputFileName = self.mhName + "-data.txt"
+            self.sink.write(outputFileName, lambda: ''.join([('{0:6.3e}{1}{2:6.3e}{3}{4:6.3e}').format(temperature,delimiter,omega[k],delimiter,peq[k]) + "\n" for k in range(len(omega))]))
+
+        elif self.outputFile == 'multiple':
+            outputFileName = chart_series_file_name(self.mhName, temperature, self.tUnits, self.pUnits, branch)
+            if self.plot in ('A','D'):
+                #
+                # only absorption or desorption curves
+                rowFormat = '{0:6.3f}{1}{2:6.3f}'
+            else:
+                rowFormat = '{0:6.3e}{1}{2:6.3e}'
+            self.sink.write(outputFileName, lambda: ''.join([rowFormat.format(omega[k],delimiter,peq[k]) + "\n" for k in range(len(omega))]), final = True)
+
+        return
+
+    def write_block(self, temperatures, branches, omega, peq):
+        for i in range(len(temperatures)):
+            for j in range(len(branches)):
+                self.write_series(temperatures[i], branches[j], omega, peq[i,j])
+
+        return
+
+    def close(self):
+        self.sink.close()
+        return
+
+
+class ChartBinaryWriter(object):
+    """
+    This class streams isotherm blocks from generate_chart_data into a 'grid'
+    container (see save_container).  the peq member is written block by block
+    so only one block is held in memory, the axes are added on close
+
+    Member Functions:
+        write_block     writes the next (nT, nBranch, nOmega) block of isotherms
+        close           writes the axes and closes the container
+
+    """
+
+    def __init__(self, fileName, members, shape):
+        self.fileName = fileName
+        self.fileNames = [fileName]
+        self.members = members
+        self.zf = zipfile.ZipFile(fileName, 'w', compression = zipfile.ZIP_STORED, allowZip64 = True)
+        self.peqFile = self.zf.open('peq.npy', 'w', force_zip64 = True)
+
+        header = {'descr' : np.lib.format.dtype_to_descr(np.dtype(float)), 'fortran_order' : False, 'shape' : tuple(shape)}
+        np.lib.format.write_array_header_1_0(self.peqFile, header)
+
+        return
+
+    def write_block(self, temperatures, branches, omega, peq):
+        self.peqFile.write(np.ascontiguousarray(peq, dtype = float).tobytes())
+        return
+
+    def close(self):
+        self.peqFile.close()
+
+        for name in self.members:
+            with self.zf.open(name + '.npy', 'w', force_zip64 = True) as member:
+                np.lib.format.write_array(member, np.asarray(self.members[name]))
+
+        self.zf.close()
+
+        return
+
+
+class ChartRaggedWriter(object):
+    """
+    This class collects series of different lengths (adaptive omega 
+    sampling) and writes them to a 'ragged' container on close
+
+    Members:
+        fileName    container file name
+        fileNames   names of the files written
+        members     the other container members (units, material, ...)
+
+    Member Functions:
+        write_series    adds one (temperature, branch) series
+        write_block     adds a (nT, nBranch, nOmega) block of series
+        close           writes the container
+
+    """
+
+    def __init__(self, fileName, members):
+        self.fileName = fileName
+        self.fileNames = [fileName]
+        self.members = members
+        self.omega = []
+        self.peq = []
+        self.temperature = []
+        self.branch = []
+
+        return
+
+    def write_series(self, temperature, branch, omega, peq):
+        self.omega.append(np.asarray(omega, dtype = float))
+        self.peq.append(np.asarray(peq, dtype = float))
+        self.temperature.append(temperature)
+        self.branch.append(('A' if branch else 'D') if isinstance(branch, (bool, np.bool_)) else branch)
+
+        return
+
+    def write_block(self, temperatures, branches, omega, peq):
+        for i in range(len(temperatures)):
+            for j in range(len(branches)):
+                self.write_series(temperatures[i], branches[j], omega, peq[i,j])
+
+        return
+
+    def close(self):
+        lengths = [len(omega) for omega in self.omega]
+        members = {'layout' : 'ragged',
+                   'dims' : ['series', 'omega'],
+                   'peq' : np.concatenate(self.peq) if len(self.peq) > 0 else np.zeros(0),
+                   'omega' : np.concatenate(self.omega) if len(self.omega) > 0 else np.zeros(0),
+                   'offsets' : np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+                   'temperature' : self.temperature,
+                   'branch' : self.branch}
+        members.update(self.members)
+        save_container(self.fileName, members)
+
+        return
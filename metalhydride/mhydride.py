@@ -1,5 +1,12 @@
 import units
+import paramcache
+import profiling
 import math
+import numpy as np
+
+#
+# universal gas constant [J/mol-K]
+R_GAS = 8.314
 
 class MetalHydride(object):
     """
@@ -30,7 +37,13 @@ class MetalHydride(object):
         get_tunits  gets the current temperature units specification
         set_tunits  sets the current temperature unit specification
         calc_peq    calcualte the equilibrium pressure Peq(omega, T)
+        calc_peq_array  calculate Peq(omega, T) for arrays of omega and temperature
+        calc_peq_grid   calculate Peq on a (temperature, branch, omega) grid
+        calc_peq_jacobian   calculate Peq(omega, T) and its analytic omega, T and parameter derivatives
+        calc_omega_eq   calculate the omega in equilibrium with (P, T), inverse of calc_peq
+        calc_t_eq       calculate the temperature in equilibrium with (P, omega), inverse of calc_peq
         calc_rdot   calculate the absorption/desorption rate Note that a positve value is desorption while a negative value is absorption 
+        calc_rdot_array calculate the absorption/desorption rate for arrays of (omega, T, P) states
 
 
     """
@@ -49,60 +62,27 @@ class MetalHydride(object):
         return
 
     def load_data(self,filename,clear = True):
-        self.fileName = filename
-        """Use this function to read MH properties into the dictionary"""
+        """
+        Use this function to read MH properties into the dictionary
 
-        #
-        # clear the dictionary
-        if clear == 'True':
-            self.paramDict.clear()
+        the file is parsed once per process by the paramcache registry, the
+        instance gets its own (mutable) dict copy of the shared record
+        """
+        self.fileName = filename
 
         #
         # filename is the metal hydride name + '.mhd'
         Filename = filename + ".mhd"
-        linenum = 0
+        params = paramcache.get_params(Filename)
 
         #
-        # loop over lines in file
-        #
-        # comment lines start with '#' character
-        #
-        # data lines are of the form [key] = [type] [value]
-        #
-        #   where 
-        #       key is the name of the parameter, e.g. MW for molecular weight
-        #       type is the value type, e.g., float, int, str
-        #       value is the actual value
-        #
-        for line in open(Filename,"r"):
-            # print (line)
-            tokens = line.split()
-            linenum = linenum + 1
-            # print (tokens)
-            #
-            # check to see if there are tokens on the line
-            if len(tokens) > 1:
-                if tokens[0] == "#":
-                    # comment line ignore
-                    # print ('Comment ',line)
-                    pass
-                elif len(tokens) > 2:
-                    if tokens[1] == "=":
-                        # print ('data:   ',line)
-                        # line contains data
-                        if tokens[2].lower() == 'float':
-                           # print (tokens[0], tokens[2], tokens[3])
-                            try:
-                                self.paramDict[tokens[0]] = float(tokens[3])
-                            except:
-                                print ('Error parsing file ',Filename," at line number ",linenum)
-                                sys.exit(2)
-
-
-                        elif tokens[2].lower() == 'int':
-                            self.paramDict[tokens[0]] = int(tokens[3])
-                        else:
-                            self.paramDict[tokens[0]] = tokens[3].strip()
+        # clear the dictionary, or merge into the values already loaded
+        if clear == 'True' or len(self.paramDict) == 0:
+            self.paramDict = dict(params)
+        else:
+            mergedDict = dict(self.paramDict)
+            mergedDict.update(params)
+            self.paramDict = mergedDict
 
         return
 
@@ -124,6 +104,9 @@ class MetalHydride(object):
         self.p = pressure
         return
 
+    def get_p(self):
+        return self.p
+
     def set_punits(self, newPunit):
         self.punits = newPunit
         return
@@ -164,7 +147,7 @@ class MetalHydride(object):
         phi0 = self.paramDict['phi0']
         beta = self.paramDict['beta']
 
-        temp = units.convertT(self.t,self.get_tunits(),'k')
+        temp = units.apply_plan(units.temperature_plan(self.tunits,'k'),self.t)
         omega = self.omega
 
         if absorb == True:
@@ -179,9 +162,384 @@ class MetalHydride(object):
             peq = peq + sign*(beta/2.0)
 
         peq = math.exp(peq)
-        peq = units.convertP(peq,'atm',self.punits)
+
+        if profiling.enabled:
+            profiling.count('calc_peq')
+        peq = units.apply_plan(units.pressure_plan('atm',self.punits),peq)
+
+        return peq
+
+    def calc_peq_array(self, omega, temp, absorb = True):
+        """
+        calc_peq_array is the vectorized form of calc_peq.  omega and temp
+        are broadcast against each other (and against absorb when it is an
+        array) so whole sweeps are evaluated without per-point method calls.
+
+        the omega <= 0 / omega >= 1 points drop the tan and beta/2 terms 
+        exactly as the scalar calc_peq does
+
+        Input:
+            array   omega       omega values
+            array   temp        temperature values in the set temperature units
+            bool    absorb      True if absorption, False if desorption, or a 
+                                boolean array (True = absorption) broadcast
+                                against omega and temp
+
+        Returns:
+            array   peq         equilibrium pressure in the set pressure units
+
+        """
+
+        #
+        # get the parameters from the dictionary
+        A = self.paramDict['A']
+        B = self.paramDict['B']
+        phi = self.paramDict['phi']
+        phi0 = self.paramDict['phi0']
+        beta = self.paramDict['beta']
+
+        omega = np.asarray(omega, dtype=float)
+        temp = units.apply_plan(units.temperature_plan(self.tunits,'k'),np.asarray(temp, dtype=float))
+        sign = np.where(absorb, 1.0, -1.0)
+
+        #
+        # only points with 0 < omega < 1 carry the tan and beta/2 terms,
+        # the others are evaluated at omega = 0.5 and then masked out
+        inside = (omega > 0.0) & (omega < 1.0)
+        omegaIn = np.where(inside, omega, 0.5)
+        shape = (phi + sign*phi0)*np.tan(np.pi*(omegaIn - 0.5)) + sign*(beta/2.0)
+
+        peq = (-A/temp) + B + np.where(inside, shape, 0.0)
+
+        if profiling.enabled:
+            profiling.count('calc_peq_array')
+            profiling.count('calc_peq_points', np.size(peq))
+
+        peq = np.exp(peq)
+        peq = units.apply_plan(units.pressure_plan('atm',self.punits),peq)
 
         return peq
 
+    def calc_peq_grid(self, omega, temp, absorb = (True, False)):
+        """
+        calc_peq_grid will calculate the equilibrium pressure on a full 
+        (temperature, branch, omega) grid.
+
+        the choi and mills form separates into a temperature only term 
+        and an omega only term
+
+        ln(peq) = [-a/t + b] + [(phi(+/-)phi0)*tan(pi*(omega - 0.5)) +/- beta/2]
+
+        so the omega shape is computed once per branch, the temperature term
+        once per isotherm and the two are combined with a broadcast outer
+        sum and a single exp
+
+        Input:
+            array   omega       1d array of omega values
+            array   temp        1d array of temperatures in the set temperature units
+            list    absorb      branches to evaluate, True for absorption and
+                                False for desorption
+
+        Returns:
+            array   peq         (nT, nBranch, nOmega) array of equilibrium
+                                pressure in the set pressure units
+
+        """
+
+        #
+        # get the parameters from the dictionary
+        A = self.paramDict['A']
+        B = self.paramDict['B']
+        phi = self.paramDict['phi']
+        phi0 = self.paramDict['phi0']
+        beta = self.paramDict['beta']
+
+        omega = np.asarray(omega, dtype=float).reshape(-1)
+        temp = units.apply_plan(units.temperature_plan(self.tunits,'k'),np.asarray(temp, dtype=float).reshape(-1))
+        sign = np.where(np.asarray(absorb, dtype=bool).reshape(-1), 1.0, -1.0)[:,np.newaxis]
+
+        #
+        # omega only term, one row per branch
+        inside = (omega > 0.0) & (omega < 1.0)
+        tanTerm = np.tan(np.pi*(np.where(inside, omega, 0.5) - 0.5))
+        shape = (phi + sign*phi0)*tanTerm + sign*(beta/2.0)
+        shape = np.where(inside, shape, 0.0)
+
+        #
+        # temperature only term, one value per isotherm
+        tTerm = (-A/temp) + B
+
+        peq = np.exp(tTerm[:,np.newaxis,np.newaxis] + shape[np.newaxis,:,:])
+
+        if profiling.enabled:
+            profiling.count('calc_peq_grid')
+            profiling.count('calc_peq_points', peq.size)
+        peq = units.apply_plan(units.pressure_plan('atm',self.punits),peq)
+
+        return peq
+
+    def calc_peq_jacobian(self, omega, temp, absorb = True, wrt = None):
+        """
+        calc_peq_jacobian will calculate Peq(omega, T) as calc_peq_array does
+        together with its analytic derivatives, all from the same tan and
+        exp evaluations.  every derivative is Peq times the derivative of
+
+        ln(peq) = -a/t + b + (phi(+/-)phi0)*tan(pi*(omega - 0.5)) +/- beta/2
+
+            d/domega    pi*(phi(+/-)phi0)*(1 + tan^2)
+            d/dT        a/t^2 times dT[k]/dT[set units]
+            d/dA        -1/t
+            d/dB        1
+            d/dphi      tan
+            d/dphi0     +/-tan
+            d/dbeta     +/-1/2
+
+        the omega <= 0 / omega >= 1 points have no tan and beta/2 terms, so
+        their omega, phi, phi0 and beta derivatives are 0
+
+        Input:
+            array   omega       omega values
+            array   temp        temperature values in the set temperature units
+            bool    absorb      True if absorption, False if desorption, or a
+                                boolean array broadcast against omega and temp
+            list    wrt         derivatives to return, any of 'omega', 't', 'A',
+                                'B', 'phi', 'phi0', 'beta', default is all
+
+        Returns:
+            array   peq         equilibrium pressure in the set pressure units
+            dict    jacobian    name -> dPeq/d(name) in the set pressure units
+                                per unit of omega, of the set temperature units
+                                or of the parameter
+
+        """
+
+        if wrt is None:
+            wrt = ['omega', 't', 'A', 'B', 'phi', 'phi0', 'beta']
+
+        #
+        # get the parameters from the dictionary
+        A = self.paramDict['A']
+        B = self.paramDict['B']
+        phi = self.paramDict['phi']
+        phi0 = self.paramDict['phi0']
+        beta = self.paramDict['beta']
+
+        tPlan = units.temperature_plan(self.tunits,'k')
+        omega = np.asarray(omega, dtype=float)
+        temp = units.apply_plan(tPlan,np.asarray(temp, dtype=float))
+        sign = np.where(absorb, 1.0, -1.0)
+
+        inside = (omega > 0.0) & (omega < 1.0)
+        tanTerm = np.where(inside, np.tan(np.pi*(np.where(inside, omega, 0.5) - 0.5)), 0.0)
+        slope = phi + sign*phi0
+
+        peq = np.exp((-A/temp) + B + slope*tanTerm + np.where(inside, sign*(beta/2.0), 0.0))
+        peq = units.apply_plan(units.pressure_plan('atm',self.punits),peq)
+
+        if profiling.enabled:
+            profiling.count('calc_peq_jacobian')
+            profiling.count('calc_peq_points', np.size(peq))
+
+        #
+        # the pressure conversion is a pure scale so d(peq)/dx = peq*d(ln(peq))/dx
+        # in any pressure units
+        jacobian = {}
+        for name in wrt:
+            if name == 'omega':
+                dLnPeq = np.pi*slope*(1.0 + tanTerm*tanTerm)*inside
+            elif name == 't':
+                dLnPeq = tPlan[0]*A/(temp*temp)
+            elif name == 'A':
+                dLnPeq = -1.0/temp
+            elif name == 'B':
+                dLnPeq = 1.0
+            elif name == 'phi':
+                dLnPeq = tanTerm
+            elif name == 'phi0':
+                dLnPeq = sign*tanTerm
+            elif name == 'beta':
+                dLnPeq = np.where(inside, sign/2.0, 0.0)
+            else:
+                raise ValueError('Unknown derivative ' + str(name) + ', use omega, t, A, B, phi, phi0 or beta')
+            jacobian[name] = peq*dLnPeq
+
+        return peq, jacobian
+
+    def calc_omega_eq(self, pressure, temp, absorb = True):
+        """
+        calc_omega_eq will calculate the omega that is in equilibrium with
+        a pressure at a temperature, i.e. the inverse of calc_peq in omega
+
+        the choi and mills form inverts in closed form
+
+        omega = 0.5 + atan((ln(p) + a/t - b -/+ beta/2)/(phi(+/-)phi0))/pi
+
+        the tan term spans all of ln(p), so every finite positive pressure
+        gives an omega strictly inside (0, 1), tending to 0 as p -> 0 and to
+        1 as p -> inf (for phi(+/-)phi0 > 0).  p = 0 gives omega 0 and
+        p = inf gives 1 (ln(p) = -/+inf), a negative pressure gives nan.  the
+        clip to [0, 1] only guards against rounding
+
+        Input:
+            array   pressure    pressure in the set pressure units
+            array   temp        temperature in the set temperature units
+            bool    absorb      True if absorption, False if desorption, or a
+                                boolean array broadcast against pressure and temp
+
+        Returns:
+            array   omega       equilibrium omega
+
+        """
+
+        #
+        # get the parameters from the dictionary
+        A = self.paramDict['A']
+        B = self.paramDict['B']
+        phi = self.paramDict['phi']
+        phi0 = self.paramDict['phi0']
+        beta = self.paramDict['beta']
+
+        pressure = units.apply_plan(units.pressure_plan(self.punits,'atm'),np.asarray(pressure, dtype=float))
+        temp = units.apply_plan(units.temperature_plan(self.tunits,'k'),np.asarray(temp, dtype=float))
+        sign = np.where(absorb, 1.0, -1.0)
+
+        #
+        # p = 0 gives ln(p) = -inf and p < 0 gives nan, both without a warning
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lnP = np.log(pressure)
+
+        x = (lnP - ((-A/temp) + B) - sign*(beta/2.0))/(phi + sign*phi0)
+        omega = 0.5 + np.arctan(x)/np.pi
+
+        return np.clip(omega, 0.0, 1.0)
+
+    def calc_t_eq(self, pressure, omega, absorb = True):
+        """
+        calc_t_eq will calculate the temperature at which a pressure is in
+        equilibrium with omega, i.e. the inverse of calc_peq in temperature
+
+        1/t = (b + (phi(+/-)phi0)*tan(pi*(omega - 0.5)) +/- beta/2 - ln(p))/a
+
+        omega <= 0 / omega >= 1 drop the tan and beta/2 terms as in calc_peq.
+        where no positive temperature gives the pressure the result is nan
+
+        Input:
+            array   pressure    pressure in the set pressure units
+            array   omega       omega values
+            bool    absorb      True if absorption, False if desorption, or a
+                                boolean array broadcast against pressure and omega
+
+        Returns:
+            array   temp        equilibrium temperature in the set temperature units
+
+        """
+
+        #
+        # get the parameters from the dictionary
+        A = self.paramDict['A']
+        B = self.paramDict['B']
+        phi = self.paramDict['phi']
+        phi0 = self.paramDict['phi0']
+        beta = self.paramDict['beta']
+
+        pressure = units.apply_plan(units.pressure_plan(self.punits,'atm'),np.asarray(pressure, dtype=float))
+        omega = np.asarray(omega, dtype=float)
+        sign = np.where(absorb, 1.0, -1.0)
+
+        inside = (omega > 0.0) & (omega < 1.0)
+        omegaIn = np.where(inside, omega, 0.5)
+        shape = (phi + sign*phi0)*np.tan(np.pi*(omegaIn - 0.5)) + sign*(beta/2.0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            denominator = B + np.where(inside, shape, 0.0) - np.log(pressure)
+            temp = np.where(denominator > 0.0, A/denominator, np.nan)
+
+        return units.apply_plan(units.temperature_plan('k',self.tunits),temp)
+
+    def calc_rdot(self):
+        """
+        calc_rdot will calculate the reaction rate domega/dt [1/s] for the 
+        current omega, temperature and pressure.  Note that a positve value 
+        is desorption while a negative value is absorption
+
+        the rate is arrhenius driven, k = dstar*exp(-Eact/(R*T)), with a 
+        pressure driving force relative to the equilibrium pressure
+
+            absorption  p > peq(absorb)     rdot = -k*ln(p/peq)*(1 - omega)
+            desorption  p < peq(desorb)     rdot = k*((peq - p)/peq)*omega
+
+        between the two equilibrium pressures (hysteresis) the rate is zero
+
+        """
+
+        Eact = self.paramDict['Eact']
+        dstar = self.paramDict['dstar']
+
+        temp = units.apply_plan(units.temperature_plan(self.tunits,'k'),self.t)
+        omega = self.omega
+        pressure = self.p
+
+        k = dstar*math.exp(-Eact/(R_GAS*temp))
+
+        peqAbsorb = self.calc_peq()
+        if pressure > peqAbsorb:
+            return -k*math.log(pressure/peqAbsorb)*(1.0 - omega)
+
+        peqDesorb = self.calc_peq(False)
+        if pressure < peqDesorb:
+            return k*((peqDesorb - pressure)/peqDesorb)*omega
+
+        return 0.0
+
+    def calc_rdot_array(self, omega, temp, pressure):
+        """
+        calc_rdot_array is the batched form of calc_rdot, the rate is 
+        evaluated for whole arrays of (omega, T, P) cell states in one call
+        (the arrays are broadcast against each other).  both equilibrium 
+        pressures are formed in log space from one shared tan term
+
+        Input:
+            array   omega       omega values
+            array   temp        temperature in the set temperature units
+            array   pressure    pressure in the set pressure units
+
+        Returns:
+            array   rdot        domega/dt [1/s], positive for desorption
+
+        """
+
+        #
+        # get the parameters from the dictionary
+        A = self.paramDict['A']
+        B = self.paramDict['B']
+        phi = self.paramDict['phi']
+        phi0 = self.paramDict['phi0']
+        beta = self.paramDict['beta']
+        Eact = self.paramDict['Eact']
+        dstar = self.paramDict['dstar']
+
+        omega = np.asarray(omega, dtype=float)
+        temp = units.apply_plan(units.temperature_plan(self.tunits,'k'),np.asarray(temp, dtype=float))
+        pressure = units.apply_plan(units.pressure_plan(self.punits,'atm'),np.asarray(pressure, dtype=float))
+
+        #
+        # ln(peq) for both branches from one tan evaluation
+        inside = (omega > 0.0) & (omega < 1.0)
+        tanTerm = np.where(inside, np.tan(np.pi*(np.where(inside, omega, 0.5) - 0.5)), 0.0)
+        halfBeta = np.where(inside, beta/2.0, 0.0)
+        tTerm = (-A/temp) + B
+        lnPeqAbsorb = tTerm + (phi + phi0)*tanTerm + halfBeta
+        lnPeqDesorb = tTerm + (phi - phi0)*tanTerm - halfBeta
+
+        with np.errstate(divide='ignore'):
+            lnP = np.log(pressure)
+
+        k = dstar*np.exp(-Eact/(R_GAS*temp))
+
+        absorbing = lnP > lnPeqAbsorb
+        desorbing = lnP < lnPeqDesorb
 
+        rdot = np.where(absorbing, -k*(lnP - lnPeqAbsorb)*(1.0 - omega), 0.0)
+        rdot = np.where(desorbing, k*(1.0 - np.exp(lnP - lnPeqDesorb))*omega, rdot)
 
+        return rdot
@@ -0,0 +1,464 @@
+import paramcache
+import screening
+import library
+import profiling
+import multiprocessing
+import numpy as np
+
+
+#
+# choi and mills parameters that can be sampled
+SAMPLED_KEYS = ['A', 'B', 'phi', 'phi0', 'beta']
+
+#
+# sampling distributions, the spread of each parameter is sigma<key>
+#
+#   normal      value + sigma*z
+#   uniform     value + sigma*u, u uniform in (-1, 1)
+#   lognormal   value*exp(sigma*z)
+#   fixed       value
+DISTRIBUTIONS = ('normal', 'uniform', 'lognormal', 'fixed')
+
+#
+# MHRFC window metrics reported by the pair mode, see screening.window_metrics
+METRIC_KEYS = ['omegaLow', 'omegaHigh', 'width', 'forwardRatio', 'returnRatio', 'margin']
+
+
+def parameter_spec(inputDict):
+    """
+    parameter_spec returns {key : (distribution, sigma)} for the sampled
+    parameters of a card, from the distKey (default normal) and sigmaKey
+    (default 0, i.e. fixed) keys
+    """
+
+    spec = {}
+    for key in SAMPLED_KEYS:
+        sigma = float(inputDict.get('sigma' + key, 0.0))
+        dist = inputDict.get('dist' + key, 'normal' if sigma > 0.0 else 'fixed')
+        if dist not in DISTRIBUTIONS:
+            raise ValueError('Unknown distribution ' + str(dist) + ' for ' + key + ', use ' + ', '.join(DISTRIBUTIONS))
+        spec[key] = (dist, sigma)
+
+    return spec
+
+
+def sample_parameters(base, spec, rhoAB, n, rng):
+    """
+    sample_parameters draws n parameter sets around the base parameters
+
+    Input:
+        dict    base        parameter record of the material
+        dict    spec        {key : (distribution, sigma)} see parameter_spec
+        float   rhoAB       correlation of the normal deviates of A and B
+        int     n           number of samples
+        Generator rng       numpy random generator
+
+    Returns:
+        dict    samples     key -> array(n)
+
+    """
+
+    samples = {}
+    deviates = {}
+    for key in SAMPLED_KEYS:
+        dist, sigma = spec[key]
+        if dist in ('normal', 'lognormal'):
+            deviates[key] = rng.standard_normal(n)
+        elif dist == 'uniform':
+            deviates[key] = rng.uniform(-1.0, 1.0, n)
+
+    #
+    # fitted A and B are strongly correlated
+    if rhoAB != 0.0 and spec['A'][0] in ('normal', 'lognormal') and spec['B'][0] in ('normal', 'lognormal'):
+        deviates['B'] = rhoAB*deviates['A'] + np.sqrt(1.0 - rhoAB*rhoAB)*deviates['B']
+
+    for key in SAMPLED_KEYS:
+        dist, sigma = spec[key]
+        value = float(base[key])
+        if dist == 'normal' or dist == 'uniform':
+            samples[key] = value + sigma*deviates[key]
+        elif dist == 'lognormal':
+            samples[key] = value*np.exp(sigma*deviates[key])
+        else:
+            samples[key] = np.full(n, value)
+
+    return samples
+
+
+def sample_library(base, spec, rhoAB, n, rng):
+    """
+    sample_library returns a HydrideLibrary with one 'material' per sample
+    so the samples are evaluated with one broadcast HydrideLibrary.calc_peq
+    """
+
+    samples = library.HydrideLibrary()
+    samples.params = sample_parameters(base, spec, rhoAB, n, rng)
+
+    return samples
+
+
+class BandHistogram(object):
+    """
+    This class accumulates the distribution of a value at many points
+    (omega, T, branch or metrics) over any number of sample chunks in
+    bounded memory.  each point has nBins equal bins between low and high
+    (set from a pilot chunk) plus an underflow and an overflow bin, chunks
+    are binned with one bincount and percentiles are interpolated within
+    the bins, so their resolution is (high - low)/nBins.  nan values are
+    not counted
+
+    Members:
+        bins        (low, high, nBins, logScale) bin range of each point (in
+                    ln(value) when logScale) and number of bins per point
+        counts      (nPoints, nBins + 2) sample counts
+
+    Member Functions:
+        add         bins a (nSamples, nPoints) chunk
+        merge       adds the counts of another histogram with the same bins
+        percentiles values at percentiles q [%] of each point
+
+    """
+
+    def __init__(self, pilot, nBins = 2048, logScale = True, padding = 0.5):
+        """
+        the bins of each point span the pilot chunk (nSamples, nPoints)
+        widened by padding times its spread on either side
+        """
+
+        pilot = _scale(pilot, logScale)
+        with np.errstate(all='ignore'):
+            low = np.nanmin(np.where(np.isfinite(pilot), pilot, np.nan), axis = 0)
+            high = np.nanmax(np.where(np.isfinite(pilot), pilot, np.nan), axis = 0)
+        low = np.nan_to_num(low, nan = 0.0)
+        high = np.nan_to_num(high, nan = 0.0)
+        spread = padding*(high - low) + 1.0e-9*np.maximum(np.abs(low), 1.0)
+
+        self.bins = (low - spread, high + spread, nBins, logScale)
+        self.counts = np.zeros((len(low), nBins + 2), dtype = np.int64)
+
+        return
+
+    def add(self, values):
+        self.counts = self.counts + bin_counts(values, self.bins)
+        return
+
+    def merge(self, counts):
+        self.counts = self.counts + counts
+        return
+
+    def percentiles(self, q):
+        """
+        percentiles returns (len(q), nPoints) values, nan where a point has
+        no samples.  percentiles in the underflow/overflow bins are clamped
+        to low/high
+        """
+
+        low, high, nBins, logScale = self.bins
+        q = np.asarray(q, dtype = float)
+        cumulative = np.cumsum(self.counts, axis = 1)
+        total = cumulative[:,-1]
+
+        target = q[:,np.newaxis]*total[np.newaxis,:]/100.0
+        index = (cumulative[np.newaxis,:,:] < target[:,:,np.newaxis]).sum(axis = -1)
+        index = np.minimum(index, nBins + 1)
+
+        rows = np.arange(len(total))[np.newaxis,:]
+        before = np.where(index > 0, cumulative[rows, np.maximum(index - 1, 0)], 0)
+        inBin = self.counts[rows, index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.clip(np.where(inBin > 0, (target - before)/inBin, 0.0), 0.0, 1.0)
+
+        values = low + (index - 1 + fraction)*(high - low)/nBins
+        values = np.where(index == 0, low, values)
+        values = np.where(index == nBins + 1, high, values)
+        values = np.where(total > 0, values, np.nan)
+
+        if logScale:
+            values = np.exp(values)
+
+        return values
+
+
+def _scale(values, logScale):
+    values = np.asarray(values, dtype = float)
+    if logScale:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.log(values)
+
+    return values
+
+
+def bin_counts(values, bins):
+    """
+    bin_counts returns the (nPoints, nBins + 2) histogram counts of a
+    (nSamples, nPoints) chunk for the bins of a BandHistogram, all points
+    are binned with one bincount
+    """
+
+    low, high, nBins, logScale = bins
+    values = _scale(values, logScale)
+    nPoints = len(low)
+    width = nBins + 2
+
+    position = (values - low)/(high - low)*nBins
+    finite = np.isfinite(position)
+    index = np.clip(np.floor(np.where(finite, position, 0.0)), -1, nBins).astype(np.int64) + 1
+    flat = (index + width*np.arange(nPoints))[finite]
+
+    return np.bincount(flat, minlength = nPoints*width).reshape(nPoints, width)
+
+
+def evaluate_chunk(problem, rng, n):
+    """
+    evaluate_chunk draws n samples and evaluates them, returning
+    (peq (n, nPeqPoints), metrics (n, nMetrics) or None)
+
+    a problem is a picklable description of the run, either
+
+        'isotherms'   Peq of one material on a (T, branch, omega) grid
+        'pair'        the four MHRFC series of a float/fixed pair and the
+                      window metrics of each sample
+    """
+
+    omegaVals = problem['omega']
+    pUnits = problem['pUnits']
+    tUnits = problem['tUnits']
+
+    if problem['mode'] == 'isotherms':
+        samples = sample_library(problem['base'], problem['spec'], problem['rhoAB'], n, rng)
+        peq = samples.calc_peq(omegaVals, problem['temps'], problem['absorb'], pUnits, tUnits)
+
+        return peq.reshape(n, -1), None
+
+    floatSamples = sample_library(problem['floatBase'], problem['spec'], problem['rhoAB'], n, rng)
+    fixedSamples = sample_library(problem['fixedBase'], problem['spec'], problem['rhoAB'], n, rng)
+    floatData = floatSamples.calc_peq(omegaVals, [problem['tHi'], problem['tLow']], [True, False], pUnits, tUnits)
+    fixedData = fixedSamples.calc_peq(omegaVals, [problem['tLow']], [True, False], pUnits, tUnits)
+
+    #
+    # float D at tHi, float A, fixed A and fixed D at tLow
+    series = np.stack((floatData[:,0,1], floatData[:,1,0], fixedData[:,0,0], fixedData[:,0,1]), axis = 1)
+
+    lnForward = np.log(series[:,0]) - np.log(series[:,2])
+    lnReturn = np.log(series[:,3]) - np.log(series[:,1])
+    metrics = screening.window_from_ratios(lnForward, lnReturn, omegaVals)
+
+    return series.reshape(n, -1), np.column_stack([metrics[key] for key in METRIC_KEYS])
+
+
+def chunk_sizes(nSamples, chunkSize):
+    return [min(chunkSize, nSamples - start) for start in range(0, nSamples, chunkSize)]
+
+
+def run_chunks(task):
+    """
+    run_chunks evaluates a group of chunks and returns their summed
+    histogram counts and the number of samples with an MHRFC window.
+    this is the unit of work handed to the process pool
+    """
+
+    problem, seeds, sizes, peqBins, metricBins = task
+
+    peqCounts = 0
+    metricCounts = None
+    feasible = 0
+
+    for seed, n in zip(seeds, sizes):
+        peq, metrics = evaluate_chunk(problem, np.random.default_rng(seed), n)
+        peqCounts = peqCounts + bin_counts(peq, peqBins)
+        if metrics is not None:
+            metricCounts = bin_counts(metrics, metricBins) if metricCounts is None else metricCounts + bin_counts(metrics, metricBins)
+            feasible = feasible + int(np.count_nonzero(metrics[:,METRIC_KEYS.index('width')] > 0.0))
+
+    return peqCounts, metricCounts, feasible
+
+
+def propagate(problem, nSamples, seed = 0, chunkSize = None, nProcs = 1, nBins = 2048, chunkPoints = 2000000):
+    """
+    propagate will sample the problem nSamples times in chunks and return
+    the histograms of the Peq points and of the metrics (pair mode)
+
+    every chunk has its own random stream spawned from one SeedSequence,
+    and the integer histogram counts are summed, so the result depends on
+    seed and chunkSize but not on nProcs or the order the chunks finish in
+
+    Input:
+        dict    problem     see evaluate_chunk
+        int     nSamples    number of samples
+        int     seed        root seed
+        int     chunkSize   samples per chunk, default keeps chunkSize*nPoints near chunkPoints
+        int     nProcs      number of worker processes
+        int     nBins       histogram bins per point
+
+    Returns:
+        BandHistogram   peqBands
+        BandHistogram   metricBands (None for isotherms)
+        int             feasible    samples with an MHRFC window
+
+    """
+
+    if chunkSize is None:
+        nPoints = len(problem['omega'])*(4 if problem['mode'] == 'pair' else len(problem['temps'])*len(problem['absorb']))
+        chunkSize = max(chunkPoints//max(nPoints, 1), 1)
+    chunkSize = max(int(chunkSize), 1)
+
+    sizes = chunk_sizes(nSamples, chunkSize)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    #
+    # the first chunk sets the histogram bins and is counted
+    with profiling.stage('compute') as stage:
+        peq, metrics = evaluate_chunk(problem, np.random.default_rng(seeds[0]), sizes[0])
+        peqBands = BandHistogram(peq, nBins, logScale = True)
+        peqBands.add(peq)
+        metricBands = None
+        feasible = 0
+        if metrics is not None:
+            metricBands = BandHistogram(metrics, nBins, logScale = False)
+            metricBands.add(metrics)
+            feasible = int(np.count_nonzero(metrics[:,METRIC_KEYS.index('width')] > 0.0))
+        stage.add_points(sizes[0])
+
+        #
+        # the remaining chunks in contiguous groups, a few per worker
+        nGroups = max(min(len(sizes) - 1, 4*nProcs), 1)
+        bounds = np.linspace(1, len(sizes), nGroups + 1).astype(int)
+        metricBins = None if metricBands is None else metricBands.bins
+        tasks = [(problem, seeds[bounds[k]:bounds[k + 1]], sizes[bounds[k]:bounds[k + 1]], peqBands.bins, metricBins)
+                 for k in range(nGroups) if bounds[k + 1] > bounds[k]]
+
+        if nProcs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(nProcs)
+            try:
+                results = pool.map(run_chunks, tasks, chunksize = 1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [run_chunks(task) for task in tasks]
+
+        for peqCounts, metricCounts, count in results:
+            peqBands.merge(peqCounts)
+            if metricBands is not None:
+                metricBands.merge(metricCounts)
+            feasible = feasible + count
+        stage.add_points(nSamples - sizes[0])
+
+    if profiling.enabled:
+        profiling.count('mc_samples', nSamples)
+        profiling.count('mc_chunks', len(sizes))
+
+    return peqBands, metricBands, feasible
+
+
+def run_uncertainty(inputDict):
+    """
+    run_uncertainty will propagate the uncertainty of the choi and mills
+    parameters for an uncertainty input card (-u) and write the percentile
+    bands, returns the names of the files written
+
+    with mhydrideName the bands are of Peq on the (T, branch, omega) grid,
+    with mhydrideFloatName/mhydrideFixedName they are of the four MHRFC
+    series plus the window metrics (see screening.window_metrics), both
+    materials are sampled independently with the same spreads
+
+    card keys:
+        mhydrideName        metal hydride name (isotherm bands), or
+        mhydrideFloatName, mhydrideFixedName, tHi, tLow     MHRFC pair
+        pUnits, tUnits      pressure and temperature units
+        omegaStart, omegaEnd, delOmega      omega axis
+        tStart, tEnd, delT  isotherm temperatures
+        plot                branches of the isotherms (A, D or B), default B
+        sigmaA, sigmaB, sigmaphi, sigmaphi0, sigmabeta      spread of each parameter,
+                            default 0 (fixed)
+        distA, distB, distphi, distphi0, distbeta           normal, uniform,
+                            lognormal or fixed, default normal
+        rhoAB               correlation of A and B, default 0
+        nSamples            number of samples
+        seed                random seed, default 0
+        chunkSize           samples per chunk, default bounds the chunk to about 2e6 points
+        nProcs              number of worker processes, default 1
+        nBins               histogram bins per point, default 2048
+        percentiles         comma separated percentiles, default 2.5,50,97.5
+        delimit             column delimiter (space, tab, csv)
+
+    """
+
+    import metalhydride
+
+    pUnits = inputDict['pUnits']
+    tUnits = inputDict['tUnits']
+    omegaVals = metalhydride.make_axis(inputDict['omegaStart'], inputDict['omegaEnd'], inputDict['delOmega'])
+    nSamples = int(inputDict['nSamples'])
+    seed = int(inputDict.get('seed', 0))
+    chunkSize = inputDict.get('chunkSize', None)
+    nProcs = int(inputDict.get('nProcs', 1))
+    nBins = int(inputDict.get('nBins', 2048))
+    percentiles = [float(q) for q in str(inputDict.get('percentiles', '2.5,50,97.5')).split(',')]
+    delimit = inputDict.get('delimit', 'space')
+
+    delimiter = ' '
+    if delimit == 'tab':
+        delimiter = "\t"
+    elif delimit == 'csv':
+        delimiter = ', '
+
+    problem = {'omega' : omegaVals, 'pUnits' : pUnits, 'tUnits' : tUnits,
+               'spec' : parameter_spec(inputDict), 'rhoAB' : float(inputDict.get('rhoAB', 0.0))}
+
+    if 'mhydrideFloatName' in inputDict:
+        mhFloatName = inputDict['mhydrideFloatName']
+        mhFixedName = inputDict['mhydrideFixedName']
+        problem['mode'] = 'pair'
+        problem['floatBase'] = dict(paramcache.get_params(mhFloatName + '.mhd'))
+        problem['fixedBase'] = dict(paramcache.get_params(mhFixedName + '.mhd'))
+        problem['tHi'] = inputDict['tHi']
+        problem['tLow'] = inputDict['tLow']
+        rows = [(inputDict['tHi'], 'D'), (inputDict['tLow'], 'A'), (inputDict['tLow'], 'A'), (inputDict['tLow'], 'D')]
+        baseName = mhFloatName + "-" + mhFixedName
+    else:
+        mhName = inputDict['mhydrideName']
+        branches = metalhydride.branch_list(inputDict.get('plot', 'B'))
+        temps = metalhydride.make_axis(inputDict['tStart'], inputDict['tEnd'], inputDict['delT'])
+        problem['mode'] = 'isotherms'
+        problem['base'] = dict(paramcache.get_params(mhName + '.mhd'))
+        problem['temps'] = temps
+        problem['absorb'] = branches
+        rows = [(temp, metalhydride.BRANCH_LETTERS[absorb]) for temp in temps for absorb in branches]
+        baseName = mhName
+
+    peqBands, metricBands, feasible = propagate(problem, nSamples, seed, chunkSize, nProcs, nBins)
+
+    outputFiles = []
+
+    with profiling.stage('write'):
+        #
+        # bands: T, branch, omega, Peq at each percentile
+        values = peqBands.percentiles(percentiles).reshape(len(percentiles), len(rows), len(omegaVals))
+        outputFileName = baseName + "-mc-data.txt"
+        f = open(outputFileName,'w+')
+        f.write('# ' + str(nSamples) + ' samples, T[' + tUnits + '] branch omega Peq[' + pUnits + '] at percentiles ' +
+                ' '.join([str(q) for q in percentiles]) + "\n")
+        for i in range(len(rows)):
+            temp, branch = rows[i]
+            for j in range(len(omegaVals)):
+                f.write(('{0:6.3e}{1}{2}{1}{3:6.3e}').format(temp,delimiter,branch,omegaVals[j]) +
+                        ''.join([('{0}{1:6.3e}').format(delimiter,values[k,i,j]) for k in range(len(percentiles))]) + "\n")
+        f.close()
+        outputFiles.append(outputFileName)
+
+        if metricBands is not None:
+            #
+            # window metrics: name and value at each percentile, over the samples with a window
+            values = metricBands.percentiles(percentiles)
+            outputFileName = baseName + "-mc-metrics.txt"
+            f = open(outputFileName,'w+')
+            f.write('# ' + str(nSamples) + ' samples, ' + str(feasible) + ' with an MHRFC window, percentiles ' +
+                    ' '.join([str(q) for q in percentiles]) + "\n")
+            for k in range(len(METRIC_KEYS)):
+                f.write(METRIC_KEYS[k] + ''.join([('{0}{1:6.3e}').format(delimiter,values[i,k]) for i in range(len(percentiles))]) + "\n")
+            f.write('feasible' + ('{0}{1:6.3e}').format(delimiter,feasible/float(nSamples)) + "\n")
+            f.close()
+            outputFiles.append(outputFileName)
+
+    return outputFiles
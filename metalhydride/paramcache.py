@@ -0,0 +1,163 @@
+import os
+import collections
+import types
+import profiling
+
+
+class ParseError(ValueError):
+    """
+    ParseError is raised when a line of a parameter file cannot be parsed
+    """
+    pass
+
+
+def parse_param_file(Filename):
+    """
+    parse_param_file will read a parameter file (metal hydride .mhd data or
+    an input card) and return the values in a new dictionary
+
+    comment lines start with '#' character
+
+    data lines are of the form [key] = [type] [value]
+
+      where
+          key is the name of the parameter, e.g. MW for molecular weight
+          type is the value type, e.g., float, int, str
+          value is the actual value
+
+    """
+
+    paramDict = {}
+    linenum = 0
+
+    with open(Filename,"r") as f:
+        for line in f:
+            tokens = line.split()
+            linenum = linenum + 1
+            #
+            # check to see if there are tokens on the line
+            if len(tokens) > 1:
+                if tokens[0] == "#":
+                    # comment line ignore
+                    pass
+                elif len(tokens) > 2:
+                    if tokens[1] == "=":
+                        # line contains data
+                        if len(tokens) < 4:
+                            raise ParseError('Error parsing file ' + str(Filename) + ' at line number ' + str(linenum))
+
+                        if tokens[2].lower() == 'float':
+                            try:
+                                paramDict[tokens[0]] = float(tokens[3])
+                            except ValueError:
+                                raise ParseError('Error parsing file ' + str(Filename) + ' at line number ' + str(linenum))
+
+
+                        elif tokens[2].lower() == 'int':
+                            try:
+                                paramDict[tokens[0]] = int(tokens[3])
+                            except ValueError:
+                                raise ParseError('Error parsing file ' + str(Filename) + ' at line number ' + str(linenum))
+                        else:
+                            paramDict[tokens[0]] = tokens[3].strip()
+
+    return paramDict
+
+
+class ParamCache(object):
+    """
+    This class is a registry of parsed parameter files.  Each file is parsed
+    once and handed out as an immutable parameter record until the file
+    changes on disk (size or modification time) or is invalidated.
+
+    Members:
+        maxSize     maximum number of files held, least recently used are evicted
+        entries     ordered dictionary path -> ((size, mtime), record)
+        hits        number of lookups served from the cache
+        misses      number of lookups that parsed the file
+
+    Member Functions:
+        get         returns the parameter record for a file
+        invalidate  drops one file (or every file) from the cache
+        reload      re-parses a file and returns the new record
+
+    """
+
+    def __init__(self, maxSize = 64):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        return
+
+    def get(self, filename):
+        """
+        get returns the immutable parameter record for filename, parsing
+        the file only if it is not cached or has changed since it was parsed
+        """
+
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        key = (stat.st_size, stat.st_mtime_ns)
+
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == key:
+            self.entries.move_to_end(path)
+            self.hits = self.hits + 1
+            if profiling.enabled:
+                profiling.count('param_cache_hits')
+            return entry[1]
+
+        self.misses = self.misses + 1
+        with profiling.stage('parse'):
+            record = types.MappingProxyType(parse_param_file(path))
+        self.entries[path] = (key, record)
+        self.entries.move_to_end(path)
+
+        #
+        # evict the least recently used files
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last = False)
+
+        return record
+
+    def invalidate(self, filename = None):
+        """
+        invalidate drops filename from the cache, or every file if
+        filename is None
+        """
+
+        if filename is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(os.path.abspath(filename), None)
+
+        return
+
+    def reload(self, filename):
+        """
+        reload re-parses filename and returns the new record
+        """
+
+        self.invalidate(filename)
+
+        return self.get(filename)
+
+
+#
+# process wide registry used by MetalHydride.load_data and load_input_data
+registry = ParamCache()
+
+
+def get_params(filename):
+    return registry.get(filename)
+
+
+def invalidate(filename = None):
+    registry.invalidate(filename)
+    return
+
+
+def reload(filename):
+    return registry.reload(filename)
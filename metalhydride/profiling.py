@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import json
+import atexit
+
+#
+# stage profiling for the metalhydride program
+#
+# the program records wall time, call counts and point counts for each
+# stage (load, compute, write, render) plus plain counters such as the
+# number of calc_peq evaluations.  profiling is switched on with the
+# --profile command line flag or the MH_PROFILE environment variable
+#
+#   MH_PROFILE=1                text report to stderr at exit
+#   MH_PROFILE=report.json      JSON report written to report.json at exit
+#   MH_PROFILE=report.txt       text report written to report.txt at exit
+#
+# when profiling is off stage() hands back a shared do-nothing context
+# and callers guard counters with 'if profiling.enabled' so the cost is
+# one attribute lookup
+
+enabled = False
+reportFile = ''
+stages = {}
+counters = {}
+_registered = False
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        return False
+
+    def add_points(self, points):
+        return
+
+
+class _Stage(object):
+    def __init__(self, name):
+        self.name = name
+        self.points = 0
+
+    def __enter__(self):
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        elapsed = time.perf_counter() - self.startTime
+        record = stages.get(self.name)
+        if record is None:
+            record = {'seconds' : 0.0, 'calls' : 0, 'points' : 0}
+            stages[self.name] = record
+        record['seconds'] = record['seconds'] + elapsed
+        record['calls'] = record['calls'] + 1
+        record['points'] = record['points'] + self.points
+        return False
+
+    def add_points(self, points):
+        self.points = self.points + int(points)
+        return
+
+
+_nullStage = _NullStage()
+
+
+def stage(name):
+    """
+    stage returns a context manager timing one pass through a stage,
+    use add_points on it to record the number of points handled
+    """
+
+    if not enabled:
+        return _nullStage
+
+    return _Stage(name)
+
+
+def count(name, n = 1):
+    """
+    count adds n to a counter, callers check profiling.enabled first
+    """
+
+    counters[name] = counters.get(name, 0) + int(n)
+    return
+
+
+def enable(fileName = ''):
+    """
+    enable switches profiling on and registers the report to be written
+    at exit (to stderr if fileName is empty)
+    """
+
+    global enabled, reportFile, _registered
+
+    enabled = True
+    reportFile = fileName
+    if not _registered:
+        atexit.register(write_report)
+        _registered = True
+
+    return
+
+
+def format_report():
+    lines = ['{0:20s} {1:>12s} {2:>10s} {3:>12s}'.format('stage', 'seconds', 'calls', 'points')]
+    for name in sorted(stages):
+        record = stages[name]
+        lines.append('{0:20s} {1:12.6f} {2:10d} {3:12d}'.format(name, record['seconds'], record['calls'], record['points']))
+
+    if len(counters) > 0:
+        lines.append('')
+        lines.append('{0:20s} {1:>12s}'.format('counter', 'count'))
+        for name in sorted(counters):
+            lines.append('{0:20s} {1:12d}'.format(name, counters[name]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_report():
+    """
+    write_report dumps the stage timings and counters as JSON (report file
+    ending in .json) or as a text table
+    """
+
+    if reportFile.endswith('.json'):
+        f = open(reportFile,'w+')
+        json.dump({'stages' : stages, 'counters' : counters}, f, indent = 2, sort_keys = True)
+        f.close()
+    elif reportFile != '':
+        f = open(reportFile,'w+')
+        f.write(format_report())
+        f.close()
+    else:
+        sys.stderr.write(format_report())
+
+    return
+
+
+#
+# switch on from the environment
+_environment = os.environ.get('MH_PROFILE', '')
+if _environment not in ('', '0'):
+    enable('' if _environment == '1' else _environment)
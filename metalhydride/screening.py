@@ -0,0 +1,161 @@
+import mhydride
+import glob
+import os
+import multiprocessing
+import numpy as np
+
+
+def library_names(libraryDir):
+    """
+    library_names returns the names of every metal hydride (.mhd file)
+    in libraryDir, sorted
+    """
+
+    return sorted([os.path.splitext(os.path.basename(f))[0] for f in glob.glob(os.path.join(libraryDir, '*.mhd'))])
+
+
+def longest_window(mask):
+    """
+    longest_window finds the longest contiguous run of True along the last
+    axis of mask and returns (start index, end index, number of points),
+    vectorized over the leading axes.  rows with no True have 0 points
+    """
+
+    #
+    # running length of the current run of True values
+    count = np.cumsum(mask, axis=-1)
+    resets = np.maximum.accumulate(np.where(mask, 0, count), axis=-1)
+    runLength = count - resets
+
+    points = runLength.max(axis=-1)
+    end = runLength.argmax(axis=-1)
+    start = end - np.maximum(points, 1) + 1
+
+    return start, end, points
+
+
+def window_metrics(floatDesorbHi, floatAbsorbLow, fixedAbsorbLow, fixedDesorbLow, omegaVals):
+    """
+    window_metrics will compute the MHRFC cycle metrics for one float/fixed
+    pair, vectorized over every (tHi, tLow) combination
+
+    the cycle moves hydrogen from the float bed (desorbing at tHi) to the
+    fixed bed (absorbing at tLow) and back from the fixed bed (desorbing at
+    tLow) to the float bed (absorbing at tLow).  the usable omega window is
+    the longest run of omega where both pressure differences drive the flow
+
+    Input:
+        array   floatDesorbHi   (nHi, nOmega) float desorption Peq at each tHi
+        array   floatAbsorbLow  (nLow, nOmega) float absorption Peq at each tLow
+        array   fixedAbsorbLow  (nLow, nOmega) fixed absorption Peq at each tLow
+        array   fixedDesorbLow  (nLow, nOmega) fixed desorption Peq at each tLow
+        array   omegaVals       omega axis
+
+    Returns:
+        dict of (nHi, nLow) arrays
+            omegaLow, omegaHigh     ends of the usable window
+            width                   omegaHigh - omegaLow
+            forwardRatio            minimum float/fixed pressure ratio in the window (tHi leg)
+            returnRatio             minimum fixed/float pressure ratio in the window (tLow leg)
+            margin                  minimum ln pressure ratio of either leg in the window
+
+    """
+
+    lnForward = np.log(floatDesorbHi[:,np.newaxis,:]) - np.log(fixedAbsorbLow[np.newaxis,:,:])
+    lnReturn = np.log(fixedDesorbLow) - np.log(floatAbsorbLow)
+    lnReturn = np.broadcast_to(lnReturn[np.newaxis,:,:], lnForward.shape)
+
+    return window_from_ratios(lnForward, lnReturn, omegaVals)
+
+
+def window_from_ratios(lnForward, lnReturn, omegaVals):
+    """
+    window_from_ratios computes the window_metrics from the ln pressure
+    ratios of the two legs, lnForward and lnReturn have the same shape
+    (..., nOmega) and the metrics are returned with the leading shape
+    """
+
+    usable = (lnForward > 0.0) & (lnReturn > 0.0)
+    start, end, points = longest_window(usable)
+
+    #
+    # restrict the ratios to the window
+    index = np.arange(len(omegaVals))
+    inWindow = (index >= start[...,np.newaxis]) & (index <= end[...,np.newaxis]) & (points[...,np.newaxis] > 0)
+    minForward = np.where(inWindow, lnForward, np.inf).min(axis=-1)
+    minReturn = np.where(inWindow, lnReturn, np.inf).min(axis=-1)
+
+    found = points > 0
+    omegaLow = np.where(found, omegaVals[start], np.nan)
+    omegaHigh = np.where(found, omegaVals[end], np.nan)
+
+    return {'omegaLow' : omegaLow,
+            'omegaHigh' : omegaHigh,
+            'width' : np.where(found, omegaHigh - omegaLow, 0.0),
+            'forwardRatio' : np.where(found, np.exp(minForward), np.nan),
+            'returnRatio' : np.where(found, np.exp(minReturn), np.nan),
+            'margin' : np.where(found, np.minimum(minForward, minReturn), np.nan)}
+
+
+def screen_float(args):
+    """
+    screen_float evaluates one float material against every fixed material
+    and returns the rows of the screening table.  this is the unit of work
+    handed to the process pool
+    """
+
+    floatName, fixedNames, libraryDir, pUnits, tUnits, omegaVals, tHiVals, tLowVals = args
+
+    mhFloat = mhydride.MetalHydride()
+    mhFloat.load_data(os.path.join(libraryDir, floatName))
+    mhFloat.set_punits(pUnits)
+    mhFloat.set_tunits(tUnits)
+
+    floatDesorbHi = mhFloat.calc_peq_grid(omegaVals, tHiVals, [False])[:,0,:]
+    floatAbsorbLow = mhFloat.calc_peq_grid(omegaVals, tLowVals, [True])[:,0,:]
+
+    rows = []
+    for fixedName in fixedNames:
+        mhFixed = mhydride.MetalHydride()
+        mhFixed.load_data(os.path.join(libraryDir, fixedName))
+        mhFixed.set_punits(pUnits)
+        mhFixed.set_tunits(tUnits)
+
+        fixedLow = mhFixed.calc_peq_grid(omegaVals, tLowVals, [True, False])
+        metrics = window_metrics(floatDesorbHi, floatAbsorbLow, fixedLow[:,0,:], fixedLow[:,1,:], omegaVals)
+
+        for i in range(len(tHiVals)):
+            for j in range(len(tLowVals)):
+                row = {'float' : floatName, 'fixed' : fixedName, 'tHi' : tHiVals[i], 'tLow' : tLowVals[j]}
+                for key in metrics:
+                    row[key] = float(metrics[key][i,j])
+                rows.append(row)
+
+    return rows
+
+
+def screen_pairs(names, libraryDir, pUnits, tUnits, omegaVals, tHiVals, tLowVals, nProcs = 1):
+    """
+    screen_pairs evaluates all N x N float/fixed pairs over the tHi and tLow
+    values and returns the rows ranked by window width and then margin
+    """
+
+    tasks = [(floatName, names, libraryDir, pUnits, tUnits, omegaVals, tHiVals, tLowVals) for floatName in names]
+
+    if nProcs > 1:
+        pool = multiprocessing.Pool(nProcs)
+        try:
+            results = pool.map(screen_float, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [screen_float(task) for task in tasks]
+
+    rows = [row for result in results for row in result]
+
+    #
+    # widest window first, ties broken by the larger pressure margin
+    rows.sort(key = lambda row: (-row['width'], -np.nan_to_num(row['margin'], nan=-np.inf)))
+
+    return rows
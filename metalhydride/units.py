@@ -1,102 +1,128 @@
+
+#
+# conversion constants
+ATM_2_PA = 101325.0
+ATM_2_KPA = 101.325
+ATM_2_PSIA = 14.7
+
+DEGC_2_K = 273.15
+DEGF_2_DEGR = 459.67
+DEGC_2_DEGF_OFFSET = 32.0
+K_2_DEGR = 1.8
+
+#
+# pressure units, value[unit] = PRESSURE_FACTORS[unit]*value[atm]
+PRESSURE_FACTORS = {'atm' : 1.0, 'pa' : ATM_2_PA, 'kpa' : ATM_2_KPA, 'psia' : ATM_2_PSIA}
+
+#
+# temperature units, (scale, offset) such that value[unit] = scale*value[degc] + offset
+# degc is used as the common scale so the usual degc <-> k and degc <-> degf
+# plans come out exact
+TEMPERATURE_FACTORS = {'k' : (1.0, DEGC_2_K), 'degc' : (1.0, 0.0), 'degf' : (K_2_DEGR, DEGC_2_DEGF_OFFSET), 'degr' : (K_2_DEGR, DEGC_2_DEGF_OFFSET + DEGF_2_DEGR)}
+
+#
+# table of resolved conversion plans, keyed on (kind, inUnit, outUnit)
+_planTable = {}
+
+
+def pressure_plan(inUnit, outUnit):
+    """
+    pressure_plan resolves a pressure conversion between
+    atm, pa, kpa, psia into an affine (scale, offset) plan
+    the plan is computed once and cached in the plan table
+    """
+
+    key = ('p', inUnit, outUnit)
+    plan = _planTable.get(key)
+    if plan is None:
+        inUnits = inUnit.lower()
+        outUnits = outUnit.lower()
+        if inUnits not in PRESSURE_FACTORS:
+            raise ValueError('In pressure units invalid: ' + str(inUnit))
+        if outUnits not in PRESSURE_FACTORS:
+            raise ValueError('Out pressure units invalid: ' + str(outUnit))
+
+        plan = (PRESSURE_FACTORS[outUnits]/PRESSURE_FACTORS[inUnits], 0.0)
+        _planTable[key] = plan
+
+    return plan
+
+
+def temperature_plan(inUnit, outUnit):
+    """
+    temperature_plan resolves a temperature conversion between
+    k, degc, degf, degr into an affine (scale, offset) plan
+    the plan is computed once and cached in the plan table
+    """
+
+    key = ('t', inUnit, outUnit)
+    plan = _planTable.get(key)
+    if plan is None:
+        inUnits = inUnit.lower()
+        outUnits = outUnit.lower()
+        if inUnits not in TEMPERATURE_FACTORS:
+            raise ValueError('Temperature in units invalid: ' + str(inUnit))
+        if outUnits not in TEMPERATURE_FACTORS:
+            raise ValueError('Temperature out units invalid: ' + str(outUnit))
+
+        inScale, inOffset = TEMPERATURE_FACTORS[inUnits]
+        outScale, outOffset = TEMPERATURE_FACTORS[outUnits]
+
+        #
+        # value[degc] = (value[in] - inOffset)/inScale
+        # value[out] = outScale*value[degc] + outOffset
+        scale = outScale/inScale
+        offset = outOffset - scale*inOffset
+
+        #
+        # k <-> degr have no offset, drop the rounding residue
+        if abs(offset) < 1.0e-9:
+            offset = 0.0
+        plan = (scale, offset)
+        _planTable[key] = plan
+
+    return plan
+
+
+def apply_plan(plan, values):
+    """
+    apply_plan applies a (scale, offset) conversion plan to a scalar
+    or to a whole numpy array in one operation
+    """
+
+    scale, offset = plan
+
+    return values*scale + offset
+
+
 def convertP(pressure, inUnit, outUnit):
     """
     convert pressure units from the following values
     atm, Pa, kPa, psia
+
+    pressure may be a scalar or a numpy array
     """
-    ATM_2_PA = 101325.0
-    ATM_2_KPA = 101.325
-    ATM_2_PSIA = 14.7
-
-    PA_2_PSIA = 14.7/101325
-
-    KPA_2_PA = 1000.0
-    KPA_2_PSIA = 14.7/101.325
-
-    
-    if inUnit in ('atm','pa','kpa','psia'):
-        if inUnit == 'atm':
-            if outUnit == 'pa':
-                pressure = pressure*ATM_2_PA
-            elif outUnit == 'kpa':
-                pressure = pressure*ATM_2KPA
-            elif outUnit == 'psia':
-                pressure = pressure*ATM_2_PSIA
-
-        if inUnit == 'pa':
-            if outUnit == 'atm':
-                pressure = pressure/ATM_2_PA
-            elif outUnit == 'kpa':
-                pressure = pressure/KPA_2_PA
-            elif outUunit == 'psia':
-                pressure = pressure*PA_2_PSIA
-
-        if inUnit == 'kpa':
-            if outUnit == 'atm':
-                pressure = pressure/ATM_2_KPA
-            elif outUnit == 'pa':
-                pressure = pressure*KPA_2_PA
-            elif outUunit == 'psia':
-                pressure = pressure*KPA_2_PSIA
-
-        if inUnit == 'psia':
-            if outUnit == 'atm':
-                pressure = pressure/ATM_2_PSIA
-            elif outUnit == 'kpa':
-                pressure = pressure/KPA_2_PSIA
-            elif outUunit == 'pa':
-                pressure = pressure/PA_2_PSIA
-    else:
-        print ('In pressure units invalid')
-
-    return pressure
+
+    try:
+        plan = pressure_plan(inUnit, outUnit)
+    except ValueError as msg:
+        print (msg)
+        return pressure
+
+    return apply_plan(plan, pressure)
 
 def convertT(temperature, inUnits, outUnits):
     """
     convert temperature units from the following values
     k, degc, degf, degr
-    """
 
-    DEGC_2_K = 273.15
-    DEGF_2_DEGR = 459.67
-    DEGC_2_DEGF_OFFSET = 32.0
-    K_2_DEGR = 1.8
-
-    if inUnits in ('k','degc','degf','degr'):
-        if inUnits == 'k':
-            if outUnits == 'degc':
-                tempertaure = temperature - DEGC_2_K
-            elif outUnits == 'degf':
-                temperature = temperature - DEGC_2_K
-                temperature = K_2_DEGR*temperature + DEGC_2_DEGF_OFFSET
-            elif outUnits == 'degR':
-                temperature = K_2_DEGR*temperature
-        if inUnits == 'degc':
-            if outUnits == 'k':
-                temperature = temperature + DEGC_2_K
-            elif outUnits == 'degf':
-                temperature = K_2_DEGR*temperature + DEGC_2_DEGF_OFFSET
-            elif outUnits == 'degR':
-                temperature = temperature + DEGC_2_K
-                temperature = K_2_DEGR*temperature
-        if inUnits == 'degf':
-            if outUnits == 'k':
-                temperature = (temperature - DEGC_2_DEGF_OFFSET)/K_2_DEGR
-                temperature = temperature + DEGC_2_K
-            elif outUnits == 'degc':
-                temperature = (temperature - DEGC_2_DEGF_OFFSET)/K_2_DEGR
-            elif outUnits == 'degR':
-                temperature = temperature + DEGF_2_DEGR
-        if inUnits == 'degr':
-            if outUnits == 'degc':
-                temperature = temperature -DEGF_2_DEGR
-                tempertaure = (temperature - DEGC_2_DEGF_OFFSET)/K_2_DEGR
-            elif outUnits == 'degf':
-                temperature = temperature - DEGF_2_DEGR
-            elif outUnits == 'k':
-                temperature = temperature/K_2_DEGR
-    else:
-        print ('Temperature in units invalid')
-
-    return temperature
+    temperature may be a scalar or a numpy array
+    """
 
+    try:
+        plan = temperature_plan(inUnits, outUnits)
+    except ValueError as msg:
+        print (msg)
+        return temperature
 
+    return apply_plan(plan, temperature)